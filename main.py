@@ -8,10 +8,131 @@ from src.engine.strategy import strategy
 if __name__ == '__main__':
     from sys import argv
     args = argv[1:]
+    if args and args[0] == 'backtester':
+        args = args[1:]
+
+    # --name=value flags, i.e. --chunk=10080 to stream the timeline in blocks of a week of 1m bars
+    # --shards=4 runs day aligned parts of the range on 4 processes, with the same result as a serial run
+    # --shared reads the klines from shared memory, loaded once for all the backtests running at the same time
+    # --no-cache skips the result cache, --refresh recomputes and overwrites a cached result
+    # --no-checkpoint doesn't save the progress of a backtest or an optimize run to resume it with after a crash
+    options = dict((a[2:].split('=', 1) + [''])[:2] for a in args if a.startswith('--'))
+    args = [a for a in args if not a.startswith('--')]
+
+    if args[:2] == ['cache', 'clear']:
+        from src.utils.result_cache import ResultCache
+        print(f"removed {ResultCache().clear()} cached results")
+        raise SystemExit
+
+    if args[:1] == ['runs']:
+        # runs [metric] --limit=20 --asc --kind=optimize --min-trades=10 ranks the registered runs, runs show <id> prints one
+        from src.utils.run_registry import RunRegistry, report
+        registry = RunRegistry()
+        if args[1:2] == ['show']:
+            import json
+            if len(args) < 3 or not args[2].isdigit():
+                raise SystemExit("usage: python main.py runs show <id>")
+            print(json.dumps(registry.run(int(args[2])), indent = 2))
+        else:
+            print(report(registry.top(args[1] if len(args) > 1 else 'growth', int(options.get('limit', 20)), 'asc' in options,
+                options.get('kind'), int(options['min-trades']) if 'min-trades' in options else None)))
+        raise SystemExit
+
+    if args[:1] == ['golden']:
+        # golden record stores the results of the reference strategies over the fixtures, golden verify
+        # --variants=chunked,sharded --tolerance=1e-9 checks other ways of running them against those
+        from src.engine import golden
+        if args[1:2] == ['record']:
+            for name, recorded in golden.record()['references'].items():
+                print(f"{name}: {recorded['result']}")
+            raise SystemExit
+        if not os.path.exists(golden.GOLDEN):
+            raise SystemExit("no golden results, run: python main.py golden record")
+        failed = 0
+        for name, variant, report in golden.verify(golden.load(), options['variants'].split(',') if options.get('variants') else None,
+                float(options.get('tolerance', 0))):
+            print(f"{name} {variant}: {'ok' if report is None else 'differs'}")
+            if report:
+                print(report)
+                failed += 1
+        raise SystemExit(1 if failed else 0)
+
+    if args[:1] == ['kline-service']:
+        # kline-service --every=60 keeps the kline files loaded in shared memory, kline-service gc cleans up after dead runs
+        from src.utils.kline_shm import KlineService
+        from src.utils.constants import PATH_HIST_KLINES
+        service = KlineService()
+        if args[1:2] == ['gc']:
+            print(f"unlinked {service.gc()} segments")
+        else:
+            try:
+                service.serve('BTCUSD', PATH_HIST_KLINES, every = float(options.get('every', 60)))
+            except KeyboardInterrupt:
+                pass
+        raise SystemExit
 
     load_dotenv()
     symbol = os.getenv("SYMBOL")
     api_key = os.getenv("BYBIT_PUBLIC_TRADE")
     secret = os.getenv("BYBIT_SECRET_TRADE")
 
-    Backtester(api_key = api_key, secret = secret, symbol = symbol, strategy = strategy, args = args)
+    if args[:1] == ['record-orderbook']:
+        # record-orderbook [seconds] --interval=1
+        from src.engine.bybit_rest import BybitRest
+        from src.utils.orderbook_store import OrderBookRecorder
+        from src.utils.constants import PATH_ORDERBOOK
+        recorder = OrderBookRecorder(PATH_ORDERBOOK)
+        recorder.poll(BybitRest(api_key = api_key, secret = secret, symbol = symbol), interval = float(options.get('interval', 1)),
+            duration = float(args[1]) if len(args) > 1 else None)
+        recorder.close()
+        raise SystemExit
+
+    if args[:1] == ['sync-klines']:
+        # sync-klines <start> --every=60 downloads the klines missing since start, then keeps them up to date
+        from src.engine.bybit_rest import BybitRest
+        from src.utils.kline_sync import KlineSync
+        from src.utils.utils import date_to_seconds
+        sync = KlineSync(BybitRest(api_key = api_key, secret = secret, symbol = symbol), symbol or 'BTCUSD')
+        if 'every' in options:
+            sync.start(date_to_seconds(args[1]), every = float(options['every'])).join()
+        else:
+            sync.sync(date_to_seconds(args[1]))
+        raise SystemExit
+
+    if args[:1] == ['resume']:
+        # resume [key] carries on with the last checkpointed run (or the one of key), resume list shows the checkpoints
+        from src.utils.checkpoint import Checkpoints
+        from src.utils.result_cache import engine_version
+        checkpoints = Checkpoints()
+        if args[1:2] == ['list']:
+            for checkpoint in checkpoints.list():
+                run = checkpoint['run']
+                print(f"{checkpoint['key']}: {run['kind']} {' '.join(run['args'])}, saved {time.ctime(checkpoint['saved'])}")
+            raise SystemExit
+        checkpoint = checkpoints.load(args[1] if len(args) > 1 else None)
+        if not checkpoint:
+            raise SystemExit("no checkpoint to resume")
+        if checkpoint['engine'] != engine_version():
+            raise SystemExit(f"{checkpoint['key']}: the engine changed since it was saved, the run has to start over")
+        run = dict(checkpoint['run'])
+        if run.pop('kind') == 'optimize':
+            from src.engine.optimizer import Optimizer
+            Optimizer(api_key = api_key, secret = secret, resume = checkpoint['state'], **run)
+        else:
+            Backtester(api_key = api_key, secret = secret, resume = checkpoint['state'], **run)
+        raise SystemExit
+
+    if args[:1] == ['optimize']:
+        # optimize <start> <end> --configs=27 --eta=3 --min-days=7 --max-drawdown=20 --min-growth=0 --workers=4 --seed=1
+        from src.engine.optimizer import Optimizer
+        number = lambda key, kind: kind(options[key]) if key in options else None
+        Optimizer(api_key = api_key, secret = secret, symbol = symbol, strategy = strategy, args = args[1:],
+            configs = number('configs', int), eta = number('eta', int), min_days = number('min-days', int),
+            max_drawdown = number('max-drawdown', float), min_growth = number('min-growth', float),
+            workers = number('workers', int), seed = number('seed', int), checkpoint = 'no-checkpoint' not in options)
+        raise SystemExit
+
+    Backtester(api_key = api_key, secret = secret, symbol = symbol, strategy = strategy, args = args,
+        chunk = int(options['chunk']) if 'chunk' in options else None,
+        shards = int(options['shards']) if 'shards' in options else None, shared = 'shared' in options,
+        cache = 'no-cache' not in options, refresh = 'refresh' in options, checkpoint = 'no-checkpoint' not in options)
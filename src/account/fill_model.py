@@ -0,0 +1,68 @@
+import numpy as np
+
+class FillModel():
+    """Prices taker fills and decides how much of an entry gets filled
+
+    fill_price: price a market order of `qty` contracts at `price` actually gets
+    fillable: portion (0..1) of an entry of `qty` contracts that fills
+
+    The base model fills everything at the quoted price, as TestAccount always did.
+    """
+
+    def fill_price(self, ts, side, price, qty):
+        return price
+
+    def fillable(self, ts, qty):
+        return 1
+
+class VolumeFillModel(FillModel):
+    """Slippage and partial fills from the Volume, TurnOver and range of the 1m bar the fill happens in
+
+    Slippage follows the square-root impact law: price * k * relative bar range * sqrt(qty / bar volume), where the
+    relative range is (High - Low) over the bar vwap (Volume / TurnOver). It is capped at the bar extreme.
+    An entry fills at most `participation` of the bar volume.
+
+    Everything but the order size is computed for the whole timeline up front, a fill is an array lookup.
+    """
+
+    def __init__(self, times, high, low, close, volume, turnover, impact = 0.1, participation = 0.1):
+        self.times = np.asarray(times, dtype = np.int64)
+        self.high = np.asarray(high, dtype = np.float64)
+        self.low = np.asarray(low, dtype = np.float64)
+
+        volume = np.asarray(volume, dtype = np.float64)
+        turnover = np.asarray(turnover, dtype = np.float64)
+        vwap = np.where(turnover > 0, volume / np.where(turnover > 0, turnover, 1), np.asarray(close, dtype = np.float64))
+
+        self.scale = impact * (self.high - self.low) / vwap / np.sqrt(np.maximum(volume, 1))
+        self.capacity = participation * volume
+
+    @classmethod
+    def from_klines(cls, klines, **params):
+        return cls(klines.index, klines['High'], klines['Low'], klines['Close'], klines['Volume'], klines['TurnOver'], **params)
+
+    def _bar(self, ts):
+        return max(np.searchsorted(self.times, ts, side = 'right') - 1, 0)
+
+    def fill_price(self, ts, side, price, qty):
+        if ts is None or not len(self.times):
+            return price
+        i = self._bar(ts)
+        slip = self.scale[i] * price * np.sqrt(qty)
+        if side == 'long':
+            return float(min(price + slip, max(self.high[i], price)))
+        return float(max(price - slip, min(self.low[i], price)))
+
+    def fillable(self, ts, qty):
+        if ts is None or not len(self.times) or qty <= 0:
+            return 1
+        return float(min(1, self.capacity[self._bar(ts)] / qty))
+
+class DepthFillModel(FillModel):
+    """Market fills walk a recorded order book (OrderBookReplay) from the quoted price"""
+
+    def __init__(self, replay):
+        self.replay = replay
+
+    def fill_price(self, ts, side, price, qty):
+        return price + self.replay.impact(ts, side, qty)
@@ -0,0 +1,58 @@
+import numpy as np
+
+class FundingSchedule():
+    """Funding payments aligned to the 1m execution timeline
+
+    Holds the cumulative funding owed per contract (in XBT) by a long position at every settlement bar of the
+    1m timeline, so the funding of a position held between two timestamps is a pair of searchsorted lookups
+    and a difference.
+    """
+
+    def __init__(self, times = (), fee_per_contract = ()):
+        self.times = np.asarray(times, dtype = np.int64)
+        self.cum = np.cumsum(np.concatenate([[0.0], np.asarray(fee_per_contract, dtype = np.float64)]))
+
+    @classmethod
+    def from_history(cls, index, open_prices, funding, start = None):
+        """
+        :param index: 1m timestamps of the execution timeline
+        :param open_prices: 1m Open prices, used as the mark price at the funding time
+        :param funding: pd.Series of funding rates indexed by settlement timestamp
+        :param start: see settlements
+        :return: FundingSchedule
+        """
+        return cls(*settlements(index, open_prices, funding, start))
+
+    def extend(self, times, fee_per_contract):
+        """Append the settlements of a later block of the timeline"""
+        self.times = np.concatenate([self.times, np.asarray(times, dtype = np.int64)])
+        # continue the running sum in order, so a schedule built block by block matches one built at once
+        tail = np.cumsum(np.concatenate([[self.cum[-1]], np.asarray(fee_per_contract, dtype = np.float64)]))
+        self.cum = np.concatenate([self.cum, tail[1:]])
+
+    def accrued(self, side, size, from_ts, to_ts):
+        """Funding paid (negative) or received (positive) for settlements in (from_ts, to_ts]"""
+        if from_ts is None or to_ts is None:
+            return 0
+        i, j = np.searchsorted(self.times, [from_ts, to_ts], side = 'right')
+        owed = size * float(self.cum[j] - self.cum[i])
+        return -owed if side == 'long' else owed
+
+def settlements(index, open_prices, funding, start = None):
+    """Settlement bars of a 1m timeline and the funding per contract due at each
+
+    A settlement is due at the first bar at or after its time, so one in a gap of the data is paid once the data
+    resumes instead of dropped.
+    :param start: the timeline takes the settlements from here on, from its first bar by default
+    :return: (timestamps, fee per contract)
+    """
+    index = np.asarray(index, dtype = np.int64)
+    if not len(funding) or not len(index):
+        return index[:0], np.zeros(0)
+
+    times = funding.index.to_numpy(dtype = np.int64)
+    rates = np.nan_to_num(funding.to_numpy(dtype = np.float64))
+    due = (times >= (index[0] if start is None else start)) & (times <= index[-1]) & (rates != 0)
+    bars = np.searchsorted(index, times[due])
+    # inverse contracts: a position of `size` USD pays size / price * rate XBT
+    return index[bars], rates[due] / np.asarray(open_prices, dtype = np.float64)[bars]
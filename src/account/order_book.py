@@ -0,0 +1,83 @@
+import heapq
+from collections import Counter
+from bisect import bisect_left, bisect_right, insort
+
+class OrderBook():
+    """Resting orders of a TestAccount, kept sorted by trigger price
+
+    Orders live on one of two sides of the market:
+      below -- hit when the bar Low trades down to the price (long limit, short stop, short take-profit)
+      above -- hit when the bar High trades up to the price (long stop, short limit, long take-profit)
+
+    Both sides are sorted lists of (price, id), so finding the orders a bar triggers is a bisect
+    against High/Low instead of a scan over every order.
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self._below = []
+        self._above = []
+        self._expiry = []
+        self._kinds = Counter()
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self.orders)
+
+    def add(self, order):
+        order_id = self._next_id
+        self._next_id += 1
+
+        order["id"] = order_id
+        self.orders[order_id] = order
+        self._kinds[order["kind"]] += 1
+        insort(self._side(order), (order["price"], order_id))
+        if order.get("expire"):
+            heapq.heappush(self._expiry, (order["expire"], order_id))
+
+        return order_id
+
+    def cancel(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if not order:
+            return None
+
+        self._kinds[order["kind"]] -= 1
+        side = self._side(order)
+        i = bisect_left(side, (order["price"], order_id))
+        del side[i]
+        return order
+
+    def cancel_where(self, predicate):
+        for order_id in [i for i, o in self.orders.items() if predicate(o)]:
+            self.cancel(order_id)
+
+    def has(self, kind):
+        return self._kinds[kind] > 0
+
+    def expire(self, timestamp):
+        # expiry heap is lazy, cancelled or filled orders are simply skipped
+        while self._expiry and self._expiry[0][0] <= timestamp:
+            _, order_id = heapq.heappop(self._expiry)
+            self.cancel(order_id)
+
+    def triggered(self, high, low, open):
+        """Orders whose price was traded through by a bar, in the order the bar reached them
+
+        :param high: bar High
+        :param low: bar Low
+        :param open: bar Open, the nearest resting price to it is assumed to be reached first
+        :return: list of orders
+        """
+        below = self._below[bisect_left(self._below, (low, -1)):]
+        above = self._above[:bisect_right(self._above, (high, float('inf')))]
+
+        hits = [(open - p, i) for p, i in below] + [(p - open, i) for p, i in above]
+        return [self.orders[i] for _, i in sorted(hits)]
+
+    def _side(self, order):
+        return self._below if resting_below(order["side"], order["type"]) else self._above
+
+def resting_below(side, type):
+    """long limits and short stops rest below the market, the opposite rest above it"""
+    return (side == 'long') == (type == 'limit')
@@ -1,6 +1,7 @@
 import logging
 
 from src.account.account import Account
+from src.account.order_book import OrderBook, resting_below
 from src.utils.utils import get_logger, timestamp_to_date, sameday, percent, date_to_seconds
 
 logger = get_logger(logging.getLogger(__name__), 'logs/test-account.log', logging.DEBUG)
@@ -9,41 +10,68 @@ class TestAccount(Account):
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self.orders = OrderBook()
+        self.funding = kwargs.get("funding")
+        # FillModel pricing taker fills and partial entries, fills are taken as quoted without one
+        self.fills = kwargs.get("fills")
+        # list to record the calls that change the balance in, to replay them on another account
+        self.journal = None
 
     def getResult(self):
+        metrics = self.getMetrics()
         return {
-            "trades": len(self.trades),
-            "strikerate": f'{(self.totalwon / len(self.trades) * 100):.2f}%',
+            "trades": metrics["trades"],
+            "strikerate": f'{metrics["strikerate"]:.2f}%',
             "balance": self.balance,
-            "growth": f'{percent(self.startbalance, self.balance):.2f}%',
+            "growth": f'{metrics["growth"]:.2f}%',
             "maxdrawdown": f'{self.maxdrawdown:.2f}%',
             "won": self.totalwon,
             "lost": self.totallost,
             "even": self.totaleven,
         }
 
+    # getResult as plain numbers, for ranking and storing runs
+    def getMetrics(self):
+        return {
+            "trades": len(self.trades),
+            "strikerate": self.totalwon / len(self.trades) * 100 if len(self.trades) else 0,
+            "balance": self.balance,
+            "growth": percent(self.startbalance, self.balance),
+            "maxdrawdown": self.maxdrawdown,
+            "won": self.totalwon,
+            "lost": self.totallost,
+            "even": self.totaleven,
+        }
+
     def get_last_trade(self):
         return self.trades[ len(self.trades) -1 ] if len(self.trades) else None
 
-    #  At given price, closes a portion of the position (1.0 == 100%, 0.5 == 50%) using a market order
+    #  At given price, closes a portion of the position (1.0 == 100%, 0.5 == 50%)
     
-    def takeprofits( self, price, portion, timestamp ):
+    def takeprofits( self, price, portion, timestamp, is_maker = False ):
 
         if not (self.trade and self.trade["size"]):
             return
+
+        if self.journal is not None:
+            self.journal.append(("takeprofits", price, portion, timestamp, is_maker))
         
         #  TODO: round()? for contracts / XBT sizing
-        quantity = self.trade["size"] * portion
+        quantity = min(self.trade["initialsize"] * portion, self.trade["size"])
 
+        self._accrue_funding( timestamp )
         self.trade["size"] -= quantity
 
         pnl = self._calc_pnl_xbt( self.trade["side"], self.trade["entry"], price, quantity )
 
-        pnl -= quantity * self.fees["taker"] * 2
+        if is_maker:
+            pnl += quantity / price * self.fees["maker"]
+        else:
+            pnl -= quantity / price * self.fees["taker"]
         
         self.balance += pnl
 
-        self.trade.takeprofits.append({
+        self.trade["takeprofits"].append({
             "timestamp": timestamp,
             "price": price,
             "portion": portion,
@@ -51,13 +79,49 @@ class TestAccount(Account):
             "profit": pnl
         })
 
+        if self.trade["size"] <= 1e-9 * self.trade["initialsize"]:
+            self._close_position( price, is_maker = is_maker, timestamp = timestamp )
 
-    def open(self, side, price, stop = None, tp = None, risk = 5, is_maker = False, timestamp = None ):
+    #  Rests an entry order in the book. type 'limit' fills at price or better, 'stop' once price is traded through.
+    #  stop, tp, risk, trail and targets are passed on to open() when the order fills.
 
-        self.dailytrades += 1
+    def place_order( self, side, type, price, stop = None, tp = None, risk = 5, trail = None, targets = None, expire = None, timestamp = None ):
+        return self.orders.add({
+            "kind": "entry",
+            "side": side,
+            "type": type,
+            "price": price,
+            "stop": stop,
+            "tp": tp,
+            "risk": risk,
+            "trail": trail,
+            "targets": targets,
+            "expire": expire,
+            "timestamp": timestamp
+        })
+
+    def cancel_order( self, order_id ):
+        return self.orders.cancel(order_id)
+
+    def open(self, side, price, stop = None, tp = None, risk = 5, is_maker = False, timestamp = None, trail = None, targets = None ):
+
+        if self.journal is not None:
+            self.journal.append(("open", side, price, stop, tp, risk, is_maker, timestamp, trail, targets))
+
+        if trail and not stop:
+            stop = price - trail if side == 'long' else price + trail
 
         size = self._size_by_stop_risk( risk, price, stop ) if stop else ( self.balance * ( risk / 100 ) )
-        
+
+        if self.fills:
+            size *= self.fills.fillable( timestamp, size )
+            if not size:
+                logger.info(f"open: no volume to fill {side} at {price}")
+                return
+            if not is_maker:
+                price = self.fills.fill_price( timestamp, side, price, size )
+
+        self.dailytrades += 1
         pnl = 0
 
         if is_maker:
@@ -72,7 +136,11 @@ class TestAccount(Account):
             "tp": tp,
             "risk": risk,
             "size": size,
+            "initialsize": size,
+            "trail": trail,
             "pnl": pnl,
+            "funding": 0,
+            "fundingtimestamp": timestamp,
             "takeprofits": [],
             "opentimestamp": timestamp,
             "closetimestamp": None,
@@ -80,6 +148,16 @@ class TestAccount(Account):
             "meta": { "initialstop": stop }
         }
 
+        #  partial take-profits rest in the book as reduce-only limits on the opposite side
+        for target, portion in targets or []:
+            self.orders.add({
+                "kind": "takeprofit",
+                "side": 'short' if side == 'long' else 'long',
+                "type": 'limit',
+                "price": target,
+                "portion": portion
+            })
+
     def close( self, price, is_maker = True, timestamp = None):
         logger.info(f"close: {price}, is_maker = {is_maker}")
         logger.info(f"close: active trade: {self.trade}")
@@ -91,7 +169,14 @@ class TestAccount(Account):
         self._close_position( price, is_maker = is_maker, timestamp = timestamp, stopped = None )
 
     def _close_position( self, price, is_maker = False, timestamp = None, stopped = False ):
+
+        if self.journal is not None:
+            self.journal.append(("close", price, is_maker, timestamp, self.stopped))
                         
+        self._accrue_funding( timestamp )
+        if self.fills and not is_maker:
+            price = self.fills.fill_price( timestamp, 'short' if self.trade["side"] == 'long' else 'long', price, self.trade["size"] )
+
         self.trade["closetimestamp"] = timestamp
         self.trade["exit"] = price
 
@@ -111,9 +196,12 @@ class TestAccount(Account):
         #         pnl -= self.trade["size"] / self.trade["entry"] * self.fees["taker"]
         #         pnl += self.trade["size"] / self.trade["entry"] * self.fees["maker"]
 
-        startbal = self.balance
+        # partial take-profits were already booked to the balance, count them towards this trade
+        partial = sum(t["profit"] for t in self.trade["takeprofits"])
+        startbal = self.balance - partial
 
         self.balance += pnl
+        pnl += partial
 
         self.closed = True        
         self.won = pnl > 0
@@ -144,17 +232,59 @@ class TestAccount(Account):
         self.trades.append( self.trade )
 
         self.trade = None
+        self.orders.cancel_where(lambda o: o["kind"] == "takeprofit")
+
+    #  Books funding settled since the last accrual on the current size, into the trade pnl
+
+    def _accrue_funding( self, timestamp ):
+        if self.funding is None:
+            return
+
+        fee = self.funding.accrued( self.trade["side"], self.trade["size"], self.trade["fundingtimestamp"], timestamp )
+        self.trade["funding"] += fee
+        self.trade["pnl"] += fee
+        self.trade["fundingtimestamp"] = timestamp
 
     def tightenstop( self, price ):
 
-        if self.trade and self.trade["side"] == 'long':
-            self.trade["stop"] = max( self.trade["stop"], price )
-        elif self.trade and self.trade["side"] == 'short':
-            self.trade["stop"] = min( self.trade["stop"], price )
+        if not self.trade:
+            return
+        stop = self.trade["stop"]
+        if self.trade["side"] == 'long':
+            self.trade["stop"] = max( stop, price )
+        elif self.trade["side"] == 'short':
+            self.trade["stop"] = min( stop, price )
+
+        if self.journal is not None and self.trade["stop"] != stop:
+            self.journal.append(("stop", self.trade["stop"]))
             
-    #  Check for stop outs etc.
-    def update( self, timestamp, kline ):
-        
+    #  Redo journaled calls of another account, on this account's balance
+
+    def replay( self, journal ):
+        for call in journal:
+            if call[0] == "open":
+                self.open(*call[1:])
+            elif call[0] == "takeprofits":
+                self.takeprofits(*call[1:])
+            elif call[0] == "stop" and self.trade:
+                self.trade["stop"] = call[1]
+            elif call[0] == "close" and self.trade:
+                #  a close journaled inside takeprofits already happened when that was replayed
+                self.stopped = call[4]
+                self._close_position(call[1], is_maker = call[2], timestamp = call[3])
+
+    #  State to carry on from after a restart, see Checkpoints. Fill models are rebuilt from the klines.
+
+    def checkpoint( self ):
+        return {k: v for k, v in vars(self).items() if k not in ("fills", "journal")}
+
+    def restore( self, state ):
+        self.__dict__.update(state)
+
+    #  Bars up to timestamp that neither fill nor exit anything, what update() would have done on them
+
+    def skip( self, timestamp ):
+
         #  Test if self is new day to reset intraday statistics
         if self.lastbardate:
             if  not sameday( self.lastbardate, timestamp ):
@@ -170,7 +300,17 @@ class TestAccount(Account):
         self.lost = False
         self.won = False
         self.even = False
+
+    #  Check for stop outs etc.
+    def update( self, timestamp, kline ):
+        
+        self.skip( timestamp )
             
+        if self.orders:
+            self.orders.expire(timestamp)
+            if not self.trade:
+                self._fill_entries(timestamp, kline)
+
         if not self.trade:
             return
         
@@ -179,14 +319,55 @@ class TestAccount(Account):
                 logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: close LONG at SL")
                 self.stopped = True
                 self._close_position( self.trade["stop"], is_maker = False, timestamp = timestamp )
-            elif float(kline["High"]) >= self.trade["tp"]:
-                logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: close LONG at TP")
-                self._close_position( self.trade["tp"], is_maker = True, timestamp = timestamp )
+            else:
+                self._fill_targets(timestamp, kline)
+                if self.trade and self.trade["tp"] and float(kline["High"]) >= self.trade["tp"]:
+                    logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: close LONG at TP")
+                    self._close_position( self.trade["tp"], is_maker = True, timestamp = timestamp )
         elif self.trade["side"] == 'short':
             if float(kline["High"]) >= self.trade["stop"]:
                 logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: close SHORT at SL")
                 self.stopped = True
                 self._close_position( self.trade["stop"], is_maker = False, timestamp = timestamp )
-            elif float(kline["Low"]) <= self.trade["tp"]:
-                logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: close SHORT at TP")
-                self._close_position( self.trade["tp"], is_maker = True, timestamp = timestamp )
+            else:
+                self._fill_targets(timestamp, kline)
+                if self.trade and self.trade["tp"] and float(kline["Low"]) <= self.trade["tp"]:
+                    logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: close SHORT at TP")
+                    self._close_position( self.trade["tp"], is_maker = True, timestamp = timestamp )
+
+        #  trail after the exits were checked, the stop only moves on what this bar already traded
+        if self.trade and self.trade["trail"]:
+            if self.trade["side"] == 'long':
+                self.tightenstop( float(kline["High"]) - self.trade["trail"] )
+            else:
+                self.tightenstop( float(kline["Low"]) + self.trade["trail"] )
+
+    def _fill_price( self, order, kline ):
+        #  a bar that gaps through the order fills it at the open
+        if resting_below(order["side"], order["type"]):
+            return min(order["price"], float(kline["Open"]))
+        return max(order["price"], float(kline["Open"]))
+
+    def _fill_entries( self, timestamp, kline ):
+        for order in self.orders.triggered(float(kline["High"]), float(kline["Low"]), float(kline["Open"])):
+            if order["kind"] != "entry":
+                continue
+
+            price = self._fill_price(order, kline)
+            self.open(order["side"], price, order["stop"], order["tp"], order["risk"], is_maker = order["type"] == 'limit',
+                timestamp = timestamp, trail = order["trail"], targets = order["targets"])
+            # without the volume to fill against, the order rests until the next bar
+            if self.trade:
+                self.orders.cancel(order["id"])
+                logger.info(f"{timestamp_to_date(timestamp).strftime('%Y-%m-%d %H:%M:%S.%d')}: {order['type']} {order['side'].upper()} filled at {price}")
+            return
+
+    def _fill_targets( self, timestamp, kline ):
+        for order in self.orders.triggered(float(kline["High"]), float(kline["Low"]), float(kline["Open"])):
+            if order["kind"] != "takeprofit":
+                continue
+
+            self.orders.cancel(order["id"])
+            self.takeprofits( self._fill_price(order, kline), order["portion"], timestamp, is_maker = True )
+            if not self.trade:
+                return
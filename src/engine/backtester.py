@@ -1,19 +1,50 @@
 import os
+import numpy as np
 import pandas as pd
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 
-from src.utils.constants import PATH_HIST_KLINES
+from src.utils.constants import PATH_HIST_KLINES, PATH_HIST_FUNDING, FUNDING_INTERVAL
 from src.account.test_account import TestAccount
+from src.account.funding import FundingSchedule, settlements
+from src.account.fill_model import VolumeFillModel, DepthFillModel
 from src.utils.chart import Chart
 from src.engine.engine import Engine
+from src.engine.plan import LONG, SHORT
 from src.engine.bybit_rest import BybitRest
+from src.utils.bars import build_bars, lookback
+from src.utils.kline_store import KLINE_COLUMNS, KlineWindow, read_bounds, read_klines, kline_dates, range_fingerprint
+from src.utils.kline_shm import KlineService
+from src.utils.kline_sync import KlineSync
+from src.utils.result_cache import ResultCache
+from src.utils.checkpoint import Checkpoints
+from src.utils.run_registry import RunRegistry
+from src.utils.orderbook_store import OrderBookReplay
+from src.utils.range_index import RangeIndex
 from src.utils.utils import get_logger, interval_bybit_notation, date_to_seconds
 
 logger = get_logger(logging.getLogger(__name__), 'logs/backtester.log', logging.DEBUG)
 
+class Bar(dict):
+    """A row of the table as process_kline reads it, the columns by name and the timestamp as name"""
+
+    def __init__(self, name, items):
+        super().__init__(items)
+        self.name = name
+
 class Backtester(Engine):
+    # kline file per interval
+    paths = PATH_HIST_KLINES
+    # funding rate file
+    funding_path = PATH_HIST_FUNDING
+    # KlineService to attach to the klines in shared memory through, None reads the files
+    shared = None
+    # Checkpoints to save the progress of the run to, None doesn't
+    checkpoints = None
+    # state of a checkpoint to carry on from, None starts at start_ts
+    resume = None
+
     def __init__(self, *args, **kwargs):
         super().__init__(strategy =  kwargs.get('strategy'), symbol = kwargs.get('symbol'))
 
@@ -25,56 +56,275 @@ class Backtester(Engine):
         self.start_ts = date_to_seconds(kwargs.get('args')[0])
         self.end_ts = date_to_seconds(kwargs.get('args')[1])
 
+        # bars of 1m per block in chunked mode, None runs the whole range in memory
+        self.chunk = kwargs.get('chunk')
+        # worker processes to run day aligned shards of the range on, None runs it serially
+        self.shards = kwargs.get('shards')
+        if kwargs.get('shared'):
+            self.shared = KlineService()
+
+        self.cache = ResultCache() if kwargs.get('cache', True) else None
+        self.registry = RunRegistry() if kwargs.get('registry', True) else None
+        # the arguments to start this run again with from a checkpoint, see main.py resume
+        self.description = {"kind": "backtest", "strategy": self.strategy, "symbol": self.symbol, "args": kwargs.get('args'),
+            "chunk": self.chunk, "shared": bool(kwargs.get('shared')), "cache": kwargs.get('cache', True), "refresh": bool(kwargs.get('refresh'))}
+        if kwargs.get('checkpoint', True) and not self.shards:
+            self.checkpoints = Checkpoints()
+        self.resume = kwargs.get('resume')
+
         #setup account
         self.account = TestAccount(startbalance = 1)
+        self.depth = OrderBookReplay(self.plan.orderbook) if self.plan.orderbook else None
 
+        # an unchanged strategy over unchanged data was already run, skip the pipeline and the chart
+        key, params = self._cache_key() if self.cache and not kwargs.get('refresh') else (None, None)
+        cached = self.cache.get(key) if key else None
+        if cached:
+            self.result = cached
+            # the run is already in the registry from when it was computed, recording it again would duplicate it
+            self._restore_result(cached)
+            logger.info(f"cached {key}: {cached['result']}")
+            print(f"cached: {cached['result']}")
+            return
+
+        if self.chunk:
+            self.run_chunked()
+        else:
+            self.run()
+        if self.checkpoints:
+            self.checkpoints.remove(self.description)
+
+        self.result = {
+            "result": self.account.getResult(),
+            "metrics": self.account.getMetrics(),
+            "trades": self.account.trades
+        }
+        key, params = self._cache_key() if self.cache or self.registry else (None, None)
+        if self.cache and key:
+            self.cache.put(key, params, **self.result)
+        self._record(params)
+
+        logger.info(self.account.getResult())
+        print(self.account.getResult())
+
+        chart = Chart(account = self.account, risk = self.risk)
+
+    def _restore_result(self, cached):
+        """The account as the cached run left it, for callers reading it instead of self.result"""
+        account, metrics = self.account, cached['metrics']
+        account.trades = cached['trades']
+        account.balance, account.maxdrawdown = metrics['balance'], metrics['maxdrawdown']
+        account.totalwon, account.totallost, account.totaleven = metrics['won'], metrics['lost'], metrics['even']
+
+    def _record(self, params):
+        if self.registry:
+            self.registry.record([{
+                "strategy": self.strategy,
+                "symbol": self.symbol,
+                "start": self.start_ts,
+                "end": self.end_ts,
+                "fingerprint": params["data"] if params else None,
+                "metrics": self.result["metrics"],
+                "trades": self.account.trades
+            }])
+
+    def run(self):
         #aggregate klines
         tic = time.perf_counter()
         kline_dict = self.aggregate_local_and_hist_klines('BTCUSD', ['1h', '15m', '1m'])
-
-        # constructing working set
-        self.klines['1m'] = kline_dict['1m'].loc[[x for x in range(self.start_ts, self.end_ts, 60)]]
-        self.klines['15m'] = kline_dict['15m'].loc[[x for x in range(self.start_ts, self.end_ts, 900)]]
-        self.klines['1h'] = kline_dict['1h'].loc[[x for x in range(self.start_ts, self.end_ts, 3600)]]
+        self._working_set(kline_dict, self.start_ts, self.end_ts)
+        if self.shared:
+            # the working set is a copy, the history can go
+            kline_dict = None
+            self.shared.close()
 
         toc = time.perf_counter()
         print(f"aggregate klines: {toc-tic:.4f}")
 
         tic = time.perf_counter()
-        table = self._get_indis()
+        table = self._table()
         toc = time.perf_counter()
         print(f"join indis: {toc-tic:.4f}")
 
+        if self.plan.funding:
+            funding = self.aggregate_local_and_hist_funding('BTCUSD')
+            self.account.funding = FundingSchedule.from_history(table.index, table['Open'], funding, self.start_ts)
+        self.account.fills = self._fill_model(table)
+
         #go for it
         tic = time.perf_counter()
-        self.execute_strategy(table)
+        if self.shards:
+            self.execute_sharded(table)
+        elif self.checkpoints:
+            self.execute_checkpointed(table)
+        else:
+            self.execute_strategy(table)
         toc = time.perf_counter()
         print(f"execute: {toc-tic:.4f}")
-        logger.info(self.account.getResult())
-        print(self.account.getResult())
 
-        chart = Chart(account = self.account, risk = self.risk)
+    def execute_checkpointed(self, table):
+        """execute_strategy a day of bars at a time, saving a checkpoint in between when one is due"""
+        if self.resume:
+            self._restore(self.resume)
+            table = table[table.index >= self.resume['next']]
+        for begin in range(0, len(table.index), 1440):
+            self.execute_strategy(table.iloc[begin:begin + 1440])
+            if begin + 1440 < len(table.index) and self.checkpoints.due():
+                self._checkpoint(table.index[begin + 1440])
+
+    def _checkpoint(self, next_ts):
+        """Save the state after the bars before next_ts"""
+        self.checkpoints.save(self.description, {"next": int(next_ts), "account": self.account.checkpoint(), "daily_open": self.daily_open})
+
+    def _restore(self, state):
+        self.account.restore(state['account'])
+        self.daily_open = state['daily_open']
+        logger.info(f"resumed at {state['next']}: balance {self.account.balance}, {len(self.account.trades)} trades")
+
+    def _working_set(self, kline_dict, start_ts, end_ts):
+        # constructing working set, from the look-back before start_ts or the first bar there is
+        self.start_ts = start_ts
+        for interval, begin in self._history(start_ts).items():
+            klines = kline_dict[interval]
+            begin = max(begin, klines.index[0]) if len(klines.index) else begin
+            # a label range, a bar missing from the data leaves a hole instead of failing the run
+            self.klines[interval] = klines.loc[begin:end_ts - 1].copy()
+        for klines in self.klines.values():
+            # klines in shared memory come without dates
+            if 'Date' not in klines:
+                klines['Date'] = kline_dates(klines.index)
+        for interval in self.bars:
+            self.bars[interval] = self._bar_window(interval, self.klines['1m'], start_ts)
+
+    def _bar_window(self, interval, klines, lower):
+        """Bars of bars.py built from 1m klines of whole days, from the warmup bars before the last one closed by lower on"""
+        bars = build_bars(klines, interval)
+        first = int(np.searchsorted(bars['Closed'].to_numpy(), lower, side = 'right')) - self._warmup_bars().get(interval, 0)
+        return bars.iloc[max(first, 0):]
+
+    def _history(self, start_ts):
+        history = super()._history(start_ts)
+        if self.bars:
+            # the bars of bars.py are built from whole days of 1m klines, as many as their warmup takes
+            warmup = self._warmup_bars()
+            history['1m'] = min(history['1m'], lookback(self._read_1m, start_ts, {i: warmup.get(i, 0) for i in self.bars}))
+        return history
+
+    def _read_1m(self, begin, end):
+        # nothing synced yet the first time around
+        if not os.path.exists(self.paths['1m']):
+            return pd.DataFrame(columns = KLINE_COLUMNS)
+        return read_klines(self.paths['1m'], begin, end)
+
+    def _table(self):
+        """Indicators over the working set, trimmed to the bars from start_ts on"""
+        table = self._get_indis()
+        return table[table.index >= self.start_ts]
+
+    def run_chunked(self):
+        """Stream the timeline from the kline files in blocks of `self.chunk` 1m bars
+
+        Each block gets its higher timeframe klines plus enough earlier bars for the indicators to warm up.
+        The account, the pending orders and the running daily open carry over from block to block, so the
+        result matches run() while memory is bounded by the block size instead of the date range.
+        """
+        tic = time.perf_counter()
+        self.sync_hist_klines('BTCUSD', list(self.klines))
+
+        funding = None
+        if self.plan.funding:
+            funding = self.aggregate_local_and_hist_funding('BTCUSD')
+            self.account.funding = FundingSchedule()
+
+        warmup = self._warmup_bars()
+        history = self._history(self.start_ts)
+
+        def begin(interval, lower):
+            if interval == '1m':
+                return lower if lower > self.start_ts else history[interval]
+            # one extra bar so the higher timeframe bar the block opens in is included
+            return max(history[interval], lower - (warmup.get(interval, 0) + 1) * interval_bybit_notation(interval) * 60)
+
+        first = self.start_ts
+        if self.resume:
+            self._restore(self.resume)
+            first = self.resume['next']
+        windows = {interval: KlineWindow(self.paths[interval], begin(interval, first), self.end_ts) for interval in self.klines}
+        # the days of 1m klines the bars of each block are built from
+        warmups = {interval: warmup.get(interval, 0) for interval in self.bars}
+        days = KlineWindow(self.paths['1m'], lookback(self._read_1m, first, warmups), self.end_ts) if self.bars else None
+
+        step = self.chunk * 60
+        for lower in range(first, self.end_ts, step):
+            upper = min(lower + step, self.end_ts)
+            for interval, window in windows.items():
+                self.klines[interval] = window.advance(begin(interval, lower), upper).copy()
+            if days:
+                klines = days.advance(lookback(self._read_1m, lower, warmups), upper)
+                for interval in self.bars:
+                    self.bars[interval] = self._bar_window(interval, klines, lower)
+
+            table = self._table()
+            if funding is not None:
+                self.account.funding.extend(*settlements(table.index, table['Open'], funding, lower))
+            self.account.fills = self._fill_model(table)
+
+            self.execute_strategy(table)
+            logger.debug(f"chunk {lower} - {upper}: {len(table.index)} bars, balance {self.account.balance}")
+            if self.checkpoints and upper < self.end_ts and self.checkpoints.due():
+                self._checkpoint(upper)
+
+        toc = time.perf_counter()
+        print(f"execute chunked: {toc-tic:.4f}")
+
+    def _fill_model(self, table):
+        fills = self.plan.fills
+        if fills.get('model') == 'volume':
+            return VolumeFillModel.from_klines(table, impact = fills.get('impact', 0.1), participation = fills.get('participation', 0.1))
+        if self.depth:
+            return DepthFillModel(self.depth)
+        return None
+
+    def _cache_key(self):
+        """Cache key of this run, or (None, None) while the local data doesn't cover the range yet"""
+        files = []
+        for interval in self.klines:
+            # the files the run reads, the shared memory service loads them too
+            bounds = read_bounds(self.paths[interval])
+            if not bounds or bounds[0] > self.start_ts or bounds[1] < self.end_ts - interval_bybit_notation(interval) * 60:
+                return None, None
+            files.append(self.paths[interval])
+
+        if self.plan.funding:
+            bounds = read_bounds(self.funding_path)
+            if not bounds or bounds[0] > self.start_ts or bounds[1] < self.end_ts - FUNDING_INTERVAL:
+                return None, None
+            files.append(self.funding_path)
+
+        # the look-back decides the result as much as the range itself
+        begin = min(self._history(self.start_ts).values())
+        fingerprint = range_fingerprint(files, begin, self.end_ts)
+        return ResultCache.key(self.strategy, self.symbol, self.start_ts, self.end_ts, fingerprint)
 
     def process_kline(self, row, signals):
         try:
             if self._check_risk_management():
-                if self._check_time(row):
-                    signal = self._check_signal(row, signals)
-
-                    if signal == "long":
-                        atr = row['atr']
-                        sl = round(row['Open'] - 1 * atr, 2)
-                        tp = round(row['Open'] + 0.95 * atr, 2)
-                        logger.info(f"{row['Date']}: LONG {row['Open']} SL {sl} TP {tp}")
-                        logger.info(row)
-                        self.account.open('long', row['Open'], sl, tp, self.risk, row.name)
-                    if signal == "short":
-                        atr = row['atr']
-                        sl = round(row['Open'] + 1 * atr, 2)
-                        tp = round(row['Open'] - 0.95 * atr, 2)
-                        logger.info(f"{row['Date']}: SHORT {row['Open']} SL {sl} TP {tp}")
-                        logger.info(row)
-                        self.account.open('short', row['Open'], sl, tp, self.risk, row.name)
+                signal = self._check_signal(row, signals)
+
+                if signal == "long":
+                    atr = row['atr']
+                    sl = round(row['Open'] - self.plan.sl_atr * atr, 2)
+                    tp = round(row['Open'] + self.plan.tp_atr * atr, 2)
+                    logger.info(f"{row['Date']}: LONG {row['Open']} SL {sl} TP {tp}")
+                    logger.info(row)
+                    self._enter('long', row, sl, tp)
+                if signal == "short":
+                    atr = row['atr']
+                    sl = round(row['Open'] + self.plan.sl_atr * atr, 2)
+                    tp = round(row['Open'] - self.plan.tp_atr * atr, 2)
+                    logger.info(f"{row['Date']}: SHORT {row['Open']} SL {sl} TP {tp}")
+                    logger.info(row)
+                    self._enter('short', row, sl, tp)
 
             # update account
             self.account.update(row.name, row)
@@ -83,8 +333,77 @@ class Backtester(Engine):
             traceback.print_exc()
             logger.error(f"error at {row.name}: {e} ")
 
+    def _enter(self, side, row, sl, tp):
+        entry = self.plan.entry
+        atr = row['atr']
+        sign = 1 if side == 'long' else -1
+
+        trail = round(self.plan.trail_atr * atr, 2) if self.plan.trail_atr else None
+        targets = [(round(row['Open'] + sign * m * atr, 2), portion) for m, portion in self.plan.targets] or None
+
+        if entry == 'market':
+            self.account.open(side, row['Open'], sl, tp, self.risk, timestamp = row.name, trail = trail, targets = targets)
+            return
+
+        # limits rest on the near side of the open, stops on the far side
+        offset = self.plan.entry_atr * atr
+        price = round(row['Open'] - sign * offset, 2) if entry == 'limit' else round(row['Open'] + sign * offset, 2)
+        shift = price - row['Open']
+        expire = row.name + self.plan.entry_expire * 60 if self.plan.entry_expire else None
+        self.account.place_order(side, entry, price, round(sl + shift, 2), round(tp + shift, 2), self.risk,
+            trail = trail, targets = [(round(t + shift, 2), p) for t, p in targets] if targets else None, expire = expire, timestamp = row.name)
+
     def execute_strategy(self, table):
-        table.apply(self.process_kline, axis = 1, signals = self.signals)
+        """Process the bars of table, jumping over the ones that can't change anything
+
+        Flat without orders, only a bar with an entry signal can. With a trade open whose only exits are its stop and
+        take profit, only the first bar reaching either, found on a RangeIndex of the table. A trailing stop, partial
+        targets or resting orders are stepped through bar by bar.
+        """
+        if not len(table.index):
+            return
+        index = RangeIndex(table['High'].to_numpy(), table['Low'].to_numpy())
+        entries = np.flatnonzero(table[LONG].to_numpy() | table[SHORT].to_numpy())
+        timestamps = table.index.to_numpy()
+        # a row out of the array costs a fraction of table.iloc[position]
+        columns, values = list(table.columns), table.to_numpy(dtype = object)
+
+        position = 0
+        while position < len(index):
+            self.process_kline(Bar(table.index[position], zip(columns, values[position])), self.signals)
+            position += 1
+            following = self._next_bar(index, entries, timestamps, position)
+            if following > position:
+                self.account.skip(table.index[following - 1])
+                position = following
+
+    def _next_bar(self, index, entries, timestamps, position):
+        """First bar from position on that can open, fill or close anything, position itself unless that is known"""
+        account = self.account
+        if account.orders:
+            return position
+        trade = account.trade
+        if trade is None:
+            if not self._check_risk_management():
+                # today's counters block entries up to the first bar of the next day, whose update resets them
+                dt = datetime.fromtimestamp(account.lastbardate)
+                tomorrow = (datetime(dt.year, dt.month, dt.day) + timedelta(days = 1)).timestamp()
+                position = max(position, int(np.searchsorted(timestamps, tomorrow)) + 1)
+            following = np.searchsorted(entries, position)
+            return int(entries[following]) if following < len(entries) else len(index)
+        if trade["trail"]:
+            return position
+
+        if trade["side"] == 'long':
+            following = index.first_below(position, trade["stop"])
+            return min(following, index.first_above(position, trade["tp"])) if trade["tp"] else following
+        following = index.first_above(position, trade["stop"])
+        return min(following, index.first_below(position, trade["tp"])) if trade["tp"] else following
+
+    def execute_sharded(self, table):
+        # sharded imports this module for the strategy code the shards run
+        from src.engine.sharded import execute_sharded
+        execute_sharded(self, table, self.shards)
 
 
     def aggregate_local_and_hist_klines(self, symbol, intervals):
@@ -93,43 +412,56 @@ class Backtester(Engine):
         :type symbol: str
         :param intervals: array of Bybit Kline intervals -- 1 3 5 15 30 60 120 240 360 720 "D" "M" "W" "Y"
         :type intervals: []
-        :return: dict of pandas Dataframes, containing OHLCV values
+        :return: dict of pandas Dataframes, containing OHLCV values from the look-back before start_ts to end_ts
         """    
-        result = {}
-
-        for interval in intervals:
-            filename = PATH_HIST_KLINES[interval]
-            file_klines = pd.DataFrame()
-
-            request_begin = strat_begin = self.start_ts - 300000
-            write_mode = 'w'
-
-            try:
-                file_klines = pd.read_csv(filename, index_col=0, names = ["Open","High","Low","Close","Volume","TurnOver","Date"])
-                file_klines.loc[:,'Date'] = [datetime.fromtimestamp(i).strftime('%Y-%m-%d %H:%M:%S.%d')[:-3] for i in file_klines.index]
-                newest = file_klines.tail(1).index[0]
-                oldest = file_klines.head(1).index[0]
-                if oldest - strat_begin > interval_bybit_notation(interval) * 60:
-                    request_begin = strat_begin
-                    write_mode = 'w'
-                    file_klines = pd.DataFrame()
-                else:
-                    request_begin = int(newest) + interval_bybit_notation(interval) * 60
-                    write_mode = 'a'
-            except FileNotFoundError as err:
-                pass
-
-            bybit_klines = pd.DataFrame()
-            if request_begin < int(datetime.now().timestamp()):
-                output_data = self.bybit.get_hist_klines(symbol, interval_bybit_notation(interval), str(request_begin))
-                column_data = [i[1:] for i in output_data]
-                index = [int(i[0]) for i in output_data]
-                # convert to data frame
-                bybit_klines = pd.DataFrame(column_data, index = index, columns=['Open', 'High', 'Low', 'Close', 'Volume', 'TurnOver'])
-                bybit_klines.loc[:,'Date'] = [datetime.fromtimestamp(i).strftime('%Y-%m-%d %H:%M:%S.%d')[:-3] for i in bybit_klines.index]
-
-                bybit_klines.to_csv(filename, header = False,  mode=write_mode)
-
-            result[interval] = pd.concat([file_klines, bybit_klines]) if not len(bybit_klines.index) == 0 else file_klines
-
-        return result
+        self.sync_hist_klines(symbol, intervals)
+
+        # only the range and the look-back before it
+        history = self._history(self.start_ts)
+        if self.shared:
+            return {interval: self.shared.attach(symbol, interval, self.paths[interval]).frame().loc[history[interval]:self.end_ts - 1] for interval in intervals}
+        return {interval: read_klines(self.paths[interval], history[interval], self.end_ts) for interval in intervals}
+
+    def sync_hist_klines(self, symbol, intervals):
+        """Bring the local kline files up to date with bybit, without loading them
+        :param symbol: Name of symbol pair -- BTCUSD, ETCUSD, EOSUSD, XRPUSD
+        :type symbol: str
+        :param intervals: array of Bybit Kline intervals
+        :type intervals: []
+        """
+        KlineSync(self.bybit, symbol, self.paths).sync(min(self._history(self.start_ts).values()), intervals = intervals)
+
+    def aggregate_local_and_hist_funding(self, symbol):
+        """Aggregate the local funding history with bybit funding rates, covering the backtest range
+        :param symbol: Name of symbol pair -- BTCUSD, ETCUSD, EOSUSD, XRPUSD
+        :type symbol: str
+        :return: pandas Series of funding rates indexed by settlement timestamp
+        """
+        filename = self.funding_path
+        funding = pd.Series(dtype = float, name = 'funding')
+
+        try:
+            funding = pd.read_csv(filename, index_col = 0, names = ['funding'])['funding']
+        except FileNotFoundError as err:
+            pass
+
+        fetched = []
+        now = int(datetime.now().timestamp())
+        if not len(funding.index):
+            fetched += self.bybit.get_funding_history(symbol, self.start_ts, now)
+        else:
+            oldest = funding.index[0]
+            newest = funding.index[-1]
+            # fetch in bulk only the missing older prefix and newer suffix
+            if self.start_ts < oldest:
+                fetched += self.bybit.get_funding_history(symbol, self.start_ts, oldest - 1)
+            if newest + FUNDING_INTERVAL < now:
+                fetched += self.bybit.get_funding_history(symbol, newest + 1, now)
+
+        if fetched:
+            fetched = pd.Series([r[1] for r in fetched], index = [r[0] for r in fetched], name = 'funding')
+            funding = pd.concat([funding, fetched])
+            funding = funding[~funding.index.duplicated(keep = 'last')].sort_index()
+            funding.to_csv(filename, header = False)
+
+        return funding
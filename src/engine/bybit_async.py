@@ -0,0 +1,242 @@
+import asyncio
+import json
+import time
+import logging
+from bisect import bisect_left
+from collections import defaultdict
+import aiohttp
+
+from src.engine.bybit_rest import BybitRest, signed_payload
+from src.utils.utils import get_logger, date_to_seconds
+
+logger = get_logger(logging.getLogger(__name__), 'logs/bybit-async.log', logging.DEBUG)
+
+# ret_codes bybit answers with when a request was rejected for the rate limit, nothing was executed
+RATE_LIMIT_CODES = {10006, 10018}
+
+class BybitError(Exception):
+    retryable = False
+
+    def __init__(self, message, path = None, status = None, ret_code = None):
+        super().__init__(f"{path}: {message}" if path else message)
+        self.path = path
+        self.status = status
+        self.ret_code = ret_code
+
+class BybitConnectionError(BybitError):
+    """The request didn't get a response: connection refused, reset or timed out"""
+    retryable = True
+
+class BybitHTTPError(BybitError):
+    @property
+    def retryable(self):
+        return self.status is not None and self.status >= 500
+
+class BybitRateLimitError(BybitError):
+    retryable = True
+
+class BybitAPIError(BybitError):
+    """The request was answered with a non zero ret_code"""
+
+class BybitDecodeError(BybitError):
+    """The response body isn't json"""
+
+class LatencyHistogram():
+    """Request latencies counted in log spaced buckets, from 1ms up to about a minute"""
+
+    bounds = [0.001 * 1.25 ** i for i in range(50)]
+
+    def __init__(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile, in seconds"""
+        if not self.count:
+            return 0
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def summary(self):
+        ms = lambda s: round(s * 1000, 2)
+        return {
+            "count": self.count,
+            "mean": ms(self.total / self.count) if self.count else 0,
+            "p50": ms(self.percentile(50)),
+            "p90": ms(self.percentile(90)),
+            "p99": ms(self.percentile(99)),
+            "max": ms(self.max)
+        }
+
+class AsyncBybitRest(BybitRest):
+    """asyncio flavour of BybitRest
+
+    Every endpoint method of BybitRest is available under the same name and returns a coroutine, so independent
+    calls can be in flight together:
+
+        async with AsyncBybitRest(api_key, secret, 'BTCUSD') as bybit:
+            position, orders = await asyncio.gather(bybit.get_position_http(), bybit.get_active_order())
+
+    Requests share a pool of at most `pool_size` keep-alive connections. Failures raise a BybitError subclass.
+    Connection errors, 5xx and rate limit rejections of GETs are retried with exponential backoff. POSTs are
+    retried only on rate limit rejections, which bybit refuses without executing. Latencies are recorded per
+    endpoint in `self.latency`.
+    """
+
+    def __init__(self, api_key, secret, symbol, test = False, url = None, pool_size = 10, retries = 3, backoff = 0.2, timeout = 10):
+        self.api_key = api_key
+        self.secret = secret
+
+        self.symbol = symbol
+
+        self.url = url if url else self.url_main if not test else self.url_test
+        self.mac = self._mac(secret) if secret is not None else None
+
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+        self.session = None
+        self.latency = defaultdict(LatencyHistogram)
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def open(self):
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector = aiohttp.TCPConnector(limit = self.pool_size),
+                headers = self.headers,
+                timeout = aiohttp.ClientTimeout(total = self.timeout))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def latency_report(self):
+        return {path: hist.summary() for path, hist in sorted(self.latency.items())}
+
+    #
+    # Http Apis
+    #
+
+    async def _request(self, method, path, payload, signed = True):
+        await self.open()
+
+        attempt = 0
+        while True:
+            # signed per attempt, the timestamp has to be fresh; public v5 endpoints get no credentials
+            params = signed_payload(dict(payload), self.api_key, self.mac) if signed else {k: v for k, v in payload.items() if v is not None}
+            try:
+                return await self._send(method, path, params)
+            except BybitError as e:
+                retry = e.retryable and (method == 'GET' or isinstance(e, BybitRateLimitError))
+                if not retry or attempt >= self.retries:
+                    logger.error(f"{method} {e}")
+                    raise
+                logger.warning(f"{method} {e}, retry {attempt + 1}/{self.retries}")
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+                attempt += 1
+
+    async def _send(self, method, path, payload):
+        tic = time.perf_counter()
+        try:
+            if method == 'GET':
+                request = self.session.get(self.url + path, params = payload)
+            else:
+                request = self.session.request(method, self.url + path, data = json.dumps(payload))
+            async with request as resp:
+                status = resp.status
+                text = await resp.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise BybitConnectionError(str(e) or type(e).__name__, path) from e
+        finally:
+            self.latency[path].record(time.perf_counter() - tic)
+
+        if status == 429:
+            raise BybitRateLimitError(text, path, status)
+        if status >= 400:
+            raise BybitHTTPError(text, path, status)
+
+        try:
+            body = json.loads(text)
+        except json.decoder.JSONDecodeError as e:
+            raise BybitDecodeError(str(e), path, status) from e
+
+        ret_code = body.get('ret_code', body.get('retCode', 0)) if isinstance(body, dict) else 0
+        if ret_code in RATE_LIMIT_CODES:
+            raise BybitRateLimitError(body.get('ret_msg'), path, status, ret_code)
+        if ret_code:
+            raise BybitAPIError(body.get('ret_msg', body.get('retMsg')), path, status, ret_code)
+
+        return body
+
+    async def get_hist_klines(self, symbol, interval, start_str, end_str=None):
+        """Same as BybitRest.get_hist_klines, with the 200 bar pages of the range requested `pool_size` at a time"""
+        limit = 200
+        start_ts = int(date_to_seconds(start_str))
+        end_ts = int(date_to_seconds(end_str)) if end_str else int(date_to_seconds('now'))
+
+        # a page only starts once a connection is free, so its timeout doesn't run while it waits for one and
+        # the api sees no more than pool_size requests at once
+        slots = asyncio.Semaphore(self.pool_size)
+        async def page(ts):
+            async with slots:
+                return await self.kline(symbol = symbol, interval = str(interval), _from = ts, limit = limit)
+
+        # NOTE: like the sync version, intervals of D/W/M/Y are not supported
+        step = limit * int(interval) * 60
+        pages = await asyncio.gather(*[page(ts) for ts in range(start_ts, end_ts, step)])
+
+        rows = {}
+        for page in pages:
+            for i in page.get('result') or []:
+                rows[i['open_time']] = [float(k) for k in list(i.values())[2:]]
+
+        return [rows[ts] for ts in sorted(rows)]
+
+    async def get_funding_history(self, symbol=None, start_ts=None, end_ts=None):
+        """Same as BybitRest.get_funding_history, the pages depend on each other so they are fetched in turn"""
+        limit = 200
+        end_ms = int((end_ts if end_ts else time.time()) * 1000)
+        start_ms = int(start_ts * 1000)
+
+        output_data = []
+        while end_ms > start_ms:
+            payload = {
+                'category': 'inverse',
+                'symbol': symbol if symbol else self.symbol,
+                'startTime': start_ms,
+                'endTime': end_ms,
+                'limit': limit
+            }
+            resp = await self._request('GET', '/v5/market/funding/history', payload=payload, signed=False)
+            rows = resp.get('result', {}).get('list', [])
+            if not rows:
+                break
+
+            output_data += [[int(r['fundingRateTimestamp']) // 1000, float(r['fundingRate'])] for r in rows]
+            end_ms = int(rows[-1]['fundingRateTimestamp']) - 1
+            if len(rows) < limit:
+                break
+
+        return sorted(output_data)
@@ -13,6 +13,18 @@ from src.utils.utils import get_logger, date_to_seconds
 
 logger = get_logger(logging.getLogger(__name__), 'logs/bybit.log', logging.DEBUG)
 
+def signed_payload(payload, api_key, mac):
+    """Adds api_key, timestamp and the HMAC signature over the sorted, url encoded parameters. None values are dropped."""
+    payload['api_key'] = api_key
+    payload['timestamp'] = int(time.time() * 1000)
+    payload = {k: v for k, v in sorted(payload.items()) if v is not None}
+
+    param_str = urllib.parse.urlencode(payload)
+    sign = mac.copy()
+    sign.update(param_str.encode('utf-8'))
+    payload['sign'] = sign.hexdigest()
+    return payload
+
 class BybitRest():
     url_main = 'https://api.bybit.com'
     url_test = 'https://api-testnet.bybit.com'
@@ -29,22 +41,20 @@ class BybitRest():
 
         self.url = self.url_main if not test else self.url_test
 
+        # keyed once, copied per request
+        self.mac = self._mac(self.secret) if self.secret is not None else None
+
+    @staticmethod
+    def _mac(secret):
+        return hmac.new(secret.encode('utf-8'), digestmod = hashlib.sha256)
+
     #
     # Http Apis
     #
 
-    def _request(self, method, path, payload):
-        payload['api_key'] = self.api_key
-        payload['timestamp'] = int(time.time() * 1000)
-        payload = dict(sorted(payload.items()))
-        for k, v in list(payload.items()):
-            if v is None:
-                del payload[k]
-
-        param_str = urllib.parse.urlencode(payload)
-        sign = hmac.new(self.secret.encode('utf-8'),
-                        param_str.encode('utf-8'), hashlib.sha256).hexdigest()
-        payload['sign'] = sign
+    def _request(self, method, path, payload, signed = True):
+        # the v5 market endpoints are public and don't take the v2 signature, they get no credentials at all
+        payload = signed_payload(payload, self.api_key, self.mac) if signed else {k: v for k, v in payload.items() if v is not None}
 
         if method == 'GET':
             query = payload
@@ -237,6 +247,49 @@ class BybitRest():
         }
         return self._request('GET', '/open-api/funding/predicted-funding', payload=payload)
 
+    def get_funding_history(self, symbol=None, start_ts=None, end_ts=None):
+        """Get the settled funding rates between two timestamps, oldest first
+        :param symbol: Name of symbol pair -- BTCUSD, ETCUSD, EOSUSD, XRPUSD
+        :type symbol: str
+        :param start_ts: seconds
+        :type start_ts: int
+        :param end_ts: optional - seconds, defaults to now
+        :type end_ts: int
+        :return: list of [timestamp (seconds), funding rate]
+        """
+        limit = 200
+        end_ms = int((end_ts if end_ts else time.time()) * 1000)
+        start_ms = int(start_ts * 1000)
+
+        output_data = []
+        idx = 0
+        # the endpoint pages backwards from endTime, newest first
+        while end_ms > start_ms:
+            payload = {
+                'category': 'inverse',
+                'symbol': symbol if symbol else self.symbol,
+                'startTime': start_ms,
+                'endTime': end_ms,
+                'limit': limit
+            }
+            resp = self._request('GET', '/v5/market/funding/history', payload=payload, signed=False)
+            rows = resp.get('result', {}).get('list', []) if isinstance(resp, dict) else []
+            if not rows:
+                break
+
+            output_data += [[int(r['fundingRateTimestamp']) // 1000, float(r['fundingRate'])] for r in rows]
+            end_ms = int(rows[-1]['fundingRateTimestamp']) - 1
+
+            idx += 1
+            if len(rows) < limit:
+                break
+
+            # sleep after every 3rd call to be kind to the API
+            if idx % 3 == 0:
+                time.sleep(0.2)
+
+        return sorted(output_data)
+
     def get_my_execution(self, order_id=None):
         payload = {
             'order_id': order_id
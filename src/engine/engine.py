@@ -2,7 +2,8 @@ import pandas as pd
 import numpy as np
 from datetime import datetime
 
-from src.utils.indicators import calc_indi
+from src.utils.indicators import calc_indis, warmup
+from src.engine.plan import Plan, LONG, SHORT
 from src.utils.utils import get_logger, start_of_min15, start_of_hour, start_of_hour4, start_of_day, date_to_seconds, interval_bybit_notation
 
 class Engine():
@@ -15,40 +16,54 @@ class Engine():
             '15m': pd.DataFrame(),
             '1m': pd.DataFrame()
         }
-        self.signals = [s.get('name') for s in self.strategy.get('signal')]
-        self.risk = self.strategy.get('risk')
+        # validated once, a broken strategy fails here instead of mid run
+        self.plan = Plan(self.strategy)
+        # volume, turnover and range bars the indicators are on, see bars.py
+        self.bars = {interval: pd.DataFrame() for interval in self.plan.bars}
+        self.signals = self.plan.signals
+        self.risk = self.plan.risk
+        # last daily open seen, carried into the next block when the timeline is processed in chunks
+        self.daily_open = np.nan
 
     def _check_signal(self, row, signals):
-        if all([row[s] for s in signals]) and row['Open'] > row['daily_open']:
+        # masks of the plan's entry expressions, no-trade-hours included
+        if row[LONG]:
             return "long"
-
-        go_short = True
-        for s in signals:
-            if row[s] == None or row[s] == True:
-                go_short = False
-        if go_short and row['Open'] < row['daily_open']:
+        if row[SHORT]:
             return "short"
 
-    def _check_time(self, row):
-        no_trade_hours = self.strategy.get('no-trade-hours')
-        hour = datetime.fromtimestamp(row.name).hour
-        return not hour in no_trade_hours
-
     def _check_risk_management(self):
-        return self.account.dailywon < 1 and self.account.dailylost <= 3 and self.account.trade == None
+        return self.account.dailywon < 1 and self.account.dailylost <= 3 and self.account.trade == None and not self.account.orders.has("entry")
 
     def _get_indis(self):
-        indis = self._calc_indis(self.strategy.get('signal'), self.strategy.get('atr'))
-        return self._join_indis(indis)
+        indis = self._calc_indis(self.plan.signal, self.plan.atr)
+        return self.plan.masks(self._join_indis(indis))
 
-    def _calc_indis(self, signal, atr):
-        frames = {}
-        indis = [s for s in signal] + [atr]
-        for indi in indis:
-            interval, result = calc_indi(indi, self.klines)
-            frames[interval] = pd.DataFrame(result) if not interval in frames else pd.concat([frames[interval], result], axis = 1)
+    def _warmup_bars(self):
+        """Bars of history each interval needs before its indicators are settled, {interval: bars}"""
+        bars = {}
+        for indi in self.plan.signal + [self.plan.atr]:
+            interval, n = warmup(indi)
+            bars[interval] = max(bars.get(interval, 0), n)
+        return bars
 
-        return frames
+    def _history(self, start_ts):
+        """First bar to load per interval, for the indicators to be settled and the daily open known at start_ts
+        :return: {interval: timestamp}
+        """
+        seconds = {interval: interval_bybit_notation(interval) * 60 for interval in self.klines}
+        history = {interval: start_ts - start_ts % seconds[interval] for interval in self.klines}
+        for interval, bars in self._warmup_bars().items():
+            # bars of bars.py are counted back from the last one closed, see Backtester._history
+            if interval in history:
+                history[interval] -= bars * seconds[interval]
+        # the daily open comes from the first 1m bar of the day
+        dt = datetime.fromtimestamp(start_ts)
+        history['1m'] = min(history['1m'], start_ts - (dt.hour * 60 + dt.minute) * 60 - dt.second)
+        return history
+
+    def _calc_indis(self, signal, atr):
+        return calc_indis([s for s in signal] + [atr], dict(self.klines, **self.bars))
 
     def _join_indis(self, indis):
         # join indis to 1m klines
@@ -64,10 +79,18 @@ class Engine():
         }
         result = self.klines['1m']
         #add daily open
-        result['daily_open'] = result.apply(lambda row: row['Open'] if start_of_day(row.name) else np.nan , axis = 1).fillna(method="ffill")
+        result['daily_open'] = result.apply(lambda row: row['Open'] if start_of_day(row.name) else np.nan , axis = 1).fillna(method="ffill").fillna(self.daily_open)
+        if len(result.index):
+            self.daily_open = result['daily_open'].iloc[-1]
 
         for interval in indis:
-            result[interval] = result.apply(timestamp_mapping_dict[interval], axis = 1)
+            if interval in self.bars:
+                # the last bar closed by the open of the 1m bar, -1 before the first one
+                bars = self.bars[interval]
+                last = np.searchsorted(bars['Closed'].to_numpy(), result.index.to_numpy(), side = 'right') - 1
+                result[interval] = np.where(last >= 0, bars.index.to_numpy()[np.maximum(last, 0)], -1)
+            else:
+                result[interval] = result.apply(timestamp_mapping_dict[interval], axis = 1)
             result = result.join(indis[interval], on=interval)
 
         return result
\ No newline at end of file
@@ -0,0 +1,184 @@
+'''
+Golden results: the trade ledgers and metrics the engine produces for a set of reference strategies over fixed kline
+fixtures, to check any other way of running a backtest against
+
+The fixtures in src/tests/golden are a week of 1m, 15m and 1h klines plus funding rates, with the bars the indicators
+warm up on in front of it. `record` runs every reference strategy in memory (Backtester.run) and stores the results
+in golden.json next to them. `verify` replays the strategies stored there through each variant (in memory, streamed in
+chunks, sharded, the optimizer's day blocks, killed halfway and resumed from a checkpoint) and reports the first trade that differs.
+
+Everything runs offline: the fixtures are the only data, nothing is downloaded, cached or recorded in the registry.
+'''
+
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import contextlib
+import pandas as pd
+
+from src.account.test_account import TestAccount
+from src.engine.engine import Engine
+from src.engine.backtester import Backtester
+from src.engine.optimizer import Trial
+from src.engine.strategy import strategy as base
+from src.utils.checkpoint import Checkpoints
+from src.utils.kline_store import read_klines
+from src.utils.ledger_diff import diff_results, plain
+from src.utils.utils import date_to_seconds
+
+FIXTURES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tests', 'golden')
+GOLDEN = os.path.join(FIXTURES, 'golden.json')
+
+RANGE = ('2021-01-01', '2021-01-08')
+
+# changes to the base strategy, each one exercising a different part of the engine
+REFERENCES = {
+    "default": {},
+    "no-funding": {"funding": False},
+    "trail-targets": {"trail-atr": 1.5, "targets": [[0.5, 0.5]]},
+    "limit": {"entry": "limit", "entry-atr": 0.2, "entry-expire": 60},
+    "stop": {"entry": "stop", "entry-atr": 0.1, "entry-expire": 30},
+    "expression": {"long": "hma and Close > daily_open + 0.2 * atr", "short": "not hma and Close < daily_open - 0.2 * atr"},
+    "volume-fills": {"fills": {"model": "volume", "impact": 0.1, "participation": 0.1}},
+    "activity-bars": {"signal": [{"name": "hma", "properties": {"interval": "volume-100000000", "length": 21, "offset": 2}},
+        {"name": "aroon", "properties": {"interval": "range-2000", "length": 14}}]},
+}
+
+class Replay(Backtester):
+    """A backtest of the fixtures, without downloading, caching or recording anything
+
+    :param paths: kline file per interval
+    :param funding: funding rates, see aggregate_local_and_hist_funding
+    :param chunk: stream in blocks of 1m bars, like Backtester
+    :param shards: run on day aligned shards, like Backtester
+    :param checkpoints: Checkpoints to save the progress to
+    :param resume: state of a checkpoint to carry on from
+    """
+
+    def __init__(self, strategy, paths, funding, start_ts, end_ts, chunk = None, shards = None, checkpoints = None, resume = None):
+        Engine.__init__(self, strategy = strategy)
+        self.paths = paths
+        self.funding = funding
+        self.start_ts = start_ts
+        self.end_ts = end_ts
+        self.chunk = chunk
+        self.shards = shards
+        self.account = TestAccount(startbalance = 1)
+        self.depth = None
+        self.checkpoints = checkpoints
+        self.resume = resume
+        self.description = {"kind": "replay", "strategy": strategy, "start": start_ts, "end": end_ts, "chunk": chunk}
+
+        if self.chunk:
+            self.run_chunked()
+        else:
+            self.run()
+
+    def sync_hist_klines(self, symbol, intervals):
+        pass
+
+    def aggregate_local_and_hist_funding(self, symbol):
+        return self.funding
+
+@contextlib.contextmanager
+def fixtures():
+    """The fixtures unpacked to a temporary directory, as (kline file per interval, funding rates)"""
+    tmp = tempfile.mkdtemp()
+    try:
+        paths = {}
+        for interval in ['1m', '15m', '1h']:
+            paths[interval] = os.path.join(tmp, f"kline_{interval}.csv")
+            with gzip.open(os.path.join(FIXTURES, f"kline_{interval}.csv.gz"), 'rb') as f, open(paths[interval], 'wb') as out:
+                shutil.copyfileobj(f, out)
+        funding = pd.read_csv(os.path.join(FIXTURES, 'funding.csv.gz'), index_col = 0, names = ['funding'])['funding']
+        yield paths, funding
+    finally:
+        shutil.rmtree(tmp)
+
+def _memory(strategy, paths, funding, start_ts, end_ts):
+    return Replay(strategy, paths, funding, start_ts, end_ts).account
+
+def _chunked(strategy, paths, funding, start_ts, end_ts):
+    return Replay(strategy, paths, funding, start_ts, end_ts, chunk = 1440).account
+
+def _sharded(strategy, paths, funding, start_ts, end_ts):
+    return Replay(strategy, paths, funding, start_ts, end_ts, shards = 2).account
+
+class Interrupted(Exception):
+    pass
+
+def _resumed(strategy, paths, funding, start_ts, end_ts, chunk = None):
+    """Killed halfway through the range, then resumed from its last checkpoint"""
+    path = tempfile.mkdtemp()
+    try:
+        checkpoints = Checkpoints(path, every = 0)
+
+        class Killed(Replay):
+            def execute_strategy(self, table):
+                if len(table.index) and table.index[0] >= (start_ts + end_ts) // 2:
+                    raise Interrupted()
+                super().execute_strategy(table)
+
+        with contextlib.suppress(Interrupted):
+            Killed(strategy, paths, funding, start_ts, end_ts, chunk = chunk, checkpoints = checkpoints)
+        resume = checkpoints.load()['state']
+        return Replay(strategy, paths, funding, start_ts, end_ts, chunk = chunk, checkpoints = checkpoints, resume = resume).account
+    finally:
+        shutil.rmtree(path)
+
+def _chunked_resumed(strategy, paths, funding, start_ts, end_ts):
+    return _resumed(strategy, paths, funding, start_ts, end_ts, chunk = 1440)
+
+def _trial(strategy, paths, funding, start_ts, end_ts):
+    trial = Trial(strategy, {interval: read_klines(path) for interval, path in paths.items()}, funding)
+    trial.evaluate(start_ts, end_ts)
+    return trial.account
+
+# ways of running a backtest, each returning the account it ran on
+VARIANTS = {
+    "memory": _memory,
+    "chunked": _chunked,
+    "sharded": _sharded,
+    "trial": _trial,
+    "resumed": _resumed,
+    "chunked-resumed": _chunked_resumed,
+}
+
+def result(account):
+    return plain({"result": account.getResult(), "metrics": account.getMetrics(), "trades": account.trades})
+
+def record(path = GOLDEN, references = None):
+    """Run every reference strategy in memory and store the results as the golden ones"""
+    start_ts, end_ts = date_to_seconds(RANGE[0]), date_to_seconds(RANGE[1])
+    golden = {"start": start_ts, "end": end_ts, "references": {}}
+    with fixtures() as (paths, funding):
+        for name, changes in (references or REFERENCES).items():
+            strategy = dict(base, **changes)
+            golden["references"][name] = dict(strategy = strategy, **result(_memory(strategy, paths, funding, start_ts, end_ts)))
+
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w') as f:
+        json.dump(golden, f, indent = 1)
+    os.replace(tmp, path)
+    return golden
+
+def load(path = GOLDEN):
+    with open(path) as f:
+        return json.load(f)
+
+def verify(golden, variants = None, tolerance = 0):
+    """Replay the golden strategies through each variant
+    :param golden: see record
+    :param variants: names of VARIANTS, all of them by default
+    :param tolerance: relative and absolute tolerance of numbers, 0 for exact
+    :return: list of (reference, variant, report of the first difference or None)
+    """
+    checks = []
+    with fixtures() as (paths, funding):
+        for name, expected in golden["references"].items():
+            for variant in variants or list(VARIANTS):
+                account = VARIANTS[variant](expected["strategy"], paths, funding, golden["start"], golden["end"])
+                checks.append((name, variant, diff_results(expected, result(account), tolerance)))
+    return checks
@@ -0,0 +1,242 @@
+'''
+Successive halving over strategy configurations
+
+Instead of backtesting every point of a grid over the whole range, `configs` random configurations of the search
+space are run on a short window at the start of the range. The best 1/eta of them by growth are promoted to a
+window eta times longer, and so on, until the survivors run over the full range. Each rung costs about as much
+as the first one, so the full range is only ever paid for by a handful of configurations.
+
+A run stops as soon as its drawdown is worse than `max_drawdown` percent, and configurations that don't reach
+`min_growth` percent are not promoted.
+
+The rung, its configurations and the trials finished on it are checkpointed as they complete, `main.py resume`
+carries on with the trials that were still missing.
+
+The search space maps a strategy key (`tp-atr`) or an indicator property (`hma.length`) to a list of values to pick
+from, or to a (low, high) range: ints draw an int, floats a float rounded to 2 decimals.
+'''
+
+import copy
+import json
+import math
+import time
+import logging
+from multiprocessing import Pool
+import numpy as np
+
+from src.account.test_account import TestAccount
+from src.account.funding import FundingSchedule
+from src.engine.engine import Engine
+from src.engine.backtester import Backtester
+from src.engine.bybit_rest import BybitRest
+from src.utils.checkpoint import Checkpoints
+from src.utils.orderbook_store import OrderBookReplay
+from src.utils.run_registry import RunRegistry
+from src.utils.utils import get_logger, date_to_seconds
+
+logger = get_logger(logging.getLogger(__name__), 'logs/optimizer.log', logging.DEBUG)
+
+SPACE = {
+    "hma.length": [21, 34, 55, 89],
+    "aroon.length": [9, 14, 25],
+    "atr.length": [14, 24, 48],
+    "tp-atr": (0.5, 3.0),
+    "sl-atr": (0.5, 3.0)
+}
+
+DAY = 86400
+
+def configure(strategy, params):
+    """Copy of strategy with params of the search space applied"""
+    strategy = copy.deepcopy(strategy)
+    for key, value in params.items():
+        if '.' in key:
+            name, prop = key.split('.', 1)
+            indis = [i for i in strategy['signal'] + [strategy['atr']] if i.get('name') == name]
+            if not indis:
+                raise KeyError(f"{key}: no indicator {name} in the strategy")
+            for indi in indis:
+                indi['properties'][prop] = value
+        else:
+            strategy[key] = value
+    return strategy
+
+def sample(space, n, rng):
+    """Up to n distinct random points of the search space"""
+    configs, seen = [], set()
+    for _ in range(n * 10):
+        params = {}
+        for key, values in space.items():
+            if isinstance(values, tuple):
+                low, high = values
+                params[key] = int(rng.integers(low, high + 1)) if isinstance(low, int) and isinstance(high, int) else round(float(rng.uniform(low, high)), 2)
+            else:
+                params[key] = values[int(rng.integers(len(values)))]
+        point = json.dumps(params, sort_keys = True)
+        if point not in seen:
+            seen.add(point)
+            configs.append(params)
+        if len(configs) == n:
+            break
+    return configs
+
+def grid_size(space):
+    """Points of the full grid, None when a dimension is a range"""
+    sizes = [len(v) for v in space.values() if not isinstance(v, tuple)]
+    return math.prod(sizes) if len(sizes) == len(space) else None
+
+def warmup_bars(strategy, candidates):
+    """Bars of history per interval the most demanding of the configurations needs, {interval: bars}"""
+    bars = {}
+    for params in [{}] + candidates:
+        # an invalid point of the space fails here, not in a worker
+        for interval, n in Engine(strategy = configure(strategy, params))._warmup_bars().items():
+            bars[interval] = max(bars.get(interval, 0), n)
+    return bars
+
+class Trial(Backtester):
+    """One configuration backtested on a window of klines that are already loaded"""
+
+    def __init__(self, strategy, kline_dict, funding):
+        Engine.__init__(self, strategy = strategy)
+        self.kline_dict = kline_dict
+        self.funding = funding
+        self.account = TestAccount(startbalance = 1)
+        self.depth = OrderBookReplay(self.plan.orderbook) if self.plan.orderbook else None
+
+    def evaluate(self, start_ts, end_ts, max_drawdown = None):
+        """Backtest [start_ts, end_ts) like Backtester.run, a day at a time so a run past max_drawdown stops early
+        :return: getMetrics() plus "stopped": whether it stopped early, and the trades
+        """
+        self._working_set(self.kline_dict, start_ts, end_ts)
+        table = self._table()
+        if self.funding is not None and self.plan.funding:
+            self.account.funding = FundingSchedule.from_history(table.index, table['Open'], self.funding, start_ts)
+        self.account.fills = self._fill_model(table)
+
+        stopped = False
+        for begin in range(0, len(table.index), 1440):
+            self.execute_strategy(table.iloc[begin:begin + 1440])
+            if max_drawdown and self.account.maxdrawdown <= -max_drawdown:
+                stopped = True
+                break
+
+        return dict(self.account.getMetrics(), stopped = stopped), self.account.trades
+
+    def _read_1m(self, begin, end):
+        klines = self.kline_dict['1m']
+        return klines[(klines.index >= begin) & (klines.index < end)]
+
+# set in every worker by _init, so the klines are sent once per worker instead of once per trial
+_data = {}
+
+def _init(strategy, kline_dict, funding):
+    _data.update(strategy = strategy, kline_dict = kline_dict, funding = funding)
+
+def _evaluate(params, start_ts, end_ts, max_drawdown):
+    trial = Trial(configure(_data['strategy'], params), _data['kline_dict'], _data['funding'])
+    return trial.evaluate(start_ts, end_ts, max_drawdown)
+
+def _evaluate_args(args):
+    # imap hands over one argument, trials come back one by one to be checkpointed
+    return _evaluate(*args)
+
+class Optimizer(Backtester):
+    """Successive halving search for the best configuration of a strategy over a date range
+
+    :param space: search space, SPACE by default
+    :param configs: configurations sampled for the first rung
+    :param eta: 1/eta of a rung is promoted to a window eta times longer
+    :param min_days: length of the first rung's window
+    :param max_drawdown: stop a run once its drawdown is worse, in percent
+    :param min_growth: don't promote configurations below this growth, in percent
+    :param resume: state of a checkpoint to carry on from
+    """
+
+    def __init__(self, *args, **kwargs):
+        Engine.__init__(self, strategy = kwargs.get('strategy'), symbol = kwargs.get('symbol'))
+        self.bybit = BybitRest(api_key = kwargs.get('api_key'), secret = kwargs.get('secret'), symbol = self.symbol)
+
+        self.start_ts = date_to_seconds(kwargs.get('args')[0])
+        self.end_ts = date_to_seconds(kwargs.get('args')[1])
+
+        self.space = kwargs.get('space') or SPACE
+        self.configs = kwargs.get('configs') or 27
+        self.eta = kwargs.get('eta') or 3
+        self.min_days = kwargs.get('min_days') or 7
+        self.max_drawdown = kwargs.get('max_drawdown')
+        self.min_growth = kwargs.get('min_growth')
+        self.workers = kwargs.get('workers') or 1
+        self.rng = np.random.default_rng(kwargs.get('seed'))
+        self.registry = RunRegistry() if kwargs.get('registry', True) else None
+        self.checkpoints = Checkpoints() if kwargs.get('checkpoint', True) else None
+        self.resume = kwargs.get('resume')
+        self.description = {"kind": "optimize", "strategy": self.strategy, "symbol": self.symbol, "args": kwargs.get('args'),
+            "space": self.space, "configs": self.configs, "eta": self.eta, "min_days": self.min_days, "max_drawdown": self.max_drawdown,
+            "min_growth": self.min_growth, "workers": self.workers, "seed": kwargs.get('seed')}
+
+        self.best = self.optimize()
+        if self.checkpoints:
+            self.checkpoints.remove(self.description)
+
+    def _warmup_bars(self):
+        return self.warmup
+
+    def windows(self):
+        """End of the window of every rung, growing eta times per rung up to the whole range"""
+        ends, days = [], self.min_days
+        while self.start_ts + days * DAY < self.end_ts:
+            ends.append(self.start_ts + days * DAY)
+            days *= self.eta
+        return ends + [self.end_ts]
+
+    def optimize(self):
+        tic = time.perf_counter()
+        state = self.resume or {"rung": 0, "candidates": sample(self.space, self.configs, self.rng), "trials": [], "cost": 0}
+        candidates, cost, results = state["candidates"], state["cost"], []
+
+        # the look-back every candidate needs, so none of them starts with unsettled indicators
+        self.warmup = warmup_bars(self.strategy, candidates)
+        kline_dict = self.aggregate_local_and_hist_klines('BTCUSD', ['1h', '15m', '1m'])
+        funding = self.aggregate_local_and_hist_funding('BTCUSD') if self.plan.funding else None
+
+        with Pool(self.workers, initializer = _init, initargs = (self.strategy, kline_dict, funding)) as pool:
+            for rung, end_ts in enumerate(self.windows()):
+                if rung < state["rung"]:
+                    continue
+                trials = state["trials"] if rung == state["rung"] else []
+                for trial in pool.imap(_evaluate_args, [(params, self.start_ts, end_ts, self.max_drawdown) for params in candidates[len(trials):]]):
+                    trials.append(trial)
+                    if self.checkpoints and len(trials) < len(candidates) and self.checkpoints.due():
+                        self.checkpoints.save(self.description, {"rung": rung, "candidates": candidates, "trials": trials, "cost": cost})
+                metrics = [m for m, _ in trials]
+                cost += len(candidates) * (end_ts - self.start_ts) // DAY
+                if self.registry:
+                    self.registry.record([{"kind": "optimize", "strategy": configure(self.strategy, params), "symbol": self.symbol,
+                        "start": self.start_ts, "end": end_ts, "metrics": m, "trades": trades} for params, (m, trades) in zip(candidates, trials)])
+
+                results = sorted(zip(candidates, metrics), key = lambda r: (not r[1]['stopped'], r[1]['growth']), reverse = True)
+                logger.info(f"rung {rung}: {len(candidates)} configs over {(end_ts - self.start_ts) // DAY} days")
+                for params, m in results:
+                    logger.info(f"{m['growth']:8.2f}% dd {m['maxdrawdown']:7.2f}% trades {m['trades']:4}{' stopped' if m['stopped'] else ''} {params}")
+                print(f"rung {rung}: {len(candidates)} configs, {(end_ts - self.start_ts) // DAY} days, best {results[0][1]['growth']:.2f}% {results[0][0]}")
+
+                if end_ts == self.end_ts:
+                    break
+                promoted = [params for params, m in results if not m['stopped'] and (self.min_growth is None or m['growth'] >= self.min_growth)]
+                candidates = promoted[:max(1, len(candidates) // self.eta)]
+                if not candidates:
+                    print("no configuration survived")
+                    return None
+                if self.checkpoints and self.checkpoints.due():
+                    self.checkpoints.save(self.description, {"rung": rung + 1, "candidates": candidates, "trials": [], "cost": cost})
+
+        grid = grid_size(self.space)
+        full = f", a full grid of {grid} is {grid * (self.end_ts - self.start_ts) // DAY}" if grid else ""
+        print(f"optimize: {time.perf_counter() - tic:.4f}, {cost} config days{full}")
+
+        params, metrics = results[0]
+        logger.info(f"best {metrics}: {params}")
+        print(f"best: {json.dumps(params)}")
+        print(metrics)
+        return params, metrics
@@ -0,0 +1,189 @@
+'''
+Strategy dicts compiled once into a validated Plan
+
+Entries are boolean expressions over columns of the joined table: the names of the "signal" indicators, Open, High,
+Low, Close, Volume, TurnOver, daily_open and atr. They combine with and, or, not, comparisons (< <= > >= == !=),
+arithmetic (+ - * /) and numbers, i.e.
+
+    "long": "hma and aroon and Open > daily_open",
+    "short": "not hma and aroon and Close < daily_open - 0.5 * atr"
+
+Without "long"/"short" every signal has to be True (False for a short) with the open above (below) the daily open.
+
+Expressions are evaluated over whole columns at once, in three valued logic: an indicator that isn't settled yet
+(None) or a nan makes a comparison unknown, `and`/`or` stay unknown unless the known side decides, and only a True
+result enters. So "not hma" holds only where hma is False, like the signal check always did.
+'''
+
+import ast
+from datetime import datetime
+import numpy as np
+
+from src.utils import indicators
+from src.utils.bars import parse as bar_interval
+
+COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'TurnOver', 'daily_open', 'atr']
+# intervals the indicators can be joined to the 1m bars from, besides the bars of bars.py (volume-50000000, ...)
+INTERVALS = ['15m', '1h']
+ENTRIES = ['market', 'limit', 'stop']
+
+# table columns the entry masks are stored in
+LONG = 'entry_long'
+SHORT = 'entry_short'
+
+COMPARE = {ast.Lt: np.less, ast.LtE: np.less_equal, ast.Gt: np.greater, ast.GtE: np.greater_equal, ast.Eq: np.equal, ast.NotEq: np.not_equal}
+ARITHMETIC = {ast.Add: np.add, ast.Sub: np.subtract, ast.Mult: np.multiply, ast.Div: np.divide}
+
+class StrategyError(ValueError):
+    pass
+
+def _number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _truth(values):
+    """1.0 / 0.0 / nan for true, false and unknown"""
+    return np.where(np.isnan(values), np.nan, values != 0)
+
+class Expression():
+    """Boolean expression over table columns, validated on construction and evaluated over whole columns"""
+
+    def __init__(self, text, columns):
+        self.text = text
+        try:
+            self.tree = ast.parse(text, mode = 'eval').body
+        except SyntaxError as e:
+            raise StrategyError(f"{text!r}: {e.msg}")
+        self._check(self.tree, columns)
+
+    def _check(self, node, columns):
+        if isinstance(node, ast.Name):
+            if node.id not in columns:
+                raise StrategyError(f"{self.text!r}: unknown column {node.id}, one of {', '.join(columns)}")
+        elif isinstance(node, ast.Constant):
+            if not _number(node.value):
+                raise StrategyError(f"{self.text!r}: only numbers can be constants, not {node.value!r}")
+        elif isinstance(node, ast.BoolOp):
+            for value in node.values:
+                self._check(value, columns)
+        elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.Not, ast.USub)):
+            self._check(node.operand, columns)
+        elif isinstance(node, ast.Compare) and all(type(op) in COMPARE for op in node.ops):
+            for value in [node.left] + node.comparators:
+                self._check(value, columns)
+        elif isinstance(node, ast.BinOp) and type(node.op) in ARITHMETIC:
+            self._check(node.left, columns)
+            self._check(node.right, columns)
+        else:
+            raise StrategyError(f"{self.text!r}: {type(node).__name__} is not supported")
+
+    def evaluate(self, table):
+        """1.0 where the expression holds, 0.0 where it doesn't and nan where it is unknown, per row of table"""
+        with np.errstate(invalid = 'ignore', divide = 'ignore'):
+            return _truth(self._evaluate(self.tree, table))
+
+    def _evaluate(self, node, table):
+        if isinstance(node, ast.Name):
+            return table[node.id].astype(float).to_numpy()
+        if isinstance(node, ast.Constant):
+            return np.full(len(table.index), float(node.value))
+
+        if isinstance(node, ast.BoolOp):
+            values = [_truth(self._evaluate(value, table)) for value in node.values]
+            result = values[0]
+            for value in values[1:]:
+                unknown = np.isnan(result) | np.isnan(value)
+                if isinstance(node.op, ast.And):
+                    result = np.where((result == 0) | (value == 0), 0.0, np.where(unknown, np.nan, 1.0))
+                else:
+                    result = np.where((result == 1) | (value == 1), 1.0, np.where(unknown, np.nan, 0.0))
+            return result
+
+        if isinstance(node, ast.UnaryOp):
+            operand = self._evaluate(node.operand, table)
+            return 1 - _truth(operand) if isinstance(node.op, ast.Not) else -operand
+
+        if isinstance(node, ast.Compare):
+            # a < b < c is a < b and b < c
+            result = np.ones(len(table.index))
+            left = self._evaluate(node.left, table)
+            for op, comparator in zip(node.ops, node.comparators):
+                right = self._evaluate(comparator, table)
+                holds = np.where(np.isnan(left) | np.isnan(right), np.nan, COMPARE[type(op)](left, right))
+                result = np.where((result == 0) | (holds == 0), 0.0, np.where(np.isnan(result) | np.isnan(holds), np.nan, 1.0))
+                left = right
+            return result
+
+        return ARITHMETIC[type(node.op)](self._evaluate(node.left, table), self._evaluate(node.right, table))
+
+class Plan():
+    """A strategy dict (see strategy.py), checked once and turned into entry expressions
+
+    Raises StrategyError on anything that would otherwise fail or be ignored in the middle of a run.
+    """
+
+    def __init__(self, strategy):
+        self.signal = [self._indicator(s, 'signal') for s in strategy.get('signal') or []]
+        self.signals = [s['name'] for s in self.signal]
+        self.atr = self._indicator(strategy.get('atr'), 'atr')
+        # bar intervals the indicators are on, built from the 1m klines
+        self.bars = sorted({i['properties']['interval'] for i in self.signal + [self.atr] if bar_interval(i['properties']['interval'])})
+
+        self.no_trade_hours = strategy.get('no-trade-hours') or []
+        if not all(isinstance(h, int) and 0 <= h < 24 for h in self.no_trade_hours):
+            raise StrategyError(f"no-trade-hours: hours of the day 0-23, not {self.no_trade_hours}")
+
+        self.risk = self._positive(strategy, 'risk')
+        self.tp_atr = self._positive(strategy, 'tp-atr')
+        self.sl_atr = self._positive(strategy, 'sl-atr')
+
+        self.entry = strategy.get('entry', 'market')
+        if self.entry not in ENTRIES:
+            raise StrategyError(f"entry: one of {', '.join(ENTRIES)}, not {self.entry!r}")
+        self.entry_atr = strategy.get('entry-atr', 0)
+        if not _number(self.entry_atr) or self.entry_atr < 0:
+            raise StrategyError(f"entry-atr: a number >= 0, not {self.entry_atr!r}")
+        self.entry_expire = self._positive(strategy, 'entry-expire', optional = True)
+        self.trail_atr = self._positive(strategy, 'trail-atr', optional = True)
+
+        self.targets = [tuple(t) for t in strategy.get('targets') or []]
+        if not all(len(t) == 2 and _number(t[0]) and t[0] > 0 and _number(t[1]) and 0 < t[1] <= 1 for t in self.targets) \
+            or sum(t[1] for t in self.targets) > 1 + 1e-9:
+            raise StrategyError(f"targets: [atr multiplier > 0, portion 0-1] with portions adding up to at most 1, not {self.targets}")
+
+        self.fills = strategy.get('fills') or {}
+        if self.fills and self.fills.get('model') != 'volume':
+            raise StrategyError(f"fills: the only model is 'volume', not {self.fills.get('model')!r}")
+        self.orderbook = strategy.get('orderbook')
+        self.funding = strategy.get('funding', True)
+
+        columns = COLUMNS + self.signals
+        self.long = Expression(strategy.get('long') or ' and '.join(self.signals + ['Open > daily_open']), columns)
+        self.short = Expression(strategy.get('short') or ' and '.join([f"not {s}" for s in self.signals] + ['Open < daily_open']), columns)
+
+    @staticmethod
+    def _indicator(indi, key):
+        if not isinstance(indi, dict) or not hasattr(indicators, str(indi.get('name'))) or not hasattr(indicators, f"{indi.get('name')}_warmup"):
+            raise StrategyError(f"{key}: unknown indicator {indi!r}")
+        interval = (indi.get('properties') or {}).get('interval')
+        if interval not in INTERVALS and not bar_interval(interval):
+            raise StrategyError(f"{key} {indi['name']}: interval one of {', '.join(INTERVALS)} or volume-, turnover-, range-<threshold>, not {interval!r}")
+        return indi
+
+    @staticmethod
+    def _positive(strategy, key, optional = False):
+        value = strategy.get(key)
+        if value is None and optional:
+            return None
+        if not _number(value) or value <= 0:
+            raise StrategyError(f"{key}: a number > 0, not {value!r}")
+        return value
+
+    def masks(self, table):
+        """Add the long and short entry masks to the joined table. Long wins a tie
+        Entries are masked out in no-trade-hours and while the atr, which stop and take profit are set from, is unknown.
+        """
+        tradeable = ~np.isin([datetime.fromtimestamp(ts).hour for ts in table.index], self.no_trade_hours)
+        tradeable &= ~np.isnan(table['atr'].astype(float).to_numpy())
+        table[LONG] = (self.long.evaluate(table) == 1) & tradeable
+        table[SHORT] = (self.short.evaluate(table) == 1) & tradeable & ~table[LONG].to_numpy()
+        return table
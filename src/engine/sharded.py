@@ -0,0 +1,108 @@
+'''
+Speculative parallel execution of a single backtest
+
+The timeline is cut at day starts into shards that run in parallel, each on a fresh account: flat, no orders,
+clean daily counters and a balance of 1. While it runs, every shard records the calls that moved its balance
+(TestAccount.journal) and, after every bar, the state the next decisions depend on.
+
+Without fill models the strategy's decisions don't depend on the balance, only on that state. Reconciliation walks
+the shards in order on the real account. Where the real state at a shard start differs from the assumed one (a
+trade or an order carried over, yesterday's counters still blocking the first bar), the shard is rerun bar by bar
+until the two states agree on a flat account. From there on the speculative run made the same decisions, so its journal is replayed
+on the real balance: the compounded balances come out bit for bit like the serial run's, not rescaled.
+'''
+
+import logging
+from multiprocessing import Pool
+import numpy as np
+
+from src.account.test_account import TestAccount
+from src.engine.engine import Engine
+from src.engine.backtester import Backtester
+from src.utils.utils import get_logger, start_of_day
+
+logger = get_logger(logging.getLogger(__name__), 'logs/sharded.log', logging.DEBUG)
+
+# flat without orders, nothing won, lost, traded or even today
+ASSUMED = (1, 0, 0, 0, 0)
+
+class Shard(Backtester):
+    """Runs the strategy over part of an already prepared table, on the account it is given"""
+
+    def __init__(self, strategy, account):
+        Engine.__init__(self, strategy = strategy)
+        self.account = account
+
+    def state(self):
+        """Everything besides the balance the next decisions depend on"""
+        account = self.account
+        return (int(account.trade is None and not account.orders), account.dailywon, account.dailylost, account.dailytrades, account.dailyeven)
+
+def speculate(strategy, table, funding):
+    """Run a shard from the assumed state
+    :return: dict of the journal, the state after every bar, the journal length after every bar and the final orders
+    """
+    account = TestAccount(startbalance = 1, funding = funding)
+    account.journal = []
+    shard = Shard(strategy, account)
+
+    states, marks = [], []
+    def step(row):
+        shard.process_kline(row, shard.signals)
+        states.append(shard.state())
+        marks.append(len(account.journal))
+
+    if len(table.index):
+        table.apply(step, axis = 1)
+    return {
+        "journal": account.journal,
+        "states": np.array(states, dtype = np.int32).reshape(-1, len(ASSUMED)),
+        "marks": np.array(marks, dtype = np.int64),
+        "orders": account.orders
+    }
+
+def split_days(index, shards):
+    """Row offsets of about `shards` parts of equal length, every part but the first starting at a day start"""
+    days = np.flatnonzero([start_of_day(ts) for ts in index])
+    targets = np.arange(1, shards) * len(index) // shards
+    cuts = np.unique(days[np.minimum(np.searchsorted(days, targets), len(days) - 1)]) if len(days) else []
+    cuts = [int(c) for c in cuts if 0 < c < len(index)]
+    return list(zip([0] + cuts, cuts + [len(index)]))
+
+def execute_sharded(engine, table, workers):
+    """Run engine.strategy over table on engine.account, with the same result as engine.execute_strategy(table)"""
+    account = engine.account
+    if not len(table.index):
+        return
+    if account.fills is not None:
+        # partial fills and impact depend on the order size, hence on the balance
+        logger.warning("fill models make the decisions depend on the balance, running serially")
+        engine.execute_strategy(table)
+        return
+
+    parts = [table.iloc[begin:end] for begin, end in split_days(table.index, workers * 4)]
+    with Pool(workers) as pool:
+        results = pool.starmap(speculate, [(engine.strategy, part, account.funding) for part in parts])
+
+    shard = Shard(engine.strategy, account)
+    rerun = 0
+    for part, spec in zip(parts, results):
+        done = 0
+        if shard.state() != ASSUMED:
+            converged = False
+            while done < len(part.index) and not converged:
+                shard.process_kline(part.iloc[done], shard.signals)
+                # a trade or orders in both states needn't be the same ones, only a flat account settles it
+                state = shard.state()
+                converged = state[0] and state == tuple(spec["states"][done])
+                done += 1
+            rerun += done
+            if not converged:
+                continue
+
+        account.replay(spec["journal"][spec["marks"][done - 1] if done else 0:])
+        account.dailywon, account.dailylost, account.dailytrades, account.dailyeven = (int(n) for n in spec["states"][-1][1:])
+        account.lastbardate = part.index[-1]
+        account.orders = spec["orders"]
+
+    logger.info(f"{len(parts)} shards over {workers} workers, {rerun} of {len(table.index)} bars rerun")
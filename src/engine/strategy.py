@@ -1,10 +1,26 @@
 '''
-signal: array of indicators that all need to resolve to True for a long entry OR false for a short entry. "name" is linked to the definitions from indicators.py. You can build your own
+signal: array of indicators that all need to resolve to True for a long entry OR false for a short entry. "name" is linked to the definitions from indicators.py. You can build your own, see the module doc there
+    "interval" is '15m', '1h' or bars built from the 1m klines: 'volume-<contracts>', 'turnover-<BTC>' or 'range-<USD>', see bars.py
 atr: pillar of the strategy. SL and TP are defined by it.
 no-trade-hours: don't trade at these hours (UTC)
 tp-atr: take profit multiplier. i.e If 2, take profit at entry +/- atrx2
 sl-atr: stop loss multiplier. i.e If 2, stop loss at entry +/- atrx2
 risk: % of balance to risk on each trade (factors in stop-loss)
+
+optional:
+entry: 'market' (default), 'limit' or 'stop'. Limit and stop entries rest in the account order book until filled
+entry-atr: distance of a limit/stop entry from the signal bar open, in atr. SL and TP move with the entry
+entry-expire: cancel an unfilled limit/stop entry after this many minutes
+trail-atr: trail the stop this far behind the best price since entry, in atr
+fills: fill model for market orders and entries. {"model": "volume", "impact": 0.1, "participation": 0.1} slips taker fills
+    by impact x bar range x sqrt(size / bar volume) and fills entries up to participation x bar volume
+orderbook: path prefix of an order book recorded with `main.py record-orderbook` (i.e. 'hist_data/orderbook'). Without a
+    volume fill model, market fills walk its depth
+funding: accrue the 8-hourly funding on open positions (default True). Rates are cached in hist_data/funding.csv
+long / short: entry conditions as expressions over the indicator names, Open, High, Low, Close, Volume, TurnOver,
+    daily_open and atr with and/or/not, comparisons, + - * / and numbers, i.e. "hma and aroon and Close > daily_open + 0.2 * atr".
+    Default: every signal True (False for short) and Open above (below) daily_open. See plan.py
+targets: partial take-profits as [atr multiplier, portion of the position], i.e. [[0.5, 0.5]] takes half off at entry +/- atrx0.5
 '''
 
 strategy = {
@@ -33,7 +49,7 @@ strategy = {
         }
     },
     "no-trade-hours": [3,4,5],
-    "tp-atr": 2,
-    "sl-atr": 2,
+    "tp-atr": 0.95,
+    "sl-atr": 1,
     "risk": 1
 }
\ No newline at end of file
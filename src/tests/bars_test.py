@@ -0,0 +1,120 @@
+import unittest
+import importlib.util
+
+def naive_bars(klines, column, threshold):
+    # bar by bar, the way the bucketing is meant to come out
+    bars, current, total = [], None, 0
+    for ts, k in klines.iterrows():
+        if current and ts // 86400 != current['day']:
+            bars.append(current)
+            current, total = None, 0
+        amount = k['High'] - k['Low'] if column is None else k[column]
+        if not current:
+            current = {'ts': ts, 'day': ts // 86400, 'Open': k['Open'], 'High': k['High'], 'Low': k['Low'], 'Volume': 0}
+            # the next multiple of the threshold the day's amount reaches
+            target = (total // threshold + 1) * threshold
+        current['High'], current['Low'] = max(current['High'], k['High']), min(current['Low'], k['Low'])
+        current['Close'], current['Volume'], current['Closed'] = k['Close'], current['Volume'] + k['Volume'], ts + 60
+        total += amount
+        if total >= target:
+            bars.append(current)
+            current = None
+    if current and not (ts + 60) % 86400:
+        # the day is over, its last bar with it
+        bars.append(current)
+        current = None
+    return bars, current
+
+class TestBars(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        import pandas as pd
+        rng = np.random.default_rng(11)
+        n = 3 * 1440
+        close = 30000 + np.cumsum(rng.normal(0, 10, n))
+        self.klines = pd.DataFrame({'Open': close, 'High': close + rng.random(n) * 20, 'Low': close - rng.random(n) * 20, 'Close': close,
+            'Volume': rng.integers(1, 100, n).astype(float) * 1000, 'TurnOver': rng.random(n)},
+            index = [1609459200 + 60 * i for i in range(n)])
+
+    def test_parse(self):
+        from src.utils.bars import parse
+        self.assertEqual(parse('volume-50000000'), ('volume', 50000000))
+        self.assertEqual(parse('range-12.5'), ('range', 12.5))
+        for interval in ['15m', 'volume', 'volume-', 'volume-0', 'volume--5', 'ticks-10', 'range-nan']:
+            self.assertIsNone(parse(interval), interval)
+
+    def test_build(self):
+        from src.utils.bars import build_bars
+        for interval, column, threshold in [('volume-1000000', 'Volume', 1e6), ('range-500', None, 500)]:
+            bars = build_bars(self.klines, interval)
+            expected, forming = naive_bars(self.klines, column, threshold)
+            self.assertEqual(list(bars.index), [b['ts'] for b in expected])
+            for field in ['Open', 'High', 'Low', 'Close', 'Volume', 'Closed']:
+                self.assertEqual(list(bars[field]), [b[field] for b in expected], field)
+            # the data ends at the end of a day, nothing is left forming
+            self.assertIsNone(forming)
+            # a bar never spans two days
+            self.assertTrue(((bars.index // 86400) == ((bars['Closed'] - 60) // 86400)).all())
+
+    def test_forming(self):
+        from src.utils.bars import build_bars
+        klines = self.klines.iloc[:1510]
+        bars = build_bars(klines, 'volume-1000000')
+        expected, forming = naive_bars(klines, 'Volume', 1e6)
+        self.assertIsNotNone(forming)
+        self.assertEqual(list(bars.index), [b['ts'] for b in expected])
+
+    def test_lookback(self):
+        from src.utils.bars import build_bars, lookback
+        reads = []
+        def read(begin, end):
+            reads.append((begin, end))
+            return self.klines[(self.klines.index >= begin) & (self.klines.index < end)]
+
+        start = 1609459200 + 2 * 86400 + 600
+        built = build_bars(self.klines[self.klines.index < start], 'volume-1000000')
+        closed = (built['Closed'] <= start).sum()
+        for n in [0, 3, closed - 5, closed]:
+            begin = lookback(read, start, {'volume-1000000': n})
+            # whole days, enough of them for n bars, built the same as from all the data
+            self.assertEqual(begin % 86400, 0)
+            bars = build_bars(self.klines[(self.klines.index >= begin) & (self.klines.index < start)], 'volume-1000000')
+            self.assertGreaterEqual((bars['Closed'] <= start).sum(), n)
+            self.assertTrue(bars.equals(built[built.index >= begin]))
+            if n:
+                self.assertLess(built.index[closed - n] - begin, 86400)
+        # nothing read before the data
+        self.assertEqual(lookback(read, start, {'volume-1000000': closed + 1}), 1609459200)
+        self.assertEqual(lookback(read, start, {'volume-1000000': 0}), start - 600)
+
+@unittest.skipUnless(importlib.util.find_spec('pandas_ta'), 'indicators need pandas_ta')
+class TestBarJoin(unittest.TestCase):
+    def test_no_look_ahead(self):
+        import numpy as np
+        import pandas as pd
+        from src.engine.engine import Engine
+        from src.engine.strategy import strategy
+        from src.utils.bars import build_bars
+        engine = Engine(strategy = dict(strategy, signal = [{"name": "hma", "properties": {"interval": "volume-1000000", "length": 9}}]))
+        self.assertEqual(list(engine.bars), ['volume-1000000'])
+
+        rng = np.random.default_rng(2)
+        close = 30000 + np.cumsum(rng.normal(0, 10, 1440))
+        engine.klines['1m'] = pd.DataFrame({'Open': close, 'High': close + 5, 'Low': close - 5, 'Close': close,
+            'Volume': rng.integers(1, 100, 1440).astype(float) * 1000}, index = [1609459200 + 60 * i for i in range(1440)])
+        engine.bars['volume-1000000'] = bars = build_bars(engine.klines['1m'].assign(TurnOver = 0.0), 'volume-1000000')
+        table = engine._join_indis({'volume-1000000': pd.DataFrame({'hma': np.arange(len(bars.index))}, index = bars.index)})
+
+        joined = table['volume-1000000'].to_numpy()
+        for ts, opened in zip(table.index, joined):
+            if opened == -1:
+                self.assertLess(ts, bars['Closed'].iloc[0])
+            else:
+                # the last bar closed by ts, never the one forming
+                position = bars.index.get_loc(opened)
+                self.assertLessEqual(bars['Closed'].iloc[position], ts)
+                if position + 1 < len(bars.index):
+                    self.assertGreater(bars['Closed'].iloc[position + 1], ts)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+import unittest
+import urllib.parse
+
+from aiohttp import web
+
+SECRET = 'secret'
+
+class StandIn():
+    """Local stand-in for the bybit REST api, checks signatures and can be slow or flaky on purpose"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.failures = {}
+        self.delay = 0
+        self.app = web.Application()
+        self.app.router.add_get('/v2/public/kline/list', self.kline)
+        self.app.router.add_get('/position/list', self.slow)
+        self.app.router.add_get('/v5/market/funding/history', self.funding)
+        self.app.router.add_post('/v2/private/order/create', self.create)
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    def verify(self, payload):
+        sign = payload.pop('sign')
+        param_str = urllib.parse.urlencode(dict(sorted(payload.items())))
+        return sign == hmac.new(SECRET.encode(), param_str.encode(), hashlib.sha256).hexdigest()
+
+    def flaky(self, path):
+        if self.failures.get(path):
+            self.failures[path] -= 1
+            return True
+
+    async def kline(self, request):
+        if self.flaky('kline'):
+            return web.Response(status = 503, text = 'busy')
+        payload = dict(request.query)
+        if not self.verify(payload):
+            return web.json_response({'ret_code': 10004, 'ret_msg': 'error sign'})
+
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(self.delay)
+        self.in_flight -= 1
+
+        start, limit = int(payload['from']), int(payload['limit'])
+        end = min(start + limit * 60, 1609459200 + 1000 * 60)
+        rows = [{'symbol': 'BTCUSD', 'interval': '1', 'open_time': ts, 'open': '1', 'high': '2', 'low': '0.5',
+            'close': '1.5', 'volume': '10', 'turnover': '0.1'} for ts in range(start, end, 60)]
+        return web.json_response({'ret_code': 0, 'result': rows})
+
+    async def funding(self, request):
+        # public, a request with credentials is refused
+        payload = dict(request.query)
+        if {'api_key', 'timestamp', 'sign'} & set(payload):
+            return web.json_response({'retCode': 10003, 'retMsg': 'API key is invalid.'})
+        start, end = int(payload['startTime']), int(payload['endTime'])
+        rows = [{'symbol': payload['symbol'], 'fundingRate': '0.0001', 'fundingRateTimestamp': str(ts)}
+            for ts in range(1609459200000, 1609459200000 + 10 * 28800000, 28800000) if start <= ts <= end]
+        return web.json_response({'retCode': 0, 'result': {'category': payload['category'], 'list': rows[::-1]}})
+
+    async def slow(self, request):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        await asyncio.sleep(0.2)
+        self.in_flight -= 1
+        return web.json_response({'ret_code': 0, 'result': []})
+
+    async def create(self, request):
+        if self.flaky('create'):
+            return web.json_response({'ret_code': 10006, 'ret_msg': 'too many visits'})
+        payload = json.loads(await request.text())
+        if not self.verify(payload):
+            return web.json_response({'ret_code': 10004, 'ret_msg': 'error sign'})
+        if float(payload['qty']) <= 0:
+            return web.json_response({'ret_code': 10001, 'ret_msg': 'invalid qty'})
+        return web.json_response({'ret_code': 0, 'result': {'order_id': 'abc', 'qty': payload['qty']}})
+
+class TestAsyncBybitRest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        from src.engine.bybit_async import AsyncBybitRest
+        self.server = StandIn()
+        url = await self.server.start()
+        self.bybit = AsyncBybitRest('key', SECRET, 'BTCUSD', url = url, pool_size = 4, backoff = 0.01)
+
+    async def asyncTearDown(self):
+        await self.bybit.close()
+        await self.server.stop()
+
+    async def test_concurrent(self):
+        tic = time.perf_counter()
+        await asyncio.gather(*[self.bybit.get_position_http() for _ in range(8)])
+        elapsed = time.perf_counter() - tic
+
+        # 8 requests of 0.2s over a pool of 4 connections
+        self.assertEqual(self.server.max_in_flight, 4)
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(self.bybit.latency_report()['/position/list']['count'], 8)
+
+    async def test_hist_klines(self):
+        self.server.failures['kline'] = 2
+        rows = await self.bybit.get_hist_klines('BTCUSD', 1, '1609459200', '1609459200')
+        self.assertEqual(rows, [])
+
+        rows = await self.bybit.get_hist_klines('BTCUSD', 1, str(1609459200), str(1609459200 + 1000 * 60))
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(rows[0], [1609459200.0, 1.0, 2.0, 0.5, 1.5, 10.0, 0.1])
+        self.assertEqual([r[0] for r in rows], sorted(r[0] for r in rows))
+
+    async def test_hist_klines_paced(self):
+        from src.engine.bybit_async import AsyncBybitRest
+        # 5 pages of 0.1s, 2 at a time: a page waiting for a connection doesn't time out
+        self.server.delay = 0.1
+        bybit = AsyncBybitRest('key', SECRET, 'BTCUSD', url = self.bybit.url, pool_size = 2, retries = 0, timeout = 0.25)
+        rows = await bybit.get_hist_klines('BTCUSD', 1, str(1609459200), str(1609459200 + 1000 * 60))
+        await bybit.close()
+        self.assertEqual(len(rows), 1000)
+        self.assertEqual(self.server.max_in_flight, 2)
+
+    async def test_funding_history(self):
+        rows = await self.bybit.get_funding_history('BTCUSD', 1609459200, 1609459200 + 5 * 28800)
+        self.assertEqual(rows, [[1609459200 + i * 28800, 0.0001] for i in range(6)])
+
+    async def test_errors(self):
+        from src.engine.bybit_async import BybitAPIError, BybitConnectionError, AsyncBybitRest
+
+        # rate limit rejections are retried, even for orders
+        self.server.failures['create'] = 1
+        resp = await self.bybit.place_active_order(side = 'Buy', order_type = 'Market', qty = 10)
+        self.assertEqual(resp['result']['order_id'], 'abc')
+
+        with self.assertRaises(BybitAPIError) as ctx:
+            await self.bybit.place_active_order(side = 'Buy', order_type = 'Market', qty = 0)
+        self.assertEqual(ctx.exception.ret_code, 10001)
+
+        unreachable = AsyncBybitRest('key', SECRET, 'BTCUSD', url = 'http://127.0.0.1:9', retries = 1, backoff = 0.01)
+        with self.assertRaises(BybitConnectionError):
+            await unreachable.get_ticker()
+        await unreachable.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+class Response():
+    def __init__(self, body):
+        self.body = body
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.body
+
+class TestBybitRest(unittest.TestCase):
+    def setUp(self):
+        from src.engine.bybit_rest import BybitRest
+        self.bybit = BybitRest(api_key = 'key', secret = 'secret', symbol = 'BTCUSD')
+        self.sent = []
+        def send(prepped):
+            self.sent.append(prepped)
+            return Response({'retCode': 0, 'result': {'list': [{'fundingRate': '0.0001', 'fundingRateTimestamp': '1609459200000'}]}})
+        self.bybit.s.send = send
+
+    def test_funding_history(self):
+        import urllib.parse
+        rows = self.bybit.get_funding_history('BTCUSD', 1609459200 - 28800, 1609459200 + 28800)
+        self.assertEqual(rows, [[1609459200, 0.0001]])
+
+        # a public v5 request, without the v2 credentials
+        url = urllib.parse.urlparse(self.sent[0].url)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        self.assertEqual(url.path, '/v5/market/funding/history')
+        self.assertEqual(query, {'category': 'inverse', 'symbol': 'BTCUSD', 'startTime': str((1609459200 - 28800) * 1000),
+            'endTime': str((1609459200 + 28800) * 1000), 'limit': '200'})
+
+    def test_signed(self):
+        import urllib.parse
+        self.bybit.get_position_http()
+        query = dict(urllib.parse.parse_qsl(urllib.parse.urlparse(self.sent[0].url).query))
+        self.assertEqual(query['api_key'], 'key')
+        self.assertIn('sign', query)
+
+if __name__ == '__main__':
+    unittest.main()
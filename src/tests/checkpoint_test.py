@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestCheckpoints(unittest.TestCase):
+    def setUp(self):
+        from src.utils.checkpoint import Checkpoints
+        self.dir = tempfile.mkdtemp()
+        self.checkpoints = Checkpoints(self.dir, every = 0)
+        self.run = {"kind": "backtest", "strategy": {"risk": 5}, "args": ["2021-01-01", "2021-02-01"], "chunk": None}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save(self):
+        from src.utils.result_cache import engine_version
+        key = self.checkpoints.save(self.run, {"next": 60})
+        key = self.checkpoints.save(self.run, {"next": 120})
+        # one file per run, the last save wins
+        self.assertEqual(os.listdir(self.dir), [f"{key}.ckpt"])
+        checkpoint = self.checkpoints.load(key)
+        self.assertEqual(checkpoint["run"], self.run)
+        self.assertEqual(checkpoint["state"], {"next": 120})
+        self.assertEqual(checkpoint["engine"], engine_version())
+
+        other = self.checkpoints.save(dict(self.run, chunk = 1440), {"next": 180})
+        self.assertNotEqual(other, key)
+        os.utime(os.path.join(self.dir, f"{key}.ckpt"), (0, 0))
+        self.assertEqual(self.checkpoints.load()["key"], other)
+        self.assertEqual([c["key"] for c in self.checkpoints.list()], [key, other])
+
+        self.assertTrue(self.checkpoints.remove(self.run))
+        self.assertFalse(self.checkpoints.remove(self.run))
+        self.assertIsNone(self.checkpoints.load(key))
+
+    def test_due(self):
+        from src.utils.checkpoint import Checkpoints
+        checkpoints = Checkpoints(self.dir, every = 3600)
+        self.assertFalse(checkpoints.due())
+        checkpoints.saved -= 3600
+        self.assertTrue(checkpoints.due())
+        checkpoints.save(self.run, {})
+        self.assertFalse(checkpoints.due())
+
+    def test_account(self):
+        from src.account.test_account import TestAccount
+        from src.account.funding import FundingSchedule
+        account = TestAccount(startbalance = 1, funding = FundingSchedule([1609459200], [1e-6]))
+        account.open("long", 50000, 49000, 51000, 5, timestamp = 1609459140)
+        account.place_order("short", "limit", 52000, 53000, 50000, 5)
+        account.dailylost, account.lastbardate = 2, 1609459140
+
+        key = self.checkpoints.save(self.run, {"account": account.checkpoint()})
+        restored = TestAccount(startbalance = 1)
+        restored.restore(self.checkpoints.load(key)["state"]["account"])
+        self.assertEqual(restored.trade, account.trade)
+        self.assertEqual(restored.dailylost, 2)
+        self.assertEqual(len(restored.orders), 1)
+
+        # both carry on the same, funding of the open trade included
+        for a in [account, restored]:
+            a.update(1609459260, {"Open": 50000, "High": 51500, "Low": 50000, "Close": 51000})
+        self.assertEqual(restored.trades, account.trades)
+        self.assertEqual(restored.balance, account.balance)
+        self.assertNotEqual(restored.trades[0]["funding"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+
+class TestFillModel(unittest.TestCase):
+    def setUp(self):
+        import pandas as pd
+        from src.account.fill_model import VolumeFillModel
+
+        # a thin bar, a thick bar and a bar without trades
+        self.klines = pd.DataFrame({
+            "Open": [50000, 50000, 50000],
+            "High": [50100, 50100, 50000],
+            "Low": [49900, 49900, 50000],
+            "Close": [50000, 50000, 50000],
+            "Volume": [10000, 10000000, 0],
+            "TurnOver": [0.2, 200, 0],
+        }, index = [0, 60, 120])
+        self.model = VolumeFillModel.from_klines(self.klines, impact = 0.5, participation = 0.1)
+
+    def test_fill_price(self):
+        thin = self.model.fill_price(10, 'long', 50000, 10000)
+        thick = self.model.fill_price(70, 'long', 50000, 10000)
+        self.assertGreater(thin, thick)
+        self.assertGreater(thick, 50000)
+        # slippage is capped at the bar extreme
+        self.assertEqual(self.model.fill_price(10, 'long', 50000, 10 ** 9), 50100)
+        self.assertEqual(self.model.fill_price(10, 'short', 50000, 10 ** 9), 49900)
+        self.assertLess(self.model.fill_price(70, 'short', 50000, 10000), 50000)
+
+    def test_fillable(self):
+        self.assertEqual(self.model.fillable(0, 500), 1)
+        self.assertAlmostEqual(self.model.fillable(0, 2000), 0.5)
+        self.assertEqual(self.model.fillable(120, 100), 0)
+
+    def test_account(self):
+        from src.account.test_account import TestAccount
+        account = TestAccount(startbalance = 1, fills = self.model)
+        account.open("long", 50000, 49000, 51000, 5, timestamp = 0)
+        self.assertAlmostEqual(account.trade["size"], 1000)
+        self.assertGreater(account.trade["entry"], 50000)
+
+        account.close(49950, is_maker = False, timestamp = 60)
+        self.assertLess(account.trades[0]["exit"], 49950)
+
+        account.open("long", 50000, 49000, 51000, 5, timestamp = 120)
+        self.assertIsNone(account.trade)
+        # only the trade that filled counts against the day
+        self.assertEqual(account.dailytrades, 1)
+
+    def test_resting_entry(self):
+        import pandas as pd
+        from src.account.fill_model import VolumeFillModel
+        from src.account.test_account import TestAccount
+        # the bar without trades, then a thick one
+        klines = pd.concat([self.klines, self.klines.iloc[[1]].set_axis([180]).assign(Open = 50050)])
+        account = TestAccount(startbalance = 1, fills = VolumeFillModel.from_klines(klines, impact = 0.5, participation = 0.1))
+        account.place_order("long", "limit", 50000, 49000, 51000, 5, timestamp = 120)
+        account.update(120, klines.loc[120])
+        self.assertIsNone(account.trade)
+        self.assertTrue(account.orders.has("entry"))
+
+        # an order that didn't fill stays in the book for the next bar
+        account.update(180, klines.loc[180])
+        self.assertIsNotNone(account.trade)
+        self.assertFalse(account.orders.has("entry"))
+        self.assertEqual(account.dailytrades, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+class TestFunding(unittest.TestCase):
+    def setUp(self):
+        import pandas as pd
+        from src.account.funding import FundingSchedule
+        from src.account.test_account import TestAccount
+
+        # one day of 1m bars at a flat 50000, funding settles at 00:00, 08:00 and 16:00
+        index = list(range(0, 86400, 60))
+        funding = pd.Series([0.0001, 0.0002, -0.0001], index = [0, 28800, 57600])
+        self.schedule = FundingSchedule.from_history(index, [50000] * len(index), funding)
+        self.account = TestAccount(startbalance = 1, funding = self.schedule)
+
+    def test_accrued(self):
+        # settlements in (from, to]: only 08:00 and 16:00
+        self.assertAlmostEqual(self.schedule.accrued('long', 50000, 0, 86340), -0.0001)
+        self.assertAlmostEqual(self.schedule.accrued('short', 50000, 0, 86340), 0.0001)
+        self.assertAlmostEqual(self.schedule.accrued('long', 50000, 60, 28800), -0.0002)
+        self.assertEqual(self.schedule.accrued('long', 50000, 28800, 57540), 0)
+
+    def test_gap(self):
+        import pandas as pd
+        from src.account.funding import settlements
+        # no bars from 07:00 to 09:00, the 08:00 settlement is due at the first bar after the gap
+        index = [ts for ts in range(0, 86400, 60) if not 25200 <= ts < 32400]
+        funding = pd.Series([0.0001, 0.0002, -0.0001], index = [0, 28800, 57600])
+        times, fees = settlements(index, [50000] * len(index), funding)
+        self.assertEqual(list(times), [0, 32400, 57600])
+        self.assertAlmostEqual(fees[1], 0.0002 / 50000)
+
+        # a block of the timeline takes the ones from its start on, not those of the block before
+        times, _ = settlements(index[index.index(32400):], [50000] * len(index), funding, start = 28800)
+        self.assertEqual(list(times), [32400, 57600])
+        times, _ = settlements(index[:index.index(32400)], [50000] * len(index), funding, start = 0)
+        self.assertEqual(list(times), [0])
+
+    def test_trade_pays_funding(self):
+        self.account.open("long", 50000, 49000, 51000, 5, timestamp = 60)
+        size = self.account.trade['size']
+        self.account.close(51000, timestamp = 30000)
+
+        trade = self.account.trades[0]
+        self.assertAlmostEqual(trade['funding'], -size / 50000 * 0.0002)
+
+        # same trade without funding
+        from src.account.test_account import TestAccount
+        flat = TestAccount(startbalance = 1)
+        flat.open("long", 50000, 49000, 51000, 5, timestamp = 60)
+        flat.close(51000, timestamp = 30000)
+        self.assertAlmostEqual(trade['result']['profit'] - flat.trades[0]['result']['profit'], trade['funding'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+class TestLedgerDiff(unittest.TestCase):
+    def setUp(self):
+        self.expected = {
+            "metrics": {"trades": 3, "balance": 1.02, "maxdrawdown": -1.5},
+            "trades": [{"side": "long", "entry": 100 + i, "exit": 101 + i, "opentimestamp": 60 * i, "targets": [(102.5, 0.5)],
+                "result": {"stopped": False, "profit": 0.01, "balance": {"before": 1, "after": 1.01}}} for i in range(3)]
+        }
+
+    def actual(self, **changes):
+        import copy
+        actual = copy.deepcopy(self.expected)
+        for key, value in changes.items():
+            i, field = key.split('_', 1)
+            actual['trades'][int(i)][field] = value
+        return actual
+
+    def test_same(self):
+        from src.utils.ledger_diff import diff_results
+        self.assertIsNone(diff_results(self.expected, self.actual()))
+        # tuples read back from json as lists
+        self.assertIsNone(diff_results(self.expected, self.actual(**{"0_targets": [[102.5, 0.5]]})))
+
+    def test_first_trade(self):
+        from src.utils.ledger_diff import diff_results
+        report = diff_results(self.expected, self.actual(**{"1_exit": 102.5, "2_side": "short"}))
+        self.assertTrue(report.startswith("trade 1 of 3 differs"))
+        self.assertIn("exit", report)
+        self.assertNotIn("side", report)
+
+        report = diff_results(self.expected, self.actual(**{"0_result": {"stopped": True, "profit": 0.01, "balance": {"before": 1, "after": 1.01}}}))
+        self.assertIn("result.stopped", report)
+
+    def test_tolerance(self):
+        from src.utils.ledger_diff import diff_results
+        actual = self.actual(**{"2_exit": 103 + 1e-12})
+        self.assertIsNotNone(diff_results(self.expected, actual))
+        self.assertIsNone(diff_results(self.expected, actual, tolerance = 1e-9))
+
+    def test_missing_trade(self):
+        from src.utils.ledger_diff import diff_results
+        actual = self.actual()
+        actual['trades'].pop()
+        self.assertTrue(diff_results(self.expected, actual).startswith("3 trades, 2 actual. First golden only trade 2"))
+
+        actual = self.actual()
+        actual['metrics']['balance'] = 1.03
+        self.assertIn("metrics differ", diff_results(self.expected, actual))
+
+@unittest.skipUnless(importlib.util.find_spec('pandas_ta'), 'indicators need pandas_ta')
+class TestGolden(unittest.TestCase):
+    def setUp(self):
+        from src.engine import golden
+        self.golden = golden
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_variants(self):
+        # every variant agrees with the in memory run it is recorded from
+        references = {name: self.golden.REFERENCES[name] for name in ['default', 'trail-targets', 'limit']}
+        recorded = self.golden.record(os.path.join(self.dir, 'golden.json'), references)
+        for name, variant, report in self.golden.verify(recorded, ['chunked', 'sharded', 'trial', 'resumed', 'chunked-resumed']):
+            self.assertIsNone(report, f"{name} {variant}\n{report}")
+
+    def test_jumps(self):
+        # jumping over the bars that can't change anything gives the ledger of stepping through every one
+        from unittest import mock
+        from src.engine.backtester import Backtester
+        from src.engine.strategy import strategy
+        from src.utils.ledger_diff import diff_results
+        from src.utils.utils import date_to_seconds
+        start_ts, end_ts = [date_to_seconds(d) for d in self.golden.RANGE]
+
+        blocked = []
+        def step(engine, index, entries, timestamps, position):
+            if engine.account.trade is None and not engine.account.orders and not engine._check_risk_management():
+                blocked.append(position)
+            return position
+
+        with self.golden.fixtures() as (paths, funding):
+            # stop and take profit only, a trailing stop with partial targets
+            for name in ['default', 'trail-targets']:
+                changes = self.golden.REFERENCES[name]
+                jumped = self.golden.result(self.golden._memory(dict(strategy, **changes), paths, funding, start_ts, end_ts))
+                with mock.patch.object(Backtester, '_next_bar', step):
+                    stepped = self.golden.result(self.golden._memory(dict(strategy, **changes), paths, funding, start_ts, end_ts))
+                self.assertGreater(len(stepped['trades']), 0)
+                self.assertIsNone(diff_results(stepped, jumped), name)
+        # days blocked by the daily counters were jumped over too
+        self.assertTrue(blocked)
+
+    def test_missing_bar(self):
+        from src.engine.strategy import strategy
+        from src.utils.utils import date_to_seconds
+        start_ts, end_ts = [date_to_seconds(d) for d in self.golden.RANGE]
+        with self.golden.fixtures() as (paths, funding):
+            # a 1m bar a day into the range is missing from the data
+            with open(paths['1m']) as f:
+                lines = f.readlines()
+            with open(paths['1m'], 'w') as f:
+                f.writelines(line for line in lines if int(line.split(',')[0]) != start_ts + 86400 + 3600)
+
+            memory = self.golden.result(self.golden._memory(strategy, paths, funding, start_ts, end_ts))
+            chunked = self.golden.result(self.golden._chunked(strategy, paths, funding, start_ts, end_ts))
+        self.assertGreater(len(memory['trades']), 0)
+        self.assertEqual(memory, chunked)
+
+    @unittest.skipUnless(os.path.exists(os.path.join(os.path.dirname(__file__), 'golden', 'golden.json')), 'no golden results recorded')
+    def test_golden(self):
+        for name, variant, report in self.golden.verify(self.golden.load()):
+            self.assertIsNone(report, f"{name} {variant}\n{report}")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import importlib.util
+
+@unittest.skipUnless(importlib.util.find_spec('pandas_ta'), 'indicators need pandas_ta')
+class TestIndicators(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        import pandas as pd
+        rng = np.random.default_rng(3)
+        self.klines = {}
+        for interval, seconds, n in [('15m', 900, 400), ('1h', 3600, 200)]:
+            close = 100 + np.cumsum(rng.normal(0, 1, n))
+            self.klines[interval] = pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close},
+                index = [1609459200 + seconds * i for i in range(n)])
+
+    def test_shared_nodes(self):
+        from src.utils.indicators import IndicatorGraph, hma, ao
+        graph = IndicatorGraph(self.klines)
+        hma({"interval": "1h", "length": 21, "offset": 2}, graph)
+        hma({"interval": "1h", "length": 21, "offset": 3}, graph)
+        ao({"interval": "1h", "fast": 5, "slow": 34, "offset": 1}, graph)
+
+        # one hma and one ao, the offsets are shifts of them
+        self.assertEqual(len([k for k in graph.nodes if k[0] == 'hma']), 1)
+        self.assertEqual(len([k for k in graph.nodes if k[0] == 'shift']), 3)
+        self.assertEqual(len([k for k in graph.nodes if k[0] == 'kline']), 3)
+
+    def test_offset(self):
+        import pandas_ta as ta
+        from src.utils.indicators import calc_indis
+        frames = calc_indis([{"name": "hma", "properties": {"interval": "1h", "length": 21, "offset": 2}}], self.klines)
+        close = self.klines['1h']['Close']
+        base, shifted = ta.hma(close, 21), ta.hma(close, 21, 2)
+        expected = [None if base.isna().iloc[i] or shifted.isna().iloc[i] else bool(base.iloc[i] > shifted.iloc[i]) for i in range(len(close))]
+        self.assertEqual(list(frames['1h']['hma']), expected)
+
+    def test_atr_properties(self):
+        from src.utils.indicators import calc_indis, warmup
+        spec = {"name": "atr", "properties": {"interval": "15m", "length": 14}}
+        atr = calc_indis([spec], self.klines)['15m']['atr']
+        self.assertEqual(len(atr.index), 400)
+        # settled after its own length, not the 24 it used to be stuck at
+        self.assertLess(atr.isna().sum(), 16)
+        self.assertEqual(warmup(spec), ('15m', 560))
+
+    def test_evaluate(self):
+        from src.utils.indicators import IndicatorGraph
+        calls = []
+        graph = IndicatorGraph(self.klines)
+        a = graph.add('a', lambda: calls.append('a') or 1)
+        b = graph.add('b', lambda: calls.append('b') or 2)
+        c = graph.add('c', lambda x, y: calls.append('c') or x + y, a, b)
+        graph.add('a', lambda: calls.append('again') or 3)
+        self.assertEqual(graph.evaluate(workers = 2)[c], 3)
+        self.assertEqual(sorted(calls), ['a', 'b', 'c'])
+        self.assertEqual(calls[-1], 'c')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+class TestKlineShm(unittest.TestCase):
+    def setUp(self):
+        from src.utils.kline_shm import KlineService
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'kline_1m.csv')
+        self.write(1000)
+        self.service = KlineService(os.path.join(self.dir, 'shm'))
+
+    def tearDown(self):
+        self.service.close()
+        self.service.unpublish('BTCUSD', '1m')
+        self.service.gc()
+        shutil.rmtree(self.dir)
+
+    def write(self, n):
+        with open(self.filename, 'w') as f:
+            for i in range(n):
+                f.write(f"{1609459200 + i * 60},{100.0 + i},101.0,99.0,100.5,10,0.1,x\n")
+
+    def exists(self, name):
+        return os.path.exists(f"/dev/shm/{name}")
+
+    def descriptor(self):
+        with open(os.path.join(self.dir, 'shm', 'BTCUSD_1m.json')) as f:
+            return json.load(f)
+
+    def test_attach(self):
+        import numpy as np
+        handle = self.service.attach('BTCUSD', '1m', self.filename)
+        frame = handle.frame()
+        self.assertEqual(frame.index[-1], 1609459200 + 999 * 60)
+        self.assertEqual(frame['Open'].iloc[10], 110.0)
+        # a view of the segment, read-only
+        self.assertTrue(np.shares_memory(frame['Open'].values, handle.values))
+        with self.assertRaises(ValueError):
+            handle.values[0, 0] = 1
+
+        # a separately launched process attaches to the same segment, which outlives it
+        code = (f"import sys; sys.path.insert(0, {ROOT!r}); from src.utils.kline_shm import KlineService; "
+            f"s = KlineService({os.path.join(self.dir, 'shm')!r}); h = s.attach('BTCUSD', '1m', {self.filename!r}); "
+            f"print(h.name, h.frame()['Open'].sum()); s.close()")
+        out = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, check = True, cwd = ROOT)
+        self.assertEqual(out.stdout.split(), [handle.name, str(frame['Open'].sum())])
+        self.assertEqual(out.stderr, '')
+        self.assertTrue(self.exists(handle.name))
+
+    def test_refcount(self):
+        first = self.service.attach('BTCUSD', '1m', self.filename)
+        second = self.service.attach('BTCUSD', '1m', self.filename)
+        self.assertEqual(first.name, second.name)
+        self.assertEqual(len(self.descriptor()['segments'][first.name]['holders']), 2)
+
+        self.service.release(first)
+        self.assertTrue(self.exists(second.name))
+        self.service.release(second)
+        self.assertFalse(self.exists(second.name))
+        self.assertEqual(self.descriptor()['segments'], {})
+
+    def test_changed_file(self):
+        old = self.service.attach('BTCUSD', '1m', self.filename)
+        self.write(1200)
+        new = self.service.attach('BTCUSD', '1m', self.filename)
+        self.assertNotEqual(old.name, new.name)
+        self.assertEqual(len(new.frame().index), 1200)
+
+        # the stale segment lives until its holder is done
+        self.assertTrue(self.exists(old.name))
+        self.service.release(old)
+        self.assertFalse(self.exists(old.name))
+        self.assertTrue(self.exists(new.name))
+
+    def test_pinned(self):
+        name = self.service.publish('BTCUSD', '1m', self.filename)
+        handle = self.service.attach('BTCUSD', '1m', self.filename)
+        self.assertEqual(handle.name, name)
+        self.service.release(handle)
+        self.assertTrue(self.exists(name))
+
+        self.service.unpublish('BTCUSD', '1m')
+        self.assertFalse(self.exists(name))
+
+    def test_dead_holder(self):
+        # a run that dies without releasing
+        code = (f"import sys; sys.path.insert(0, {ROOT!r}); from src.utils.kline_shm import KlineService; "
+            f"h = KlineService({os.path.join(self.dir, 'shm')!r}).attach('BTCUSD', '1m', {self.filename!r}); print(h.name)")
+        name = subprocess.run([sys.executable, '-c', code], capture_output = True, text = True, check = True, cwd = ROOT).stdout.strip()
+        self.assertTrue(self.exists(name))
+        self.assertEqual(self.service.gc(), 1)
+        self.assertFalse(self.exists(name))
+
+if __name__ == '__main__':
+    unittest.main()
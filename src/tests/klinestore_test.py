@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+class TestKlineStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.dir, 'kline_1m.csv')
+        with open(self.filename, 'w') as f:
+            for i in range(1000):
+                ts = 1609459200 + i * 60
+                f.write(f"{ts},100.0,101.0,99.0,100.5,10,0.1,x\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_read_bounds(self):
+        from src.utils.kline_store import read_bounds
+        self.assertEqual(read_bounds(self.filename), (1609459200, 1609459200 + 999 * 60))
+        self.assertIsNone(read_bounds(os.path.join(self.dir, 'missing.csv')))
+
+    def test_stream(self):
+        from src.utils.kline_store import stream_klines
+        start, end = 1609459200 + 150 * 60, 1609459200 + 420 * 60
+        blocks = list(stream_klines(self.filename, start, end, rows = 100))
+        self.assertEqual(sum(len(b.index) for b in blocks), 270)
+        self.assertEqual(blocks[0].index[0], start)
+        self.assertEqual(blocks[-1].index[-1], end - 60)
+
+    def test_read_range(self):
+        from src.utils.kline_store import read_klines
+        klines = read_klines(self.filename, 1609459200 + 150 * 60 + 30, 1609459200 + 420 * 60)
+        self.assertEqual(list(klines.index), [1609459200 + i * 60 for i in range(151, 420)])
+        self.assertEqual(klines['Date'].iloc[0][:10], '2021-01-01')
+        self.assertEqual(len(read_klines(self.filename, 1609459200 + 2000 * 60, 1609459200 + 3000 * 60).index), 0)
+        self.assertEqual(len(read_klines(self.filename).index), 1000)
+
+    def test_window(self):
+        from src.utils.kline_store import KlineWindow
+        window = KlineWindow(self.filename, 1609459200, 1609459200 + 1000 * 60, rows = 64)
+        seen = []
+        for lower in range(1609459200, 1609459200 + 1000 * 60, 300 * 60):
+            frame = window.advance(lower, lower + 300 * 60)
+            seen += list(frame.index)
+            # nothing before the block is kept around
+            self.assertGreaterEqual(window.frame.index[0], lower)
+        self.assertEqual(seen, [1609459200 + i * 60 for i in range(1000)])
+
+    def test_append_in_progress(self):
+        from src.utils.kline_store import read_bounds, read_klines, stream_klines, range_fingerprint
+        before = range_fingerprint([self.filename], 1609459200, 1609459200 + 2000 * 60)
+        # a sync is halfway through appending a line
+        with open(self.filename, 'a') as f:
+            f.write(f"{1609459200 + 1000 * 60},100.0,10")
+
+        self.assertEqual(read_bounds(self.filename), (1609459200, 1609459200 + 999 * 60))
+        self.assertEqual(len(read_klines(self.filename).index), 1000)
+        self.assertEqual(read_klines(self.filename, 1609459200 + 990 * 60, 1609459200 + 2000 * 60).index[-1], 1609459200 + 999 * 60)
+        self.assertEqual(list(stream_klines(self.filename, 1609459200 + 1000 * 60, 1609459200 + 2000 * 60)), [])
+        self.assertEqual(range_fingerprint([self.filename], 1609459200, 1609459200 + 2000 * 60), before)
+
+    def test_range_fingerprint(self):
+        from src.utils.kline_store import seek_timestamp, range_fingerprint
+        with open(self.filename, 'rb') as f:
+            self.assertEqual(seek_timestamp(f, 0), 0)
+            offset = seek_timestamp(f, 1609459200 + 10 * 60 + 1)
+            f.seek(offset)
+            self.assertTrue(f.readline().startswith(b"1609459860,"))
+
+        start, end = 1609459200 + 100 * 60, 1609459200 + 200 * 60
+        before = range_fingerprint([self.filename], start, end)
+
+        # newer data appended after the range does not change it, a change inside the range does
+        with open(self.filename, 'a') as f:
+            f.write(f"{1609459200 + 1000 * 60},1,1,1,1,1,1,x\n")
+        self.assertEqual(range_fingerprint([self.filename], start, end), before)
+
+        with open(self.filename) as f:
+            lines = f.readlines()
+        lines[150] = lines[150].replace("100.5", "100.6")
+        with open(self.filename, 'w') as f:
+            f.writelines(lines)
+        self.assertNotEqual(range_fingerprint([self.filename], start, end), before)
+
+if __name__ == '__main__':
+    unittest.main()
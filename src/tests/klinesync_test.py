@@ -0,0 +1,106 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+START = 1609459200
+
+class FakeBybit():
+    """Serves 1m klines from `listed` to `now`, 200 a page like bybit"""
+
+    def __init__(self, listed, now, fail_after = None):
+        self.listed = listed
+        self.now = now
+        self.fail_after = fail_after
+        self.calls = []
+
+    def kline(self, symbol = None, interval = None, _from = None, limit = None):
+        if self.fail_after is not None and len(self.calls) >= self.fail_after:
+            raise ConnectionError('connection reset')
+        self.calls.append(_from)
+        first = max(_from + (-_from) % 60, self.listed)
+        return {'result': [{'symbol': symbol, 'interval': interval, 'open_time': ts, 'open': 100, 'high': 101, 'low': 99,
+            'close': 100.5, 'volume': 10, 'turnover': 0.1} for ts in range(first, min(first + limit * 60, self.now), 60)]}
+
+class TestKlineSync(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.paths = {'1m': os.path.join(self.dir, 'kline_1m.csv')}
+        self.manifest = os.path.join(self.dir, 'klines.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def sync(self, bybit, start, end, chunk = 20000):
+        from src.utils.kline_sync import KlineSync
+        KlineSync(bybit, paths = self.paths, manifest = self.manifest, chunk = chunk).sync(start, end)
+
+    def timestamps(self):
+        with open(self.paths['1m']) as f:
+            return [int(line.split(',')[0]) for line in f]
+
+    def test_extend_and_backfill(self):
+        bybit = FakeBybit(START, START + 5000 * 60)
+        self.sync(bybit, START + 2000 * 60, START + 3000 * 60)
+        self.assertEqual(self.timestamps(), list(range(START + 2000 * 60, START + 3000 * 60, 60)))
+
+        bybit.calls = []
+        self.sync(bybit, START + 500 * 60, START + 4000 * 60, chunk = 300)
+        self.assertEqual(self.timestamps(), list(range(START + 500 * 60, START + 4000 * 60, 60)))
+        # only the missing prefix and suffix are asked for
+        self.assertTrue(all(ts < START + 2000 * 60 or ts >= START + 3000 * 60 for ts in bybit.calls))
+
+    def test_append(self):
+        bybit = FakeBybit(START, START + 3000 * 60)
+        self.sync(bybit, START + 1000 * 60, START + 1500 * 60)
+        inode = os.stat(self.paths['1m']).st_ino
+
+        # newer bars are appended to the file in place, older ones merged in through a new file
+        self.sync(bybit, START + 1000 * 60, START + 2500 * 60, chunk = 300)
+        self.assertEqual(os.stat(self.paths['1m']).st_ino, inode)
+        self.sync(bybit, START + 500 * 60, START + 2500 * 60)
+        self.assertNotEqual(os.stat(self.paths['1m']).st_ino, inode)
+        self.assertEqual(self.timestamps(), list(range(START + 500 * 60, START + 2500 * 60, 60)))
+
+    def test_listing(self):
+        from src.utils.kline_sync import KlineSync
+        bybit = FakeBybit(START + 100 * 60, START + 500 * 60)
+        self.sync(bybit, START, START + 500 * 60)
+        self.assertEqual(self.timestamps()[0], START + 100 * 60)
+        self.assertEqual(KlineSync(bybit, paths = self.paths, manifest = self.manifest).covered('1m'), (START, START + 499 * 60))
+
+        # nothing older is asked for again
+        bybit.calls = []
+        self.sync(bybit, START, START + 500 * 60)
+        self.assertEqual(bybit.calls, [])
+
+    def test_torn_line(self):
+        bybit = FakeBybit(START, START + 1000 * 60)
+        self.sync(bybit, START, START + 400 * 60)
+        with open(self.paths['1m'], 'a') as f:
+            f.write(f"{START + 400 * 60},100.0,10")
+
+        from src.utils.kline_sync import repair
+        self.sync(bybit, START, START + 600 * 60)
+        self.assertEqual(self.timestamps(), list(range(START, START + 600 * 60, 60)))
+        self.assertEqual(repair(self.paths['1m']), 0)
+
+    def test_interrupted_backfill(self):
+        bybit = FakeBybit(START, START + 5000 * 60)
+        self.sync(bybit, START + 3000 * 60, START + 4000 * 60)
+
+        bybit.fail_after = len(bybit.calls) + 4
+        with self.assertRaises(ConnectionError):
+            self.sync(bybit, START, START + 4000 * 60, chunk = 300)
+        # the chunks that made it are in, in order, in front of the old bars
+        timestamps = self.timestamps()
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertEqual(timestamps[0], START)
+
+        bybit.fail_after = None
+        self.sync(bybit, START, START + 4000 * 60, chunk = 300)
+        self.assertEqual(self.timestamps(), list(range(START, START + 4000 * 60, 60)))
+        self.assertFalse(os.path.exists(self.paths['1m'] + '.tmp'))
+
+if __name__ == '__main__':
+    unittest.main()
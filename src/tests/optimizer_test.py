@@ -0,0 +1,53 @@
+import unittest
+import importlib.util
+
+@unittest.skipUnless(importlib.util.find_spec('pandas_ta'), 'indicators need pandas_ta')
+class TestOptimizer(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        from src.engine.strategy import strategy
+        self.strategy = strategy
+        self.rng = np.random.default_rng(1)
+
+    def test_configure(self):
+        from src.engine.optimizer import configure
+        strategy = configure(self.strategy, {"hma.length": 21, "atr.length": 48, "tp-atr": 1.5})
+        self.assertEqual(strategy['signal'][0]['properties']['length'], 21)
+        self.assertEqual(strategy['atr']['properties']['length'], 48)
+        self.assertEqual(strategy['tp-atr'], 1.5)
+        # the base strategy is left alone
+        self.assertEqual(self.strategy['signal'][0]['properties']['length'], 55)
+
+        with self.assertRaises(KeyError):
+            configure(self.strategy, {"rsi.length": 14})
+
+    def test_sample(self):
+        from src.engine.optimizer import sample, grid_size
+        space = {"hma.length": [21, 34], "aroon.length": (10, 12), "tp-atr": (0.5, 3.0)}
+        configs = sample(space, 20, self.rng)
+        self.assertEqual(len(configs), 20)
+        self.assertEqual(len({tuple(sorted(c.items())) for c in configs}), 20)
+        for c in configs:
+            self.assertIn(c["hma.length"], [21, 34])
+            self.assertIn(c["aroon.length"], [10, 11, 12])
+            self.assertTrue(0.5 <= c["tp-atr"] <= 3.0)
+
+        # a small space runs out of distinct points
+        self.assertEqual(len(sample({"hma.length": [21, 34], "aroon.length": [9, 14]}, 10, self.rng)), 4)
+        self.assertEqual(grid_size({"hma.length": [21, 34], "aroon.length": [9, 14, 25]}), 6)
+        self.assertIsNone(grid_size(space))
+
+    def test_warmup(self):
+        from src.engine.engine import Engine
+        from src.engine.optimizer import configure, warmup_bars
+        base = Engine(strategy = self.strategy)._warmup_bars()
+        self.assertEqual(warmup_bars(self.strategy, []), base)
+
+        # the longest of every candidate and the base strategy, per interval
+        bars = warmup_bars(self.strategy, [{"atr.length": 48, "aroon.length": 9}, {"aroon.length": 25}])
+        self.assertEqual(bars['1h'], Engine(strategy = configure(self.strategy, {"atr.length": 48}))._warmup_bars()['1h'])
+        self.assertGreater(bars['1h'], base['1h'])
+        self.assertEqual(bars['15m'], 26)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+
+def bar(o, h, l, c):
+    return {"Open": o, "High": h, "Low": l, "Close": c}
+
+class TestOrderBook(unittest.TestCase):
+    def setUp(self):
+        from src.account.test_account import TestAccount
+        self.account = TestAccount(startbalance=1)
+
+    def test_triggered(self):
+        from src.account.order_book import OrderBook
+        book = OrderBook()
+        for price in [90, 95, 99]:
+            book.add({"kind": "entry", "side": "long", "type": "limit", "price": price})
+        for price in [101, 105, 110]:
+            book.add({"kind": "entry", "side": "short", "type": "limit", "price": price})
+
+        hits = book.triggered(high = 105, low = 96, open = 100)
+        self.assertEqual([o["price"] for o in hits], [99, 101, 105])
+
+        book.cancel(hits[0]["id"])
+        self.assertEqual([o["price"] for o in book.triggered(105, 96, 100)], [101, 105])
+
+    def test_limit_entry(self):
+        self.account.place_order("long", "limit", 49000, stop = 48000, tp = 51000, risk = 5, expire = 600)
+        self.account.update(0, bar(50000, 50100, 49500, 49600))
+        self.assertIsNone(self.account.trade)
+
+        self.account.update(60, bar(49600, 49700, 48900, 49100))
+        self.assertEqual(self.account.trade["entry"], 49000)
+        self.assertFalse(self.account.orders.has("entry"))
+
+    def test_entry_expires(self):
+        self.account.place_order("short", "stop", 49000, stop = 50000, tp = 47000, expire = 120)
+        self.account.update(120, bar(50000, 50100, 49500, 49600))
+        self.account.update(180, bar(49600, 49700, 48900, 49100))
+        self.assertIsNone(self.account.trade)
+        self.assertEqual(len(self.account.orders), 0)
+
+    def test_trailing_stop(self):
+        self.account.open("long", 50000, risk = 5, trail = 500, timestamp = 0)
+        self.assertEqual(self.account.trade["stop"], 49500)
+
+        self.account.update(60, bar(50000, 51000, 49900, 50900))
+        self.assertEqual(self.account.trade["stop"], 50500)
+
+        self.account.update(120, bar(50900, 50950, 50400, 50450))
+        self.assertEqual(len(self.account.trades), 1)
+        self.assertEqual(self.account.trades[0]["exit"], 50500)
+        self.assertTrue(self.account.trades[0]["result"]["stopped"])
+
+    def test_partial_takeprofits(self):
+        self.account.open("long", 50000, 49000, 53000, 5, timestamp = 0, targets = [(51000, 0.5), (52000, 0.25)])
+
+        self.account.update(60, bar(50000, 51500, 49900, 51400))
+        self.assertEqual(len(self.account.trade["takeprofits"]), 1)
+        self.assertAlmostEqual(self.account.trade["size"], self.account.trade["initialsize"] * 0.5)
+
+        self.account.update(120, bar(51400, 53100, 51300, 53000))
+        self.assertIsNone(self.account.trade)
+        trade = self.account.trades[0]
+        self.assertEqual(len(trade["takeprofits"]), 2)
+        self.assertEqual(trade["exit"], 53000)
+        self.assertAlmostEqual(trade["result"]["balance"]["after"] - trade["result"]["balance"]["before"], trade["result"]["profit"])
+        self.assertEqual(len(self.account.orders), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+def snapshots(n, seed = 1):
+    """Random L2 books of 25 levels a side around a drifting mid, as bybit returns them"""
+    rng = np.random.default_rng(seed)
+    mid = 100000
+    sizes = rng.integers(1, 200000, 50)
+    for i in range(n):
+        mid += int(rng.integers(-2, 3))
+        changed = rng.random(50) < 0.2
+        sizes = np.where(changed, rng.integers(1, 200000, 50), sizes)
+        levels = [{'price': f"{(mid - 1 - k) * 0.5:.1f}", 'symbol': 'BTCUSD', 'id': mid - 1 - k, 'side': 'Buy', 'size': int(sizes[k])} for k in range(25)]
+        levels += [{'price': f"{(mid + k) * 0.5:.1f}", 'symbol': 'BTCUSD', 'id': mid + k, 'side': 'Sell', 'size': int(sizes[25 + k])} for k in range(25)]
+        yield 1609459200000 + i * 1000, levels
+
+class TestOrderBookStore(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'orderbook')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def record(self, n, keyframe = 50):
+        from src.utils.orderbook_store import OrderBookRecorder, book_from_l2
+        recorder = OrderBookRecorder(self.path, tick = 0.5, keyframe = keyframe)
+        books, raw = [], 0
+        for ts, levels in snapshots(n):
+            recorder.record_l2(ts, levels)
+            books.append((ts,) + book_from_l2(levels, 0.5))
+            raw += len(json.dumps(levels))
+        recorder.close()
+        return books, raw
+
+    def test_replay(self):
+        from src.utils.orderbook_store import OrderBookReplay
+        books, raw = self.record(500)
+
+        replay = OrderBookReplay(self.path)
+        replayed = list(replay.replay())
+        self.assertEqual(len(replayed), 500)
+        for (ts, prices, sizes), (ts_r, prices_r, sizes_r) in zip(books, replayed):
+            self.assertEqual(ts, ts_r)
+            np.testing.assert_array_equal(prices, prices_r)
+            np.testing.assert_array_equal(sizes, sizes_r)
+
+        # a small fraction of the json snapshots
+        self.assertLess(os.path.getsize(f"{self.path}.bin") + os.path.getsize(f"{self.path}.idx"), raw * 0.1)
+
+    def test_seek(self):
+        from src.utils.orderbook_store import OrderBookReplay
+        books, _ = self.record(300)
+        replay = OrderBookReplay(self.path)
+
+        for i in [0, 49, 50, 51, 137, 299]:
+            ts, prices, sizes = replay.book_at(books[i][0] + 500)
+            self.assertEqual(ts, books[i][0])
+            np.testing.assert_array_equal(prices, books[i][1])
+            np.testing.assert_array_equal(sizes, books[i][2])
+
+        self.assertIsNone(replay.book_at(books[0][0] - 1))
+        self.assertEqual([ts for ts, _, _ in replay.replay(books[120][0], books[130][0])], [b[0] for b in books[120:130]])
+
+    def test_torn_write(self):
+        from src.utils.orderbook_store import OrderBookRecorder, OrderBookReplay
+        books, _ = self.record(120)
+        with open(f"{self.path}.bin", 'ab') as f:
+            f.write(b'D\x00\x01')
+
+        self.assertEqual(len(list(OrderBookReplay(self.path).replay())), 120)
+
+        # appending after the torn record drops it
+        recorder = OrderBookRecorder(self.path)
+        recorder.record(books[-1][0] + 1000, books[0][1], books[0][2])
+        recorder.close()
+        replayed = list(OrderBookReplay(self.path).replay())
+        self.assertEqual(len(replayed), 121)
+        np.testing.assert_array_equal(replayed[-1][2], books[0][2])
+
+    def test_torn_index(self):
+        from src.utils.orderbook_store import OrderBookRecorder, OrderBookReplay, INDEX_DTYPE
+        books, _ = self.record(120, keyframe = 10)
+        size = os.path.getsize(f"{self.path}.bin")
+        # the last keyframe's record is torn, its index entry made it, and half of one more entry
+        os.truncate(f"{self.path}.bin", int(OrderBookReplay(self.path).index['offset'][-1]) + 5)
+        with open(f"{self.path}.idx", 'ab') as f:
+            f.write(np.array([(books[-1][0] + 1000, size)], dtype = INDEX_DTYPE).tobytes()[:7])
+
+        recorder = OrderBookRecorder(self.path, keyframe = 10)
+        for ts, prices, sizes in books[:25]:
+            recorder.record(ts + 200000, prices, sizes)
+        recorder.close()
+
+        replay = OrderBookReplay(self.path)
+        self.assertEqual(os.path.getsize(f"{self.path}.idx") % INDEX_DTYPE.itemsize, 0)
+        self.assertEqual(list(replay.index['ts']), sorted(replay.index['ts']))
+        self.assertTrue(all(replay._read(int(offset))[0] == b'K' for offset in replay.index['offset']))
+        # the books before the torn keyframe, then the new ones, all found through the index
+        expected = books[:110] + [(ts + 200000, prices, sizes) for ts, prices, sizes in books[:25]]
+        self.assertEqual([ts for ts, _, _ in replay.replay()], [b[0] for b in expected])
+        for ts, prices, sizes in expected[105:]:
+            book = replay.book_at(ts)
+            self.assertEqual(book[0], ts)
+            np.testing.assert_array_equal(book[2], sizes)
+
+    def test_walk_book(self):
+        from src.utils.orderbook_store import walk_book
+        prices = np.array([98, 99, 100, 101, 102])
+        sizes = np.array([30, 20, -10, -20, -50])
+        self.assertEqual(walk_book(prices, sizes, 'long', 10), (100.0, 10.0))
+        self.assertEqual(walk_book(prices, sizes, 'long', 30), ((100 * 10 + 101 * 20) / 30, 30.0))
+        self.assertEqual(walk_book(prices, sizes, 'short', 40), ((99 * 20 + 98 * 20) / 40, 40.0))
+        self.assertEqual(walk_book(prices, sizes, 'long', 500)[1], 80.0)
+
+if __name__ == '__main__':
+    unittest.main()
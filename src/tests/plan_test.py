@@ -0,0 +1,72 @@
+import unittest
+import importlib.util
+
+@unittest.skipUnless(importlib.util.find_spec('pandas_ta'), 'indicators need pandas_ta')
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        import pandas as pd
+        from src.engine.strategy import strategy
+        self.strategy = strategy
+
+        # 00:00 - 00:05 UTC of a day, one row per combination of settled and unsettled signals
+        self.table = pd.DataFrame({
+            'hma': [True, True, False, None, False, np.nan],
+            'aroon': [True, False, False, True, None, False],
+            'Open': [110, 110, 90, 110, 90, 90],
+            'Close': [110, 110, 90, 110, 90, 90],
+            'daily_open': [100, 100, 100, 100, 100, 100],
+            'atr': [5, 5, 5, 5, 5, np.nan]
+        }, index = [1609459200 + 60 * i for i in range(6)])
+
+    def plan(self, **changes):
+        from src.engine.plan import Plan
+        return Plan(dict(self.strategy, **changes))
+
+    def test_default(self):
+        from src.engine.plan import LONG, SHORT
+        table = self.plan(**{'no-trade-hours': []}).masks(self.table)
+        self.assertEqual(list(table[LONG]), [True, False, False, False, False, False])
+        # unsettled signals and an unknown atr never enter
+        self.assertEqual(list(table[SHORT]), [False, False, True, False, False, False])
+
+    def test_expressions(self):
+        plan = self.plan(long = "(hma or aroon) and not Open < daily_open", short = "not hma and Close < daily_open - 2 * atr")
+        self.assertEqual(list(plan.long.evaluate(self.table)), [1, 1, 0, 1, 0, 0])
+        # hma unknown but aroon decides the or, daily_open - 2 * atr is 90 so the short never holds
+        self.assertEqual(list(plan.short.evaluate(self.table)[:5]), [0, 0, 0, 0, 0])
+        self.assertEqual(list(self.plan(long = "95 < Open <= 110").long.evaluate(self.table)), [1, 1, 0, 1, 0, 0])
+
+    def test_history(self):
+        from src.engine.engine import Engine
+        engine = Engine(strategy = self.strategy)
+        start_ts = 1609459200 + 10 * 3600 + 17 * 60
+        history = engine._history(start_ts)
+        # hma 55 on 1h needs 55 + 7 + 2 hours, the atr 960, aroon 14 on 15m 15 bars, the daily open all of the day on 1m
+        self.assertEqual(history['1h'], 1609459200 + 10 * 3600 - 960 * 3600)
+        self.assertEqual(history['15m'], 1609459200 + 10 * 3600 + 15 * 60 - 15 * 900)
+        self.assertEqual(history['1m'], 1609459200)
+
+    def test_bars(self):
+        signal = self.strategy['signal'] + [{"name": "ao", "properties": {"interval": "range-500", "fast": 5, "slow": 34}}]
+        plan = self.plan(signal = signal, atr = {"name": "atr", "properties": {"interval": "volume-50000000", "length": 14}})
+        self.assertEqual(plan.bars, ['range-500', 'volume-50000000'])
+        self.assertEqual(self.plan().bars, [])
+
+    def test_no_trade_hours(self):
+        from src.engine.plan import LONG
+        from datetime import datetime
+        hour = datetime.fromtimestamp(self.table.index[0]).hour
+        self.assertFalse(self.plan(**{'no-trade-hours': [hour]}).masks(self.table)[LONG].any())
+
+    def test_invalid(self):
+        from src.engine.plan import StrategyError
+        for changes in [{'long': 'hma and rsi'}, {'long': 'hma and'}, {'short': 'Open.mean() > 1'}, {'entry': 'iceberg'},
+                {'risk': 0}, {'targets': [[0.5, 0.7], [1, 0.5]]}, {'no-trade-hours': [25]}, {'fills': {'model': 'depth'}},
+                {'atr': {'name': 'atr', 'properties': {'interval': '4h', 'length': 24}}}, {'signal': [{'name': 'nope', 'properties': {}}]},
+                {'atr': {'name': 'atr', 'properties': {'interval': 'volume-0', 'length': 24}}}]:
+            with self.assertRaises(StrategyError, msg = changes):
+                self.plan(**changes)
+
+if __name__ == '__main__':
+    unittest.main()
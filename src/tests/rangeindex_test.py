@@ -0,0 +1,37 @@
+import unittest
+
+class TestRangeIndex(unittest.TestCase):
+    def setUp(self):
+        import numpy as np
+        from src.utils.range_index import RangeIndex
+        rng = np.random.default_rng(5)
+        close = 100 + np.cumsum(rng.normal(0, 1, 1000))
+        self.high, self.low = close + rng.random(1000), close - rng.random(1000)
+        self.index = RangeIndex(self.high, self.low)
+
+    def test_first(self):
+        import numpy as np
+        rng = np.random.default_rng(7)
+        for start in rng.integers(0, 1000, 200):
+            price = self.high[start] + rng.normal(0, 10)
+            above = np.flatnonzero(self.high[start:] >= price)
+            below = np.flatnonzero(self.low[start:] <= price)
+            self.assertEqual(self.index.first_above(start, price), start + above[0] if len(above) else 1000)
+            self.assertEqual(self.index.first_below(start, price), start + below[0] if len(below) else 1000)
+
+    def test_bounds(self):
+        self.assertEqual(self.index.first_above(0, self.high.max()), self.high.argmax())
+        self.assertEqual(self.index.first_above(0, self.high.max() + 1), 1000)
+        self.assertEqual(self.index.first_below(999, self.low[999]), 999)
+        self.assertEqual(self.index.first_below(1000, 0), 1000)
+
+    def test_missing(self):
+        import numpy as np
+        from src.utils.range_index import RangeIndex
+        # a missing bar never reaches a price, the ones next to it still do
+        index = RangeIndex([1, np.nan, 3], [1, np.nan, 3])
+        self.assertEqual(index.first_above(0, 2), 2)
+        self.assertEqual(index.first_below(1, 3), 2)
+
+if __name__ == '__main__':
+    unittest.main()
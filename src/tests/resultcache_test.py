@@ -0,0 +1,118 @@
+import shutil
+import tempfile
+import unittest
+import importlib.util
+
+class TestResultCache(unittest.TestCase):
+    def setUp(self):
+        from src.utils.result_cache import ResultCache
+        self.dir = tempfile.mkdtemp()
+        self.cache = ResultCache(self.dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_key(self):
+        from src.utils.result_cache import ResultCache
+        a = {"risk": 1, "atr": {"name": "atr", "properties": {"interval": "1h", "length": 24}}}
+        b = {"atr": {"properties": {"length": 24, "interval": "1h"}, "name": "atr"}, "risk": 1}
+        key_a, _ = ResultCache.key(a, 'BTCUSD', 0, 60, 'abc', version = '1')
+        key_b, _ = ResultCache.key(b, 'BTCUSD', 0, 60, 'abc', version = '1')
+        self.assertEqual(key_a, key_b)
+        self.assertNotEqual(key_a, ResultCache.key(a, 'BTCUSD', 0, 60, 'abd', version = '1')[0])
+        self.assertNotEqual(key_a, ResultCache.key(a, 'BTCUSD', 0, 60, 'abc', version = '2')[0])
+
+    def test_sources(self):
+        from src.utils.result_cache import result_sources
+        sources = result_sources()
+        # the modules the result depends on besides the engine itself
+        for module in ['src/engine/sharded.py', 'src/engine/backtester.py', 'src/utils/kline_store.py', 'src/utils/kline_shm.py',
+                'src/utils/utils.py', 'src/utils/range_index.py', 'src/account/funding.py']:
+            self.assertIn(module, sources)
+        for module in ['src/utils/run_registry.py', 'src/utils/result_cache.py', 'src/engine/bybit_rest.py']:
+            self.assertNotIn(module, sources)
+
+    def test_put_get(self):
+        from src.account.test_account import TestAccount
+        account = TestAccount(startbalance = 1)
+        account.open("long", 50000, 49000, 51000, 5, timestamp = 60)
+        account.close(51000, timestamp = 120)
+
+        key, params = self.cache.key({"risk": 5}, 'BTCUSD', 0, 180, 'abc')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, params, account.getResult(), account.getMetrics(), account.trades)
+
+        entry = self.cache.get(key)
+        self.assertEqual(entry['result'], account.getResult())
+        self.assertEqual(entry['trades'][0]['exit'], 51000)
+
+        self.assertTrue(self.cache.invalidate(key))
+        self.assertIsNone(self.cache.get(key))
+
+        self.cache.put(key, params, account.getResult(), account.getMetrics(), account.trades)
+        self.assertEqual(self.cache.clear(), 1)
+
+@unittest.skipUnless(importlib.util.find_spec('pandas_ta'), 'indicators need pandas_ta')
+class TestCacheKey(unittest.TestCase):
+    def key(self, paths, funding_path):
+        from src.engine.backtester import Backtester
+        from src.engine.engine import Engine
+        from src.engine.golden import RANGE
+        from src.engine.strategy import strategy
+        from src.utils.utils import date_to_seconds
+        # only what _cache_key reads, no download and no run
+        backtester = Backtester.__new__(Backtester)
+        Engine.__init__(backtester, strategy = strategy, symbol = 'BTCUSD')
+        backtester.start_ts, backtester.end_ts = [date_to_seconds(d) for d in RANGE]
+        backtester.paths, backtester.funding_path = paths, funding_path
+        return backtester._cache_key()[0]
+
+    def test_run_files(self):
+        import os
+        from src.engine.golden import fixtures
+        with fixtures() as (paths, funding), fixtures() as (other, _):
+            funding_path = os.path.join(os.path.dirname(paths['1m']), 'funding.csv')
+            funding.to_csv(funding_path, header = False)
+            key = self.key(paths, funding_path)
+            self.assertIsNotNone(key)
+            # keyed on the data the run reads, wherever it is
+            self.assertEqual(self.key(other, funding_path), key)
+
+            with open(other['1m']) as f:
+                lines = f.readlines()
+            lines[len(lines) // 2] = lines[len(lines) // 2].replace(',', ',1', 1)
+            with open(other['1m'], 'w') as f:
+                f.writelines(lines)
+            self.assertNotEqual(self.key(other, funding_path), key)
+
+    def test_cached_run(self):
+        import os
+        from unittest import mock
+        from src.account.test_account import TestAccount
+        from src.engine.backtester import Backtester
+        from src.engine.golden import RANGE, fixtures
+        from src.engine.strategy import strategy
+        from src.utils.result_cache import ResultCache
+        from src.utils.run_registry import RunRegistry
+        with fixtures() as (paths, funding):
+            folder = os.path.dirname(paths['1m'])
+            funding_path = os.path.join(folder, 'funding.csv')
+            funding.to_csv(funding_path, header = False)
+            class Cache(ResultCache):
+                def __init__(self):
+                    super().__init__(os.path.join(folder, 'cache'))
+            cache, registry = Cache(), RunRegistry(os.path.join(folder, 'runs.sqlite'))
+            account = TestAccount(startbalance = 1)
+            key = self.key(paths, funding_path)
+            cache.put(key, {}, account.getResult(), account.getMetrics(), account.trades)
+
+            with mock.patch.object(Backtester, 'paths', paths), mock.patch.object(Backtester, 'funding_path', funding_path), \
+                    mock.patch('src.engine.backtester.ResultCache', Cache), mock.patch('src.engine.backtester.RunRegistry', lambda: registry):
+                backtester = Backtester(api_key = '', secret = '', symbol = 'BTCUSD', strategy = strategy, args = list(RANGE), checkpoint = False)
+            self.assertEqual(backtester.result['result'], account.getResult())
+            # computed once, recorded once, a hit isn't another run
+            self.assertEqual(registry.count(), 0)
+            registry.close()
+
+if __name__ == '__main__':
+    unittest.main()
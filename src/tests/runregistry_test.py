@@ -0,0 +1,66 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+class TestRunRegistry(unittest.TestCase):
+    def setUp(self):
+        from src.utils.run_registry import RunRegistry
+        from src.engine.strategy import strategy
+        self.dir = tempfile.mkdtemp()
+        self.registry = RunRegistry(os.path.join(self.dir, 'runs.sqlite'))
+        self.strategy = strategy
+
+    def tearDown(self):
+        self.registry.close()
+        shutil.rmtree(self.dir)
+
+    def runs(self, n):
+        for i in range(n):
+            trades = [{"side": "long", "entry": 100 + j, "exit": 101 + j, "initialsize": 10, "size": 10, "opentimestamp": 60 * j,
+                "closetimestamp": 60 * j + 30, "result": {"stopped": False, "exit": 101 + j, "profit": 0.001, "percent": 0.1,
+                "balance": {"before": 1, "after": 1.001}}} for j in range(i % 5)]
+            yield {"strategy": dict(self.strategy, risk = 1 + i % 7), "symbol": "BTCUSD", "start": 1609459200, "end": 1612137600,
+                "fingerprint": "abc", "metrics": {"trades": len(trades), "strikerate": 50, "balance": 1 + i / 1000,
+                "growth": (i * 37 % 1000) / 10 - 50, "maxdrawdown": -(i * 13 % 100) / 4, "won": 1, "lost": 1, "even": 0}, "trades": trades}
+
+    def test_record(self):
+        ids = self.registry.record(list(self.runs(3000)))
+        self.assertEqual(len(ids), 3000)
+        self.assertEqual(self.registry.count(), 3000)
+
+        run = self.registry.run(ids[4])
+        self.assertEqual(run['strategy']['risk'], 5)
+        self.assertEqual(len(run['trades']), 4)
+        self.assertEqual(run['trades'][3]['entry'], 103)
+        self.assertEqual(run['fingerprint'], 'abc')
+        self.assertIsNone(self.registry.run(99999))
+
+    def test_rank(self):
+        self.registry.record(list(self.runs(3000)))
+
+        tic = time.perf_counter()
+        top = self.registry.top('growth', limit = 10)
+        worst = self.registry.top('maxdrawdown', limit = 10, ascending = True, min_trades = 3)
+        elapsed = time.perf_counter() - tic
+
+        self.assertEqual([r['growth'] for r in top], sorted([r['growth'] for r in top], reverse = True))
+        self.assertAlmostEqual(top[0]['growth'], 49.9)
+        self.assertTrue(all(r['trades'] >= 3 and r['maxdrawdown'] == -24.75 for r in worst))
+        self.assertLess(elapsed, 0.05)
+
+        from src.utils.run_registry import report
+        self.assertEqual(len(report(top).splitlines()), 11)
+
+        with self.assertRaises(ValueError):
+            self.registry.top('growth; DROP TABLE runs')
+
+    def test_delete(self):
+        ids = self.registry.record(list(self.runs(5)))
+        self.registry.delete(ids[:2])
+        self.assertEqual(self.registry.count(), 3)
+        self.assertEqual(self.registry.db.execute("SELECT COUNT(*) FROM trades WHERE run_id IN (?, ?)", ids[:2]).fetchone()[0], 0)
+
+if __name__ == '__main__':
+    unittest.main()
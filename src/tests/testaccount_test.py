@@ -38,5 +38,27 @@ class TestTestAccount(unittest.TestCase):
         from src.utils.utils import percent
         self.assertEqual(f'{percent(self.account.startbalance, self.account.balance):.2f}%', '-5.01%')
 
+    def test_replay(self):
+        from src.account.test_account import TestAccount
+        bars = [(60 * i, {"Open": 50000 + 100 * i, "High": 50050 + 100 * i, "Low": 49950 + 100 * i}) for i in range(30)]
+        def run(account):
+            account.open("long", 50000, tp = 52000, risk = 5, timestamp = 0, trail = 400, targets = [(50800, 0.5)])
+            for ts, kline in bars:
+                account.update(ts, kline)
+            account.open("short", 53000, 53500, 52000, 5, timestamp = 1800)
+            account.close(53200, timestamp = 1860)
+
+        self.account.journal = []
+        run(self.account)
+        self.assertEqual([call[0] for call in self.account.journal][:4], ["open", "stop", "stop", "stop"])
+
+        # the calls replayed on twice the balance book the same as running it on twice the balance
+        direct, replayed = TestAccount(startbalance = 2), TestAccount(startbalance = 2)
+        run(direct)
+        replayed.replay(self.account.journal)
+        self.assertEqual(replayed.trades, direct.trades)
+        self.assertEqual(replayed.balance, direct.balance)
+        self.assertEqual(len(direct.trades[0]["takeprofits"]), 1)
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,109 @@
+'''
+Bars that close on activity instead of time, built from the 1m klines
+
+An indicator interval `<kind>-<threshold>` in the strategy dict is one of these bars:
+
+    volume-50000000    a bar per 50M contracts traded, the Volume column (USD for inverse contracts)
+    turnover-1000      a bar per 1000 BTC traded, the TurnOver column
+    range-500          a bar per 500 USD the price travelled, the sum of the 1m High - Low
+
+The 1m klines are bucketed by the running sum of that amount: a cumsum, a floor division by the threshold and one
+reduceat per column, no loop over bars. The sum restarts every day at 00:00 UTC, so a bar never spans two days and a
+day's bars don't depend on where the data starts; the last bar of a day closes with it, short of the threshold. A 1m
+kline is never split, one that crosses several thresholds makes a single bar.
+
+Bars are indexed by the timestamp of their first 1m kline, like the time intervals, and `Closed` holds the time they
+closed: the end of their last 1m kline. A 1m bar only ever sees the last bar closed by its open (Engine._join_indis),
+never the one still forming.
+
+As a day's bars only depend on that day, they are built from whole days of the 1m klines a run has in memory, the
+block in chunked mode, reaching back as many days as their warmup takes (lookback). No pass over the whole 1m file.
+'''
+
+import math
+import numpy as np
+import pandas as pd
+
+from src.utils.kline_store import KLINE_COLUMNS
+
+KINDS = {"volume": "Volume", "turnover": "TurnOver", "range": None}
+COLUMNS = KLINE_COLUMNS[:-1] + ['Closed']
+DAY = 86400
+
+def parse(interval):
+    """(kind, threshold) of a bar interval, None for anything else"""
+    kind, _, threshold = str(interval).partition('-')
+    if kind not in KINDS:
+        return None
+    try:
+        threshold = float(threshold)
+    except ValueError:
+        return None
+    return (kind, threshold) if math.isfinite(threshold) and threshold > 0 else None
+
+def build_bars(klines, interval):
+    """Bars of an interval from 1m klines
+    :param klines: DataFrame of 1m klines indexed by timestamp
+    :return: DataFrame of Open, High, Low, Close, Volume, TurnOver and Closed indexed by the bar's first timestamp
+    """
+    kind, threshold = parse(interval)
+    ts = klines.index.to_numpy(dtype = np.int64)
+    if not len(ts):
+        return pd.DataFrame(columns = COLUMNS, index = pd.Index([], dtype = np.int64))
+
+    high, low = klines['High'].to_numpy(dtype = float), klines['Low'].to_numpy(dtype = float)
+    amount = np.nan_to_num(high - low if kind == 'range' else klines[KINDS[kind]].to_numpy(dtype = float))
+
+    # running amount of the day before each kline, and the bucket of the threshold it falls in
+    day = ts // DAY
+    newday = np.ones(len(ts), dtype = bool)
+    newday[1:] = day[1:] != day[:-1]
+    before = np.cumsum(amount) - amount
+    before -= before[np.flatnonzero(newday)][np.cumsum(newday) - 1]
+    bucket = np.floor(before / threshold)
+
+    start = newday.copy()
+    start[1:] |= bucket[1:] != bucket[:-1]
+    starts = np.flatnonzero(start)
+    ends = np.append(starts[1:], len(ts)) - 1
+
+    bars = pd.DataFrame({
+        "Open": klines['Open'].to_numpy(dtype = float)[starts],
+        "High": np.maximum.reduceat(high, starts),
+        "Low": np.minimum.reduceat(low, starts),
+        "Close": klines['Close'].to_numpy(dtype = float)[ends],
+        "Volume": np.add.reduceat(klines['Volume'].to_numpy(dtype = float), starts),
+        "TurnOver": np.add.reduceat(klines['TurnOver'].to_numpy(dtype = float), starts),
+        "Closed": ts[ends] + 60
+    }, index = pd.Index(ts[starts]))
+
+    # the last bar is still forming, unless it reached the threshold or its day is over
+    last = ends[-1]
+    if before[last] + amount[last] < (bucket[last] + 1) * threshold and ts[last] + 60 < (day[last] + 1) * DAY:
+        bars = bars.iloc[:-1]
+    return bars
+
+def lookback(read, start_ts, warmups):
+    """First day of 1m klines to build the bars from, for each interval to have its warmup bars closed by start_ts
+    :param read: read(begin, end) -> DataFrame of the 1m klines in [begin, end)
+    :param warmups: {interval: bars}
+    :return: timestamp of a day start, or of the first day there is data for if it runs out before
+    """
+    begin = start_ts - start_ts % DAY
+    klines, days = read(begin, start_ts), 1
+    while True:
+        first = []
+        for interval, n in warmups.items():
+            bars = build_bars(klines, interval)
+            closed = int(np.searchsorted(bars['Closed'].to_numpy(), start_ts, side = 'right'))
+            if closed < n:
+                break
+            first.append(bars.index[closed - n] if n else start_ts)
+        else:
+            return min((ts - ts % DAY for ts in first), default = start_ts - start_ts % DAY)
+        earlier = read(begin - days * DAY, begin)
+        if not len(earlier.index):
+            return int(klines.index[0] - klines.index[0] % DAY) if len(klines.index) else begin
+        klines = pd.concat([earlier, klines]) if len(klines.index) else earlier
+        begin -= days * DAY
+        days *= 2
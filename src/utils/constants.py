@@ -2,4 +2,24 @@ PATH_HIST_KLINES = {
     '1m': "hist_data/kline_1m.csv",
     '15m': "hist_data/kline_15m.csv",
     '1h': "hist_data/kline_1h.csv",
-}
\ No newline at end of file
+}
+
+PATH_HIST_FUNDING = "hist_data/funding.csv"
+# range each kline file covers, kept by KlineSync
+PATH_KLINE_MANIFEST = "hist_data/klines.json"
+
+# prefix of the recorded L2 order book, <prefix>.bin and <prefix>.idx
+PATH_ORDERBOOK = "hist_data/orderbook"
+
+# inverse perpetuals settle funding every 8 hours, at 00:00, 08:00 and 16:00 UTC
+FUNDING_INTERVAL = 8 * 3600
+
+PATH_RESULT_CACHE = "cache/results"
+PATH_RUN_REGISTRY = "cache/runs.sqlite"
+# descriptors of the kline segments in shared memory, see kline_shm.py
+PATH_SHM = "cache/shm"
+# state of interrupted runs to resume, see checkpoint.py
+PATH_CHECKPOINTS = "cache/checkpoints"
+
+# bump on a change of backtest semantics the source hash can't see (i.e. a new pandas_ta behaviour)
+ENGINE_VERSION = 1
@@ -1,42 +1,144 @@
+'''
+Indicators are built into a graph of series instead of being computed one after the other
+
+Each indicator function adds the nodes it needs to an IndicatorGraph: kline columns, the pandas_ta call on them and the
+signal derived from that. A node is keyed by what it computes, so a series two indicators need (the hma of the same close
+and length, with and without an offset) is computed once. Offsets are shifts of the base series, which is what
+pandas_ta does with its offset argument. Nodes whose inputs are done run together on a thread pool.
+
+To add an indicator `name`, write `name(props, graph)` adding its nodes and returning (interval, key of the signal node),
+and `name_warmup(props)` returning the bars of history it needs.
+'''
+
+import os
 import pandas_ta as ta
 import pandas as pd
 import numpy as np
 import math
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
-from src.utils.utils import get_logger
+from src.utils.utils import get_logger, get_offset
 logger = get_logger(logging.getLogger(__name__), 'logs/indicators.log', logging.DEBUG)
 
+class IndicatorGraph():
+    """Series keyed by what they compute, each computed once after the ones it depends on
+
+    :param klines: {interval: DataFrame of klines} the column nodes read from
+    """
+
+    def __init__(self, klines):
+        self.klines = klines
+        self.nodes = {}
+
+    def add(self, key, fn, *deps):
+        """Node computing fn(*deps), unless there already is one for key
+        :return: key
+        """
+        if key not in self.nodes:
+            self.nodes[key] = (fn, deps)
+        return key
+
+    def column(self, interval, name):
+        return self.add(('kline', interval, name), lambda: self.klines[interval][name])
+
+    def shift(self, key, offset):
+        offset = get_offset(offset)
+        return self.add(('shift', key, offset), lambda series: series.shift(offset), key) if offset else key
+
+    def evaluate(self, workers = None):
+        """Compute every node, a wave of the ones whose inputs are done at a time
+        :return: {key: series}
+        """
+        done, pending = {}, dict(self.nodes)
+        with ThreadPoolExecutor(workers or min(8, os.cpu_count() or 1)) as pool:
+            while pending:
+                ready = [key for key, (fn, deps) in pending.items() if all(d in done for d in deps)]
+                futures = {key: pool.submit(pending[key][0], *[done[d] for d in pending[key][1]]) for key in ready}
+                for key, future in futures.items():
+                    done[key] = future.result()
+                    del pending[key]
+        return done
+
+def _above(a, b):
+    # True/False where both are known, None otherwise
+    a, b = np.asarray(a, dtype = float), np.asarray(b, dtype = float)
+    return np.where(np.isnan(a) | np.isnan(b), None, a > b)
+
+def calc_indis(indi_objs, klines, workers = None):
+    """Compute indicators through one graph
+    :return: {interval: DataFrame of the signals on it, a column per indicator name}
+    """
+    graph = IndicatorGraph(klines)
+    outputs = []
+    for indi_obj in indi_objs:
+        try:
+            outputs.append((indi_obj.get("name"), *globals()[indi_obj.get("name")](indi_obj.get("properties"), graph)))
+        except Exception as err:
+            logger.error(f"calc_indis {indi_obj}: {err}")
+            raise
+
+    done = graph.evaluate(workers)
+    frames = {}
+    for name, interval, key in outputs:
+        series = pd.Series(done[key], index = klines[interval].index, name = name)
+        frames[interval] = pd.DataFrame(series) if not interval in frames else pd.concat([frames[interval], series], axis = 1)
+    return frames
+
 def calc_indi(indi_obj, klines):
     try:
-        name = indi_obj.get("name")
-        props = indi_obj.get("properties")
-        return globals()[f'{name}'](props,klines)
+        interval, frame = next(iter(calc_indis([indi_obj], klines).items()))
+        return interval, frame[indi_obj.get("name")]
     except Exception as err:
         logger.error(f"calc_indi: {err}")
 
-def hma(props, klines):
+def warmup(indi_obj):
+    """Bars of history an indicator needs on its own interval before its value stops depending on where the data starts
+    :return: (interval, bars)
+    """
+    name = indi_obj.get("name")
+    props = indi_obj.get("properties")
+    return props.get('interval'), globals()[f'{name}_warmup'](props)
+
+def hma(props, graph):
     interval = props.get('interval')
     length = props.get('length')
-    offset = props.get('offset')
-    hma = pd.DataFrame({'hma' : ta.hma(klines[interval]['Close'], length) , 'hmao': ta.hma(klines[interval]['Close'], length, offset)})
-    return interval, pd.Series(hma.apply(lambda row: row['hma'] > row['hmao'] if not (math.isnan(row['hma']) or math.isnan(row['hmao'])) else None, axis = 1), name ='hma')
+    hma = graph.add(('hma', interval, length), lambda close: ta.hma(close, length), graph.column(interval, 'Close'))
+    hmao = graph.shift(hma, props.get('offset'))
+    return interval, graph.add(('above', hma, hmao), _above, hma, hmao)
 
-def aroon(props, klines):
+def hma_warmup(props):
+    length = props.get('length')
+    return length + int(math.sqrt(length)) + get_offset(props.get('offset'))
+
+def aroon(props, graph):
     interval = props.get('interval')
     length = props.get('length')
-    aroon = ta.aroon(klines[interval]['High'], klines[interval]['Low'], length)
-    return interval, pd.Series(aroon.apply(lambda row: row[f'AROONOSC_{length}'] > 0 if not math.isnan(row[f'AROONOSC_{length}']) else None, axis = 1), name = 'aroon')
+    osc = graph.add(('aroonosc', interval, length), lambda high, low: ta.aroon(high, low, length)[f'AROONOSC_{length}'],
+        graph.column(interval, 'High'), graph.column(interval, 'Low'))
+    return interval, graph.add(('above', osc, 0), lambda osc: _above(osc, np.zeros(len(osc))), osc)
+
+def aroon_warmup(props):
+    return props.get('length') + 1
 
-def ao(props, klines):
+def ao(props, graph):
     interval = props.get('interval')
     fast = props.get('fast')
     slow = props.get('slow')
-    offset = props.get('offset')
-    ao = pd.DataFrame({'ao': ta.ao(klines[interval]['High'], klines[interval]['Low'], fast, slow), 'aoo': ta.ao(klines[interval]['High'], klines[interval]['Low'], fast, slow, offset)})
-    return interval, pd.Series(ao.apply(lambda row: row['ao'] > row['aoo'] if not (math.isnan(row['ao']) or math.isnan(row['aoo'])) else None, axis = 1), name ='ao')
+    ao = graph.add(('ao', interval, fast, slow), lambda high, low: ta.ao(high, low, fast, slow),
+        graph.column(interval, 'High'), graph.column(interval, 'Low'))
+    aoo = graph.shift(ao, props.get('offset'))
+    return interval, graph.add(('above', ao, aoo), _above, ao, aoo)
 
-def atr(props, klines):
+def ao_warmup(props):
+    return (props.get('slow') or 34) + get_offset(props.get('offset'))
+
+def atr(props, graph):
     interval = props.get('interval')
     length = props.get('length')
-    return interval, pd.Series(ta.atr(klines['1h']['High'], klines['1h']['Low'], klines['1h']['Close'], 24), name = 'atr')
+    return interval, graph.add(('atr', interval, length), lambda high, low, close: ta.atr(high, low, close, length),
+        graph.column(interval, 'High'), graph.column(interval, 'Low'), graph.column(interval, 'Close'))
+
+def atr_warmup(props):
+    # rma: the weight of the first bar decays as (1 - 1/length)^n and is below float precision after 40 lengths
+    return 40 * props.get('length')
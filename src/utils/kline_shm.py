@@ -0,0 +1,237 @@
+'''
+Klines loaded once into POSIX shared memory, for any number of backtest processes to read
+
+A symbol and interval is published as one segment: the timestamps as int64 followed by the Open, High, Low, Close,
+Volume and TurnOver columns as float64, one column after the other. Its descriptor, a json file in cache/shm, names
+the segment, the kline file it was loaded from and the pids holding it. Any process, also one launched separately,
+attaches to the segment named there and gets a DataFrame over read-only views of it, nothing is copied.
+
+A segment is unlinked when its last holder releases it, unless a `kline-service` process pins it. A kline file that
+changed since it was loaded (synced) is published again as a new segment, the old one lives on until its holders are
+done with it. Holders that died without releasing are dropped the next time the descriptor is touched, or by gc().
+'''
+
+import os
+import json
+import time
+import glob
+import fcntl
+import secrets
+import logging
+import contextlib
+from multiprocessing import shared_memory, resource_tracker
+import numpy as np
+import pandas as pd
+
+from src.utils.constants import PATH_SHM
+from src.utils.kline_store import KLINE_COLUMNS, complete_lines
+from src.utils.utils import get_logger
+
+logger = get_logger(logging.getLogger(__name__), 'logs/kline-shm.log', logging.DEBUG)
+
+COLUMNS = KLINE_COLUMNS[:-1]
+
+def _segment(name, size = 0):
+    """Open a segment, or create one of size bytes"""
+    shm = shared_memory.SharedMemory(name = name, create = bool(size), size = size)
+    # the holders in the descriptor decide when it goes, not the resource tracker of whichever process opened it
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+def _unlink(name):
+    try:
+        # registered with the resource tracker, unlink() unregisters it again
+        shm = shared_memory.SharedMemory(name = name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class SharedKlines():
+    """A published segment attached to this process, see KlineService.attach"""
+
+    def __init__(self, key, name, rows, shm):
+        self.key = key
+        self.name = name
+        self.shm = shm
+        self.timestamps = np.ndarray((rows,), dtype = np.int64, buffer = shm.buf)
+        self.values = np.ndarray((len(COLUMNS), rows), dtype = np.float64, buffer = shm.buf, offset = rows * 8)
+        self.timestamps.flags.writeable = False
+        self.values.flags.writeable = False
+
+    def frame(self):
+        """DataFrame over the segment, indexed by timestamp, without Date"""
+        return pd.DataFrame(self.values.T, index = pd.Index(self.timestamps, copy = False), columns = COLUMNS, copy = False)
+
+    def close(self):
+        self.timestamps = self.values = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # a frame over it is still around, the mapping goes with the process
+            pass
+
+class KlineService():
+    """Publishes kline files to shared memory and attaches to them, see the module doc
+
+    :param path: directory of the descriptors
+    """
+
+    def __init__(self, path = PATH_SHM):
+        self.path = path
+        os.makedirs(path, exist_ok = True)
+        self.attached = []
+
+    @contextlib.contextmanager
+    def _descriptor(self, key):
+        """The descriptor of a key, locked until it is saved on the way out"""
+        with open(os.path.join(self.path, f"{key}.lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            filename = os.path.join(self.path, f"{key}.json")
+            try:
+                with open(filename) as f:
+                    descriptor = json.load(f)
+            except (FileNotFoundError, json.decoder.JSONDecodeError):
+                descriptor = {"current": None, "segments": {}}
+
+            yield descriptor
+
+            self._collect(descriptor)
+            tmp = f"{filename}.tmp"
+            with open(tmp, 'w') as f:
+                json.dump(descriptor, f, indent = 2)
+            os.replace(tmp, filename)
+
+    def _collect(self, descriptor):
+        """Drop dead holders and unlink the segments nobody holds
+        :return: segments unlinked
+        """
+        unlinked = 0
+        for name, segment in list(descriptor['segments'].items()):
+            segment['holders'] = [pid for pid in segment['holders'] if _alive(pid)]
+            pinned = segment.get('pinned') and _alive(segment['pinned']) and name == descriptor['current']
+            if not segment['holders'] and not pinned:
+                _unlink(name)
+                del descriptor['segments'][name]
+                if descriptor['current'] == name:
+                    descriptor['current'] = None
+                unlinked += 1
+                logger.info(f"unlinked {name}")
+        return unlinked
+
+    def _current(self, key, descriptor, filename):
+        """Name of the segment holding the file as it is now, loading it if there is none"""
+        stat = os.stat(filename)
+        source = [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+        current = descriptor['segments'].get(descriptor['current'])
+        if current and current['source'] == source:
+            try:
+                _segment(descriptor['current']).close()
+                return descriptor['current']
+            except FileNotFoundError:
+                # /dev/shm was cleared under the descriptor
+                del descriptor['segments'][descriptor['current']]
+                current = None
+
+        name, rows = self._load(key, filename)
+        descriptor['segments'][name] = {"rows": rows, "source": source, "holders": [], "created": int(time.time()),
+            "pinned": current.get('pinned') if current else None}
+        if current:
+            # the stale segment stays for its holders, the pin moves on
+            current['pinned'] = None
+        descriptor['current'] = name
+        return name
+
+    def _load(self, key, filename):
+        with open(filename, 'rb') as f:
+            klines = pd.read_csv(complete_lines(f), index_col = 0, names = ['timestamp'] + COLUMNS, usecols = range(len(COLUMNS) + 1))
+        rows = len(klines.index)
+        if not rows:
+            raise ValueError(f"{filename}: no klines to publish")
+        columns = klines[COLUMNS].to_numpy(dtype = np.float64).T
+
+        name = f"bt_{key}_{secrets.token_hex(4)}"
+        shm = _segment(name, size = rows * 8 * (len(COLUMNS) + 1))
+        timestamps = np.ndarray((rows,), dtype = np.int64, buffer = shm.buf)
+        values = np.ndarray((len(COLUMNS), rows), dtype = np.float64, buffer = shm.buf, offset = rows * 8)
+        timestamps[:] = klines.index.values
+        values[:] = columns
+        del timestamps, values
+        shm.close()
+
+        logger.info(f"loaded {filename} into {name}: {rows} klines")
+        return name, rows
+
+    def attach(self, symbol, interval, filename):
+        """Attach to the klines of a file, publishing them first unless they are already
+        :return: SharedKlines, hand it back to release() when done
+        """
+        key = f"{symbol}_{interval}"
+        with self._descriptor(key) as descriptor:
+            name = self._current(key, descriptor, filename)
+            segment = descriptor['segments'][name]
+            segment['holders'].append(os.getpid())
+            handle = SharedKlines(key, name, segment['rows'], _segment(name))
+
+        self.attached.append(handle)
+        return handle
+
+    def release(self, handle):
+        with self._descriptor(handle.key) as descriptor:
+            segment = descriptor['segments'].get(handle.name)
+            if segment and os.getpid() in segment['holders']:
+                segment['holders'].remove(os.getpid())
+        handle.close()
+        if handle in self.attached:
+            self.attached.remove(handle)
+
+    def close(self):
+        """Release everything attached by this service"""
+        for handle in list(self.attached):
+            self.release(handle)
+
+    def publish(self, symbol, interval, filename):
+        """Load a file for good, pinned by this process until unpublish() or its exit
+        :return: segment name
+        """
+        with self._descriptor(f"{symbol}_{interval}") as descriptor:
+            name = self._current(f"{symbol}_{interval}", descriptor, filename)
+            descriptor['segments'][name]['pinned'] = os.getpid()
+        return name
+
+    def unpublish(self, symbol, interval):
+        with self._descriptor(f"{symbol}_{interval}") as descriptor:
+            for segment in descriptor['segments'].values():
+                segment['pinned'] = None
+
+    def serve(self, symbol, paths, every = 60):
+        """Keep the files of paths ({interval: filename}) published, republishing a file once it changes, until interrupted"""
+        try:
+            while True:
+                for interval, filename in paths.items():
+                    if os.path.exists(filename):
+                        self.publish(symbol, interval, filename)
+                time.sleep(every)
+        finally:
+            for interval in paths:
+                self.unpublish(symbol, interval)
+
+    def gc(self):
+        """Drop dead holders and unlink what nobody holds anymore, across all descriptors
+        :return: segments unlinked
+        """
+        unlinked = 0
+        for filename in glob.glob(os.path.join(self.path, '*.json')):
+            with self._descriptor(os.path.basename(filename)[:-len('.json')]) as descriptor:
+                unlinked += self._collect(descriptor)
+        return unlinked
@@ -0,0 +1,170 @@
+import io
+import os
+import hashlib
+import pandas as pd
+from datetime import datetime
+
+KLINE_COLUMNS = ["Open","High","Low","Close","Volume","TurnOver","Date"]
+
+def kline_dates(index):
+    return [datetime.fromtimestamp(i).strftime('%Y-%m-%d %H:%M:%S.%d')[:-3] for i in index]
+
+def complete_end(f):
+    """Offset just past the last newline of a file, the end of the last line a sync finished appending"""
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    back = min(size, 4096)
+    while back:
+        f.seek(size - back)
+        found = f.read(back).rfind(b'\n')
+        if found >= 0:
+            return size - back + found + 1
+        if back == size:
+            break
+        back = min(size, back * 2)
+    return 0
+
+class _Upto(io.RawIOBase):
+    """Reads a file from its position up to an offset"""
+
+    def __init__(self, f, end):
+        self.f = f
+        self.end = end
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.f.read(max(0, min(len(buffer), self.end - self.f.tell())))
+        buffer[:len(data)] = data
+        return len(data)
+
+def complete_lines(f):
+    """Binary file object over f from its position to the end of its last complete line
+    KlineSync appends in place, a reader starting during an append stops short of the line still being written.
+    """
+    position = f.tell()
+    end = complete_end(f)
+    f.seek(position)
+    return io.BufferedReader(_Upto(f, end))
+
+def read_bounds(filename):
+    """Oldest and newest timestamp of a kline file, read from its first and last complete line only
+    :return: (oldest, newest) or None if the file is missing or empty
+    """
+    try:
+        with open(filename, 'rb') as f:
+            size = complete_end(f)
+            f.seek(0)
+            first = f.readline()
+            if not size or not first.strip():
+                return None
+
+            back = min(size, 4096)
+            while True:
+                f.seek(size - back)
+                lines = [l for l in f.read(back).splitlines() if l.strip()]
+                if len(lines) > 1 or back == size:
+                    break
+                back = min(size, back * 2)
+    except FileNotFoundError:
+        return None
+
+    return int(float(first.split(b',')[0])), int(float(lines[-1].split(b',')[0]))
+
+def seek_timestamp(f, ts):
+    """Byte offset of the first line of a sorted kline file with a timestamp >= ts, by bisecting on file offsets"""
+    size = complete_end(f)
+
+    def line_at(pos):
+        # start of the first line at or after pos
+        f.seek(pos)
+        if pos:
+            f.readline()
+        return f.tell(), f.readline()
+
+    lo, hi = 0, size
+    while lo < hi:
+        mid = (lo + hi) // 2
+        start, line = line_at(mid)
+        # a line still being appended counts as the end of the file
+        if start >= size or not line.strip() or int(float(line.split(b',')[0])) >= ts:
+            hi = mid
+        else:
+            lo = mid + 1
+
+    return min(line_at(lo)[0], size)
+
+def range_fingerprint(filenames, start, end):
+    """sha1 over the raw lines of each file with a timestamp in [start, end)
+    Appending newer klines or backfilling older ones leaves the fingerprint of a covered range unchanged.
+    """
+    digest = hashlib.sha1()
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            begin = seek_timestamp(f, start)
+            stop = seek_timestamp(f, end)
+            f.seek(begin)
+            remaining = stop - begin
+            while remaining > 0:
+                data = f.read(min(remaining, 1 << 20))
+                if not data:
+                    break
+                digest.update(data)
+                remaining -= len(data)
+
+    return digest.hexdigest()
+
+def read_klines(filename, start = None, end = None):
+    """The klines of a file in [start, end) as a DataFrame indexed by timestamp, the whole file without a range"""
+    if start is None:
+        with open(filename, 'rb') as f:
+            klines = pd.read_csv(complete_lines(f), index_col = 0, names = KLINE_COLUMNS)
+        klines.loc[:,'Date'] = kline_dates(klines.index)
+        return klines
+
+    blocks = list(stream_klines(filename, start, end))
+    return pd.concat(blocks) if blocks else pd.DataFrame(columns = KLINE_COLUMNS)
+
+def stream_klines(filename, start, end, rows = 100000):
+    """Read a kline file in blocks of `rows` lines, yielding only the klines in [start, end)
+    The file is sorted by timestamp, so reading starts at the first line of the range and stops at the first block past `end`.
+    """
+    with open(filename, 'rb') as f:
+        f.seek(seek_timestamp(f, start))
+        lines = complete_lines(f)
+        if not lines.peek(1):
+            return
+
+        with pd.read_csv(lines, index_col = 0, names = KLINE_COLUMNS, chunksize = rows) as reader:
+            for block in reader:
+                past_end = block.index[-1] >= end
+                block = block[block.index < end].copy()
+                if len(block.index):
+                    block['Date'] = kline_dates(block.index)
+                    yield block
+                if past_end:
+                    return
+
+class KlineWindow():
+    """Forward-only window over a kline file
+
+    advance(lower, upper) returns the klines in [lower, upper), reading further into the file as needed and
+    dropping everything before `lower`, so memory stays bounded by the window plus one read block.
+    """
+
+    def __init__(self, filename, start, end, rows = 100000):
+        self._stream = stream_klines(filename, start, end, rows)
+        self._done = False
+        self.frame = pd.DataFrame(columns = KLINE_COLUMNS)
+
+    def advance(self, lower, upper):
+        while not self._done and (not len(self.frame.index) or self.frame.index[-1] < upper - 1):
+            try:
+                block = next(self._stream)
+                self.frame = pd.concat([self.frame, block]) if len(self.frame.index) else block
+            except StopIteration:
+                self._done = True
+
+        self.frame = self.frame[self.frame.index >= lower]
+        return self.frame[self.frame.index < upper]
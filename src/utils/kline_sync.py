@@ -0,0 +1,222 @@
+'''
+Keeps the local kline files covering a range, downloading only what is missing
+
+Per symbol and interval the manifest (hist_data/klines.json) records the range the file covers. That can start
+before its first bar when bybit has nothing older, so a listing date isn't asked for again on every run. A sync
+backfills the older prefix the file is missing and extends the newer suffix, in chunks of `chunk` bars.
+
+A chunk past the newest bar, what nearly every sync is, is appended to the file and fsynced, so a sync costs the new
+rows and not the file. A torn last line, left by an append that was cut off, is cut off before anything else is done.
+Only the rare chunk that goes in front of existing bars (a backfilled prefix or the rest of an interrupted one) is
+committed by writing the whole new file next to the old one and renaming it over, as is the manifest. Readers in
+kline_store stop at the last complete line, so a backtest starting during a sync never parses a half-written row.
+'''
+
+import os
+import json
+import time
+import fcntl
+import shutil
+import logging
+import threading
+import pandas as pd
+
+from src.utils.constants import PATH_HIST_KLINES, PATH_KLINE_MANIFEST
+from src.utils.kline_store import KLINE_COLUMNS, kline_dates, read_bounds, seek_timestamp
+from src.utils.utils import get_logger, interval_bybit_notation
+
+logger = get_logger(logging.getLogger(__name__), 'logs/kline-sync.log', logging.DEBUG)
+
+def repair(filename):
+    """Cut a kline file back to its last complete line
+    :return: bytes cut off
+    """
+    try:
+        size = os.path.getsize(filename)
+    except FileNotFoundError:
+        return 0
+
+    with open(filename, 'rb+') as f:
+        back = min(size, 4096)
+        while True:
+            f.seek(size - back)
+            tail = f.read(back)
+            end = len(tail)
+            # a complete line ends in a newline and has every column
+            while end:
+                start = tail.rfind(b'\n', 0, end - 1) + 1
+                line = tail[start:end]
+                if line.endswith(b'\n') and line.count(b',') == len(KLINE_COLUMNS):
+                    break
+                end = start
+            if end or back == size:
+                break
+            back = min(size, back * 2)
+
+        keep = size - back + end
+        if keep < size:
+            f.truncate(keep)
+            logger.warning(f"{filename}: cut a torn line of {size - keep} bytes")
+        return size - keep
+
+def klines_csv(rows):
+    """Lines of the kline files for [open_time, open, high, low, close, volume, turnover] rows"""
+    frame = pd.DataFrame([r[1:] for r in rows], index = [int(r[0]) for r in rows], columns = KLINE_COLUMNS[:-1])
+    frame.loc[:, 'Date'] = kline_dates(frame.index)
+    return frame.to_csv(header = False)
+
+class KlineSync():
+    """Downloads the klines missing from the local files, see the module doc
+
+    :param bybit: BybitRest to download with
+    :param chunk: bars per committed chunk
+    """
+
+    def __init__(self, bybit, symbol = 'BTCUSD', paths = PATH_HIST_KLINES, manifest = PATH_KLINE_MANIFEST, chunk = 20000):
+        self.bybit = bybit
+        self.symbol = symbol
+        self.paths = paths
+        self.manifest = manifest
+        self.chunk = chunk
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def _save_covered(self, interval, covered):
+        manifest = self._load_manifest()
+        manifest.setdefault(self.symbol, {})[interval] = covered
+        tmp = f"{self.manifest}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent = 2)
+        os.replace(tmp, self.manifest)
+
+    def _recorded(self, interval):
+        return self._load_manifest().get(self.symbol, {}).get(interval) or {}
+
+    def covered(self, interval):
+        """(start, newest bar) the file of an interval covers, None without one"""
+        bounds = read_bounds(self.paths[interval])
+        if not bounds:
+            return None
+        recorded = self._recorded(interval)
+        # the recorded start only holds while the file still begins with the bar it was recorded for
+        if recorded.get('oldest') == bounds[0] and recorded['start'] <= bounds[0]:
+            return recorded['start'], bounds[1]
+        return bounds[0], bounds[1]
+
+    def sync(self, start_ts, end_ts = None, intervals = None):
+        """Make the files cover [start_ts, end_ts), up to now without end_ts"""
+        end_ts = end_ts or int(time.time())
+        for interval in intervals or list(self.paths):
+            with open(f"{self.paths[interval]}.lock", 'w') as lock:
+                # a background sync and a backtest can both be syncing
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                self._sync(interval, start_ts, end_ts)
+
+    def _sync(self, interval, start_ts, end_ts):
+        step = interval_bybit_notation(interval) * 60
+        repair(self.paths[interval])
+
+        covered = self.covered(interval)
+        gap = self._recorded(interval).get('gap') if covered else None
+        if gap:
+            # the rest of a backfill that was interrupted
+            self._download(interval, gap[0], gap[1])
+            covered = self.covered(interval)
+
+        if covered is None:
+            self._download(interval, start_ts, end_ts, start_ts)
+            return
+
+        start, newest = covered
+        if start_ts < start:
+            self._download(interval, start_ts, start, start_ts)
+        if newest + step < end_ts:
+            self._download(interval, newest + step, end_ts)
+
+    def _download(self, interval, begin, end, start = None):
+        """Download [begin, end) a chunk at a time, each one committed as soon as it is complete
+        :param start: the range being backfilled starts here, also where there turns out to be no data
+        """
+        step = interval_bybit_notation(interval) * 60
+        bounds = read_bounds(self.paths[interval])
+        # chunks committed in front of existing bars leave a gap until the last one is in
+        before = bounds is not None and bounds[1] >= end
+
+        rows, ts, calls = [], begin, 0
+        while ts < end:
+            calls += 1
+            if calls % 3 == 0:
+                # be kind to the API
+                time.sleep(0.2)
+            resp = self.bybit.kline(symbol = self.symbol, interval = str(interval_bybit_notation(interval)), _from = ts, limit = 200)
+            page = [[float(k) for k in list(i.values())[2:]] for i in (resp.get('result') or [] if isinstance(resp, dict) else [])]
+            page = [r for r in page if ts <= r[0] < end]
+            if not page:
+                break
+            rows += page
+            ts = int(page[-1][0]) + step
+
+            if len(rows) >= self.chunk and ts < end:
+                self._commit(interval, rows, start, gap = [ts, end] if before else None)
+                rows = []
+
+        if rows or bounds:
+            # without rows nothing older exists, the file covers back to start anyway
+            self._commit(interval, rows, start)
+
+    def _commit(self, interval, rows, start = None, gap = None):
+        """Append rows to the file of an interval, or merge them in through a temporary file renamed over it"""
+        filename = self.paths[interval]
+        previous = self.covered(interval)
+
+        if rows and (previous is None or rows[0][0] > previous[1]):
+            with open(filename, 'ab') as out:
+                out.write(klines_csv(rows).encode('utf-8'))
+                out.flush()
+                os.fsync(out.fileno())
+        elif rows:
+            data = klines_csv(rows).encode('utf-8')
+            tmp = f"{filename}.tmp"
+            with open(tmp, 'wb') as out, open(filename, 'rb') as f:
+                # the rows fill a gap, in front of the first bar past them
+                offset = seek_timestamp(f, rows[0][0])
+                f.seek(0)
+                while f.tell() < offset:
+                    out.write(f.read(min(offset - f.tell(), 1 << 20)))
+                out.write(data)
+                shutil.copyfileobj(f, out)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp, filename)
+
+        oldest, newest = read_bounds(filename)
+        covered_start = min(x for x in [start, previous[0] if previous else None, oldest] if x is not None)
+        self._save_covered(interval, {"start": int(covered_start), "oldest": oldest, "newest": newest, "gap": gap})
+        logger.info(f"{self.symbol} {interval}: +{len(rows)} bars, covers {covered_start} - {newest}{f', missing {gap}' if gap else ''}")
+
+    def start(self, start_ts, every = 60, intervals = None):
+        """Sync in a background thread every `every` seconds, until stop()"""
+        def loop():
+            while not self._stop.is_set():
+                try:
+                    self.sync(start_ts, intervals = intervals)
+                except Exception as e:
+                    logger.error(f"sync: {e}")
+                self._stop.wait(every)
+
+        self._stop.clear()
+        self._thread = threading.Thread(target = loop, daemon = True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
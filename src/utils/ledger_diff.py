@@ -0,0 +1,70 @@
+import json
+import math
+
+from src.utils.result_cache import canonical
+
+def flatten(obj, prefix = ''):
+    """Nested dicts and lists as {dotted.key: value}"""
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, (list, tuple)):
+        items = enumerate(obj)
+    else:
+        return {prefix: obj}
+
+    flat = {}
+    for key, value in items:
+        flat.update(flatten(value, f"{prefix}.{key}" if prefix else str(key)))
+    return flat
+
+def plain(obj):
+    """obj as it reads back from json: lists for tuples, python numbers for numpy ones"""
+    return json.loads(canonical(obj))
+
+def same(a, b, tolerance = 0):
+    if isinstance(a, bool) or isinstance(b, bool) or not isinstance(a, (int, float)) or not isinstance(b, (int, float)):
+        return a == b
+    if math.isnan(a) or math.isnan(b):
+        return math.isnan(a) and math.isnan(b)
+    return a == b if not tolerance else math.isclose(a, b, rel_tol = tolerance, abs_tol = tolerance)
+
+def diff_fields(expected, actual, tolerance = 0):
+    """[(field, expected, actual)] of the fields that differ, missing ones as None"""
+    expected, actual = flatten(plain(expected)), flatten(plain(actual))
+    return [(k, expected.get(k), actual.get(k)) for k in sorted(set(expected) | set(actual), key = _natural)
+        if k not in expected or k not in actual or not same(expected[k], actual[k], tolerance)]
+
+def _natural(key):
+    return [(0, int(p), '') if p.isdigit() else (1, 0, p) for p in key.split('.')]
+
+def diff_results(expected, actual, tolerance = 0):
+    """Where two backtest results part ways, None when they agree
+    :param expected, actual: dicts of metrics (getMetrics()) and trades (the ledger)
+    :param tolerance: relative and absolute tolerance of numbers, 0 for exact
+    :return: report of the first trade that differs field by field, or of the metrics when the ledgers agree
+    """
+    for i, (a, b) in enumerate(zip(expected['trades'], actual['trades'])):
+        fields = diff_fields(a, b, tolerance)
+        if fields:
+            return _report(f"trade {i} of {len(expected['trades'])} differs, opened at {a.get('opentimestamp')}", fields)
+
+    if len(expected['trades']) != len(actual['trades']):
+        n = min(len(expected['trades']), len(actual['trades']))
+        extra = (expected if len(expected['trades']) > n else actual)['trades'][n]
+        which = 'golden' if len(expected['trades']) > n else 'actual'
+        return _report(f"{len(expected['trades'])} trades, {len(actual['trades'])} actual. First {which} only trade {n}:",
+            [(k, v, None) if which == 'golden' else (k, None, v) for k, v in flatten(plain(extra)).items()])
+
+    fields = diff_fields(expected['metrics'], actual['metrics'], tolerance)
+    if fields:
+        return _report("the ledgers agree, the metrics differ", fields)
+    return None
+
+def _report(title, fields):
+    width = max([len('field')] + [len(k) for k, _, _ in fields])
+    lines = [title, f"  {'field':<{width}}  {'golden':>24}  {'actual':>24}"]
+    lines += [f"  {k:<{width}}  {_show(e):>24}  {_show(a):>24}" for k, e, a in fields]
+    return '\n'.join(lines)
+
+def _show(value):
+    return '-' if value is None else repr(value)
@@ -0,0 +1,275 @@
+'''
+Order book snapshots in an append-only binary file, plus a keyframe index next to it
+
+A book is a sorted array of price levels in ticks with a signed size, bids positive and asks negative, so a level
+that flips side between snapshots is just a changed size. Every record stores only the levels that changed since
+the previous snapshot (size 0 removes a level). Every `keyframe` records the full book is written instead, and its
+(timestamp, offset) is appended to the index.
+
+<path>.bin   header  b'OBK1' | tick float64
+             record  kind 'K'|'D' | ts ms int64 | base price int64 | count uint32 | price code | size code
+                     | price deltas | sizes
+<path>.idx   (ts ms int64, offset int64) per keyframe
+
+Price deltas and sizes are stored in the narrowest integer type that fits each record.
+'''
+
+import os
+import mmap
+import time
+import struct
+import logging
+import numpy as np
+
+from src.utils.utils import get_logger
+
+logger = get_logger(logging.getLogger(__name__), 'logs/orderbook.log', logging.DEBUG)
+
+MAGIC = b'OBK1'
+FILE_HEADER = struct.Struct('<4sd')
+RECORD_HEADER = struct.Struct('<cqqIBB')
+INDEX_DTYPE = np.dtype([('ts', '<i8'), ('offset', '<i8')])
+DTYPES = [np.dtype(t) for t in ['<i1', '<i2', '<i4', '<i8', '<u1', '<u2', '<u4', '<u8']]
+
+def narrowest(values, unsigned = False):
+    if not len(values):
+        return 4 if unsigned else 0
+    lo, hi = int(values.min()), int(values.max())
+    for code, dtype in enumerate(DTYPES):
+        if (dtype.kind == 'u') != unsigned:
+            continue
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return code
+    raise ValueError(f"values out of range: {lo} {hi}")
+
+def apply_delta(prices, sizes, dprices, dsizes):
+    """Book after applying the changed levels of a record"""
+    merged = np.union1d(prices, dprices)
+    merged_sizes = np.zeros(len(merged), dtype = np.int64)
+    merged_sizes[np.searchsorted(merged, prices)] = sizes
+    merged_sizes[np.searchsorted(merged, dprices)] = dsizes
+    keep = merged_sizes != 0
+    return merged[keep], merged_sizes[keep]
+
+def diff_books(prices, sizes, new_prices, new_sizes):
+    """Levels that differ between two books, with their new size (0 for removed levels)"""
+    merged = np.union1d(prices, new_prices)
+    old = np.zeros(len(merged), dtype = np.int64)
+    new = np.zeros(len(merged), dtype = np.int64)
+    old[np.searchsorted(merged, prices)] = sizes
+    new[np.searchsorted(merged, new_prices)] = new_sizes
+    changed = old != new
+    return merged[changed], new[changed]
+
+def book_from_l2(levels, tick):
+    """Sorted (price ticks, signed sizes) from bybit's orderBook/L2 result"""
+    prices = np.array([round(float(l['price']) / tick) for l in levels], dtype = np.int64)
+    sizes = np.array([int(l['size']) if l['side'] == 'Buy' else -int(l['size']) for l in levels], dtype = np.int64)
+    order = np.argsort(prices, kind = 'stable')
+    return prices[order], sizes[order]
+
+def walk_book(prices, sizes, side, qty):
+    """Average price of a market order of `qty` contracts against a book, in ticks
+    :return: (average price, filled quantity), the fill is partial when the book runs out
+    """
+    if side == 'long':
+        levels = sizes < 0
+        p, s = prices[levels], -sizes[levels]
+    else:
+        levels = sizes > 0
+        p, s = prices[levels][::-1], sizes[levels][::-1]
+
+    if not len(p) or qty <= 0:
+        return None, 0
+
+    before = np.concatenate([[0], np.cumsum(s)[:-1]])
+    take = np.clip(qty - before, 0, s)
+    filled = take.sum()
+    return float((p * take).sum() / filled) if filled else None, float(filled)
+
+class OrderBookRecorder():
+    """Polls L2 snapshots into an append-only order book file"""
+
+    def __init__(self, path, tick = 0.5, keyframe = 100):
+        self.path = path
+        self.tick = tick
+        self.keyframe = keyframe
+
+        self.prices = np.zeros(0, dtype = np.int64)
+        self.sizes = np.zeros(0, dtype = np.int64)
+        self.since_keyframe = keyframe
+
+        new = not os.path.exists(f"{path}.bin") or not os.path.getsize(f"{path}.bin")
+        if not new:
+            self._repair()
+
+        self.data = open(f"{path}.bin", 'ab')
+        self.index = open(f"{path}.idx", 'ab')
+        if new:
+            self.data.write(FILE_HEADER.pack(MAGIC, tick))
+            self.data.flush()
+
+    def _repair(self):
+        """Cut both files back to their last complete record, the next snapshot starts with a keyframe"""
+        index = f"{self.path}.idx"
+        if os.path.exists(index):
+            # a torn entry would shift every entry appended after it
+            size = os.path.getsize(index)
+            os.truncate(index, size - size % INDEX_DTYPE.itemsize)
+
+        replay = OrderBookReplay(self.path)
+        # keyframes whose record didn't make it to the data file, and everything after them
+        complete = [replay._read(int(offset)) is not None for offset in replay.index['offset']]
+        keep = complete.index(False) if False in complete else len(complete)
+        replay.index = replay.index[:keep]
+        # a record torn by an interrupted write
+        self.tick, end = replay.tick, replay.end()
+        replay.close()
+
+        os.truncate(f"{self.path}.bin", end)
+        if os.path.exists(index):
+            os.truncate(index, keep * INDEX_DTYPE.itemsize)
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def record(self, ts_ms, prices, sizes):
+        """Append one snapshot, given as sorted price ticks and signed sizes"""
+        keyframe = self.since_keyframe >= self.keyframe
+        if keyframe:
+            dprices, dsizes = prices, sizes
+            self.since_keyframe = 0
+        else:
+            dprices, dsizes = diff_books(self.prices, self.sizes, prices, sizes)
+        self.since_keyframe += 1
+
+        base = int(dprices[0]) if len(dprices) else 0
+        deltas = np.diff(dprices, prepend = base)
+        pcode, scode = narrowest(deltas, unsigned = True), narrowest(dsizes)
+
+        offset = self.data.tell()
+        self.data.write(RECORD_HEADER.pack(b'K' if keyframe else b'D', int(ts_ms), base, len(dprices), pcode, scode))
+        self.data.write(deltas.astype(DTYPES[pcode]).tobytes())
+        self.data.write(dsizes.astype(DTYPES[scode]).tobytes())
+        self.data.flush()
+
+        # the index only ever points at data that is already written
+        if keyframe:
+            self.index.write(np.array([(int(ts_ms), offset)], dtype = INDEX_DTYPE).tobytes())
+            self.index.flush()
+
+        self.prices, self.sizes = prices, sizes
+
+    def record_l2(self, ts_ms, levels):
+        self.record(ts_ms, *book_from_l2(levels, self.tick))
+
+    def poll(self, bybit, symbol = None, interval = 1.0, duration = None):
+        """Record bybit.get_orderbook_http every `interval` seconds, for `duration` seconds or forever"""
+        end = time.time() + duration if duration else None
+        while end is None or time.time() < end:
+            tic = time.time()
+            try:
+                resp = bybit.get_orderbook_http(symbol)
+                if isinstance(resp, dict) and resp.get('result'):
+                    self.record_l2(int(float(resp.get('time_now', tic)) * 1000), resp['result'])
+            except Exception as e:
+                logger.error(f"poll: {e}")
+            time.sleep(max(0, interval - (time.time() - tic)))
+
+class OrderBookReplay():
+    """Reads an order book file back: seek to any timestamp through the keyframe index, or replay in order"""
+
+    def __init__(self, path):
+        with open(f"{path}.bin", 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+        magic, self.tick = FILE_HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path}.bin is not an order book file")
+
+        self.index = np.fromfile(f"{path}.idx", dtype = INDEX_DTYPE) if os.path.exists(f"{path}.idx") else np.zeros(0, dtype = INDEX_DTYPE)
+
+    def close(self):
+        self.buffer.close()
+
+    def end(self):
+        """Offset just past the last complete record"""
+        offset = int(self.index['offset'][-1]) if len(self.index) else FILE_HEADER.size
+        while True:
+            record = self._read(offset)
+            if record is None:
+                return offset
+            offset = record[-1]
+
+    def _read(self, offset):
+        """Decode the record at offset: (kind, ts, price ticks, sizes, next offset), None past the end or on a torn write"""
+        if offset + RECORD_HEADER.size > len(self.buffer):
+            return None
+        kind, ts, base, count, pcode, scode = RECORD_HEADER.unpack_from(self.buffer, offset)
+        pos = offset + RECORD_HEADER.size
+        pbytes, sbytes = count * DTYPES[pcode].itemsize, count * DTYPES[scode].itemsize
+        if pos + pbytes + sbytes > len(self.buffer):
+            return None
+
+        prices = np.cumsum(np.frombuffer(self.buffer, DTYPES[pcode], count, pos).astype(np.int64)) + base
+        sizes = np.frombuffer(self.buffer, DTYPES[scode], count, pos + pbytes).astype(np.int64)
+        return kind, ts, prices, sizes, pos + pbytes + sbytes
+
+    def replay(self, start_ms = None, end_ms = None):
+        """Yield (ts ms, price ticks, signed sizes) for every snapshot in [start_ms, end_ms)"""
+        offset = FILE_HEADER.size
+        if start_ms is not None and len(self.index):
+            i = np.searchsorted(self.index['ts'], start_ms, side = 'right') - 1
+            offset = int(self.index['offset'][max(i, 0)])
+
+        prices = sizes = np.zeros(0, dtype = np.int64)
+        while True:
+            record = self._read(offset)
+            if record is None:
+                return
+            kind, ts, dprices, dsizes, offset = record
+            if kind == b'K':
+                prices, sizes = dprices, dsizes
+            else:
+                prices, sizes = apply_delta(prices, sizes, dprices, dsizes)
+
+            if end_ms is not None and ts >= end_ms:
+                return
+            if start_ms is None or ts >= start_ms:
+                yield ts, prices, sizes
+
+    def book_at(self, ts_ms):
+        """Latest snapshot at or before ts_ms as (ts ms, price ticks, signed sizes), O(log n) through the index"""
+        if not len(self.index) or ts_ms < self.index['ts'][0]:
+            return None
+        i = np.searchsorted(self.index['ts'], ts_ms, side = 'right') - 1
+        offset = int(self.index['offset'][i])
+
+        book = None
+        prices = sizes = np.zeros(0, dtype = np.int64)
+        while True:
+            record = self._read(offset)
+            if record is None or record[1] > ts_ms:
+                return book
+            kind, ts, dprices, dsizes, offset = record
+            if kind == b'K':
+                prices, sizes = dprices, dsizes
+            else:
+                prices, sizes = apply_delta(prices, sizes, dprices, dsizes)
+            book = (ts, prices, sizes)
+
+    def impact(self, ts, side, qty):
+        """Price a market order of `qty` contracts would move away from the touch at `ts` (seconds), in price units
+        Positive for buys, negative for sells, 0 without a recorded book.
+        """
+        book = self.book_at(int(ts * 1000)) if ts is not None else None
+        if book is None:
+            return 0
+        _, prices, sizes = book
+        average, filled = walk_book(prices, sizes, side, qty)
+        if average is None:
+            return 0
+
+        touch = prices[sizes < 0].min() if side == 'long' else prices[sizes > 0].max()
+        return (average - touch) * self.tick
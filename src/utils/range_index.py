@@ -0,0 +1,56 @@
+'''
+First bar from a given one whose High or Low reaches a price, without visiting the bars in between
+
+Level k of an index holds the maximum of every aligned block of 2**k bars, lows are kept negated so both sides are
+maxima. A search from a bar climbs to the largest aligned block that starts there, skips the blocks that stay short of
+the price and descends into the first one that doesn't: O(log n) per search, 2n values per column, built with one
+numpy reduction per level.
+'''
+
+import numpy as np
+
+def _levels(values):
+    levels = [np.asarray(values, dtype = float)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        if len(level) % 2:
+            level = np.append(level, -np.inf)
+        # fmax ignores a missing bar like the bar by bar comparison does
+        levels.append(np.fmax(level[0::2], level[1::2]))
+    return levels
+
+def _first(levels, start, price):
+    n = len(levels[0])
+    position, k = start, 0
+    while position < n:
+        if levels[k][position >> k] >= price:
+            if not k:
+                return position
+            k -= 1
+        else:
+            position += 1 << k
+            while k + 1 < len(levels) and not position & (2 << k) - 1:
+                k += 1
+    return n
+
+class RangeIndex():
+    """Block maxima of High and minima of Low of a table of klines
+
+    :param high: High per bar
+    :param low: Low per bar
+    """
+
+    def __init__(self, high, low):
+        self.highs = _levels(high)
+        self.lows = _levels(-np.asarray(low, dtype = float))
+
+    def __len__(self):
+        return len(self.highs[0])
+
+    def first_above(self, start, price):
+        """Position of the first bar from start with a High at or above price, len(self) if there is none"""
+        return _first(self.highs, start, price)
+
+    def first_below(self, start, price):
+        """Position of the first bar from start with a Low at or below price, len(self) if there is none"""
+        return _first(self.lows, start, -price)
@@ -0,0 +1,103 @@
+import os
+import json
+import glob
+import time
+import hashlib
+import logging
+
+from src.utils.constants import PATH_RESULT_CACHE, ENGINE_VERSION
+from src.utils.utils import get_logger
+
+logger = get_logger(logging.getLogger(__name__), 'logs/result-cache.log', logging.DEBUG)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# modules whose code decides the outcome of a backtest, a change to any of them invalidates the cache: everything in
+# src/account, src/engine and src/utils but the modules that only download data (fingerprinted on its own) or store,
+# compare and show results
+RESULT_SOURCES = ['src/account/*.py', 'src/engine/*.py', 'src/utils/*.py']
+NOT_RESULT_SOURCES = ['src/engine/bybit_rest.py', 'src/engine/bybit_async.py', 'src/engine/golden.py', 'src/utils/chart.py',
+    'src/utils/checkpoint.py', 'src/utils/kline_sync.py', 'src/utils/ledger_diff.py', 'src/utils/result_cache.py', 'src/utils/run_registry.py']
+
+def result_sources():
+    """Files engine_version hashes, relative to the repository"""
+    files = {os.path.relpath(f, ROOT) for pattern in RESULT_SOURCES for f in glob.glob(os.path.join(ROOT, pattern))}
+    return sorted(files - set(NOT_RESULT_SOURCES))
+
+def engine_version():
+    digest = hashlib.sha1(str(ENGINE_VERSION).encode('utf-8'))
+    for filename in result_sources():
+        with open(os.path.join(ROOT, filename), 'rb') as f:
+            digest.update(f.read())
+    return f"{ENGINE_VERSION}-{digest.hexdigest()[:12]}"
+
+def canonical(obj):
+    return json.dumps(obj, sort_keys = True, separators = (',', ':'), default = _plain)
+
+def _plain(o):
+    # numpy scalars from the kline frames
+    return o.item() if hasattr(o, 'item') else str(o)
+
+class ResultCache():
+    """Backtest results on disk, one json file per key
+
+    The key is a hash of everything that decides a result: the strategy dict, symbol, date range, a fingerprint of
+    the kline data in that range and the engine version. Entries are written atomically, so a crashed run never
+    leaves a half written result behind.
+    """
+
+    def __init__(self, path = PATH_RESULT_CACHE):
+        self.path = path
+        os.makedirs(self.path, exist_ok = True)
+
+    @staticmethod
+    def key(strategy, symbol, start_ts, end_ts, fingerprint, version = None):
+        params = {
+            "strategy": strategy,
+            "symbol": symbol,
+            "start": start_ts,
+            "end": end_ts,
+            "data": fingerprint,
+            "engine": version if version else engine_version()
+        }
+        return hashlib.sha256(canonical(params).encode('utf-8')).hexdigest(), params
+
+    def get(self, key):
+        try:
+            with open(self._file(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return None
+
+    def put(self, key, params, result, metrics, trades):
+        entry = {
+            "key": key,
+            "params": params,
+            "created": int(time.time()),
+            "result": result,
+            "metrics": metrics,
+            "trades": trades
+        }
+        tmp = self._file(key) + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(entry, default = _plain))
+        os.replace(tmp, self._file(key))
+        logger.info(f"stored {key}: {result}")
+        return entry
+
+    def invalidate(self, key):
+        try:
+            os.remove(self._file(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def clear(self):
+        """Drop every cached result, i.e. after changing how data is downloaded or cleaned"""
+        files = glob.glob(os.path.join(self.path, '*.json'))
+        for filename in files:
+            os.remove(filename)
+        return len(files)
+
+    def _file(self, key):
+        return os.path.join(self.path, f"{key}.json")
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+from src.utils.constants import PATH_RUN_REGISTRY
+from src.utils.result_cache import canonical, engine_version
+from src.utils.utils import get_logger
+
+logger = get_logger(logging.getLogger(__name__), 'logs/run-registry.log', logging.DEBUG)
+
+# getMetrics() keys stored as indexed columns, the only ones runs can be ranked by
+METRICS = ['trades', 'strikerate', 'balance', 'growth', 'maxdrawdown', 'won', 'lost', 'even']
+
+SCHEMA = f'''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    created INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    symbol TEXT,
+    start_ts INTEGER NOT NULL,
+    end_ts INTEGER NOT NULL,
+    strategy TEXT NOT NULL,
+    strategy_hash TEXT NOT NULL,
+    fingerprint TEXT,
+    engine TEXT NOT NULL,
+    trades INTEGER, strikerate REAL, balance REAL, growth REAL, maxdrawdown REAL, won INTEGER, lost INTEGER, even INTEGER
+);
+CREATE TABLE IF NOT EXISTS trades (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    seq INTEGER NOT NULL,
+    side TEXT,
+    opentimestamp INTEGER,
+    closetimestamp INTEGER,
+    entry REAL,
+    exit REAL,
+    size REAL,
+    profit REAL,
+    percent REAL,
+    balance REAL,
+    stopped INTEGER,
+    trade TEXT NOT NULL,
+    PRIMARY KEY (run_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS runs_strategy ON runs(strategy_hash);
+CREATE INDEX IF NOT EXISTS runs_created ON runs(created);
+{''.join(f"CREATE INDEX IF NOT EXISTS runs_{m} ON runs({m});" for m in METRICS)}
+'''
+
+RUN_COLUMNS = ['created', 'kind', 'symbol', 'start_ts', 'end_ts', 'strategy', 'strategy_hash', 'fingerprint', 'engine'] + METRICS
+
+class RunRegistry():
+    """Every backtest run in a local sqlite database: strategy, range, data fingerprint, metrics and trade ledger
+
+    Runs are written in one transaction per record() call, so a sweep storing its runs in batches stays fast, and
+    ranked by any metric through the index on its column.
+    """
+
+    def __init__(self, path = PATH_RUN_REGISTRY):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.executescript(SCHEMA)
+        # set once per process, engine_version hashes the engine sources
+        self.engine = None
+
+    def close(self):
+        self.db.close()
+
+    def record(self, runs):
+        """Store runs in a single transaction
+        :param runs: dicts of strategy, symbol, start, end, metrics (getMetrics()), trades and optionally kind
+            ('backtest' by default) and fingerprint (of the kline data, see range_fingerprint)
+        :return: ids of the stored runs
+        """
+        if self.engine is None:
+            self.engine = engine_version()
+
+        now, ids = int(time.time()), []
+        with self.db:
+            for run in runs:
+                strategy = canonical(run['strategy'])
+                metrics = run['metrics']
+                row = [now, run.get('kind', 'backtest'), run.get('symbol'), int(run['start']), int(run['end']), strategy,
+                    hashlib.sha1(strategy.encode('utf-8')).hexdigest()[:16], run.get('fingerprint'), self.engine] + [metrics.get(m) for m in METRICS]
+                cursor = self.db.execute(f"INSERT INTO runs ({', '.join(RUN_COLUMNS)}) VALUES ({', '.join('?' * len(RUN_COLUMNS))})", row)
+                ids.append(cursor.lastrowid)
+                self.db.executemany('INSERT INTO trades VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    [self._trade_row(cursor.lastrowid, seq, trade) for seq, trade in enumerate(run.get('trades') or [])])
+
+        logger.info(f"recorded {len(ids)} runs")
+        return ids
+
+    @staticmethod
+    def _trade_row(run_id, seq, trade):
+        result = trade.get('result') or {}
+        return (run_id, seq, trade.get('side'), trade.get('opentimestamp'), trade.get('closetimestamp'), trade.get('entry'),
+            trade.get('exit'), trade.get('initialsize', trade.get('size')), result.get('profit'), result.get('percent'),
+            (result.get('balance') or {}).get('after'), int(bool(result.get('stopped'))), canonical(trade))
+
+    def top(self, metric = 'growth', limit = 20, ascending = False, kind = None, min_trades = None):
+        """Runs ranked by a metric column
+        :return: list of sqlite3.Row of the run columns, without strategy
+        """
+        if metric not in METRICS:
+            raise ValueError(f"rank by one of {', '.join(METRICS)}, not {metric}")
+        where, args = ["1"], []
+        if kind:
+            where.append("kind = ?")
+            args.append(kind)
+        if min_trades:
+            where.append("trades >= ?")
+            args.append(min_trades)
+
+        columns = ', '.join(c for c in ['id'] + RUN_COLUMNS if c != 'strategy')
+        return self.db.execute(f"SELECT {columns} FROM runs WHERE {' AND '.join(where)} AND {metric} IS NOT NULL "
+            f"ORDER BY {metric} {'ASC' if ascending else 'DESC'} LIMIT ?", args + [limit]).fetchall()
+
+    def run(self, run_id):
+        """A run with its strategy and trade ledger decoded, None if there is no such run"""
+        row = self.db.execute("SELECT * FROM runs WHERE id = ?", (run_id,)).fetchone()
+        if row is None:
+            return None
+        run = dict(row)
+        run['strategy'] = json.loads(run['strategy'])
+        run['trades'] = [json.loads(t[0]) for t in self.db.execute("SELECT trade FROM trades WHERE run_id = ? ORDER BY seq", (run_id,))]
+        return run
+
+    def delete(self, run_ids):
+        with self.db:
+            self.db.executemany("DELETE FROM runs WHERE id = ?", [(i,) for i in run_ids])
+
+    def count(self):
+        return self.db.execute("SELECT COUNT(*) FROM runs").fetchone()[0]
+
+def report(rows):
+    """Ranked runs as a text table"""
+    lines = [f"{'id':>6} {'kind':<9} {'range':<23} {'trades':>6} {'strike':>7} {'growth':>9} {'maxdd':>8} {'balance':>10}  strategy"]
+    for r in rows:
+        dates = f"{time.strftime('%Y-%m-%d', time.gmtime(r['start_ts']))} {time.strftime('%Y-%m-%d', time.gmtime(r['end_ts']))}"
+        lines.append(f"{r['id']:>6} {r['kind']:<9} {dates:<23} {r['trades']:>6} {r['strikerate']:>6.2f}% {r['growth']:>8.2f}% "
+            f"{r['maxdrawdown']:>7.2f}% {r['balance']:>10.6f}  {r['strategy_hash']}")
+    return '\n'.join(lines)
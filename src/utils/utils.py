@@ -3,6 +3,7 @@ import logging
 import dateparser
 import pytz
 from decimal import Decimal
+from threading import Thread
 from datetime import datetime
 from pandas import Series
 